@@ -0,0 +1,136 @@
+"""
+Runs whole ETL configs against the offline fake Drive/Sheets backend and
+reports throughput, per-stage latency and peak memory.
+
+    python -m benchmarks.bench_etl
+    python -m benchmarks.bench_etl --kind xlsx --files 20 --rows 5000
+    python -m benchmarks.bench_etl --latency 0.05 --workers 1 8
+
+Each run happens in a fresh process so peak RSS is measured per run.
+
+"""
+import argparse
+import os
+import statistics
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, cast
+
+import gspread
+import yaml
+
+from gskeleton.drive_etl import DriveETL
+from gskeleton.fakes import FakeDrive, FakeGspreadClient, generate_inputs
+
+
+def write_config(root: str, kind: str, workers: int) -> None:
+    config = {
+        "workers": workers,
+        "extractors": [
+            {
+                "name": "inputs",
+                "inputs": {"folder": {"key": "inputs"}, "extension": kind},
+                "tables": [{"name": "records", "sheet": {"name": "Data"}}],
+            }
+        ],
+        "transformers": [
+            {
+                "sql_command": """CREATE TABLE categories AS
+                    SELECT category, COUNT(*) AS n, SUM(amount) AS total
+                    FROM records GROUP BY category;"""
+            }
+        ],
+        "loaders": [
+            {
+                "name": "categories",
+                "extension": "xlsx",
+                "exports": {"key": "exports"},
+                "tables": [{"name": "categories"}],
+            }
+        ],
+    }
+    os.makedirs(os.path.join(root, "configs"), exist_ok=True)
+    with open(os.path.join(root, "configs", "etl.yaml"), "w") as stream:
+        yaml.safe_dump(config, stream)
+
+
+def run_scenario(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = os.path.join(tmp_dir, "drive")
+        generate_inputs(
+            root,
+            "inputs",
+            kind=scenario["kind"],
+            files=scenario["files"],
+            rows=scenario["rows"],
+            cols=scenario["cols"],
+        )
+        write_config(root, scenario["kind"], scenario["workers"])
+        work_dir = os.path.join(tmp_dir, "work")
+        os.makedirs(work_dir)
+        os.chdir(work_dir)
+        drive = FakeDrive(root, latency=scenario["latency"])
+        etl = DriveETL()
+        etl.drive = drive
+        # The fake implements only the Client methods DriveETL calls
+        etl.gspread_client = cast(
+            gspread.Client,
+            FakeGspreadClient(drive, latency=scenario["latency"]),
+        )
+        etl.run_etl_config(
+            "configs", from_folder=True, report_path="report.json"
+        )
+        return etl.metrics.report()
+
+
+def summarize(scenario: Dict[str, Any], report: Dict[str, Any]) -> None:
+    seconds = report["seconds"]
+    rows = sum(t["in"] for t in report["tables"].values())
+    print(
+        f"\n{scenario['kind']} files={scenario['files']} "
+        f"rows={scenario['rows']} cols={scenario['cols']} "
+        f"workers={scenario['workers']} latency={scenario['latency']}s"
+    )
+    print(f"  total:      {seconds:10.3f} s")
+    print(f"  throughput: {rows / seconds:10.0f} rows/s")
+    print(f"  throughput: {scenario['files'] / seconds:10.2f} files/s")
+    print(f"  peak RSS:   {report['peak_rss_bytes'] / 2**20:10.1f} MB")
+    stages: Dict[str, List[float]] = {}
+    for stage in report["stages"]:
+        stages.setdefault(stage["stage"], []).append(stage["seconds"])
+    print(f"  {'stage':<14}{'count':>6}{'total s':>10}{'p50 s':>10}"
+          f"{'max s':>10}")
+    for name, times in stages.items():
+        print(
+            f"  {name:<14}{len(times):>6}{sum(times):>10.3f}"
+            f"{statistics.median(times):>10.4f}{max(times):>10.4f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--kind", choices=["gsheet", "xlsx"], nargs="+")
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--cols", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    args = parser.parse_args()
+
+    for kind in args.kind or ["gsheet", "xlsx"]:
+        for workers in args.workers:
+            scenario = {
+                "kind": kind,
+                "files": args.files,
+                "rows": args.rows,
+                "cols": args.cols,
+                "latency": args.latency,
+                "workers": workers,
+            }
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                report = pool.submit(run_scenario, scenario).result()
+            summarize(scenario, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Times each SQL function over a synthetic table, next to the per-row
+implementations that _connect_to_db used to register.
+
+    python -m benchmarks.bench_udfs --rows 1000000
+
+"""
+import argparse
+import hashlib
+import re
+import sqlite3
+import time
+from typing import List, Tuple
+
+from gskeleton.udfs import register_udfs
+
+
+def legacy_int_hash(s: str) -> int:
+    return int(hashlib.sha256(s.encode("utf-8")).hexdigest(), 16) % 10 ** 12
+
+
+def legacy_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    conn.create_function("intHash", 1, legacy_int_hash)
+    conn.create_function(
+        "regexp", 2, lambda x, y: 1 if re.search(x, y) else 0
+    )
+    return conn
+
+
+def registry_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    register_udfs(conn)
+    return conn
+
+
+def fill(conn: sqlite3.Connection, rows: int) -> None:
+    conn.execute("CREATE TABLE t (id TEXT, name TEXT);")
+    conn.executemany(
+        "INSERT INTO t VALUES (?, ?);",
+        (
+            (f"id-{i}", f"user {i % 997} <u{i}@example.com>")
+            for i in range(rows)
+        ),
+    )
+    conn.commit()
+
+
+QUERIES: List[Tuple[str, str]] = [
+    ("intHash", "SELECT SUM(intHash(id) % 7) FROM t;"),
+    ("fastHash", "SELECT SUM(fastHash(id) % 7) FROM t;"),
+    ("regexp", "SELECT COUNT(*) FROM t WHERE name REGEXP '<u\\d+5@';"),
+    (
+        "regexp_extract",
+        "SELECT COUNT(DISTINCT regexp_extract(name, '@([\\w.]+)')) FROM t;",
+    ),
+    (
+        "regexp_replace",
+        "SELECT MAX(LENGTH(regexp_replace(name, '\\d', '#'))) FROM t;",
+    ),
+]
+
+
+def timed(conn: sqlite3.Connection, sql: str) -> float:
+    start = time.perf_counter()
+    conn.execute(sql).fetchall()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args()
+
+    legacy, registry = legacy_connection(), registry_connection()
+    for conn in [legacy, registry]:
+        fill(conn, args.rows)
+    print(f"rows: {args.rows}")
+    print(f"{'function':<16}{'legacy s':>10}{'registry s':>12}{'rows/s':>12}")
+    for name, sql in QUERIES:
+        try:
+            legacy_time = f"{timed(legacy, sql):10.3f}"
+        except sqlite3.OperationalError:
+            legacy_time = f"{'-':>10}"
+        seconds = timed(registry, sql)
+        print(
+            f"{name:<16}{legacy_time}{seconds:>12.3f}"
+            f"{args.rows / seconds:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares the full-sheet and the column-pruned xlsx extraction paths on a
+synthetic workbook.
+
+    python -m benchmarks.bench_xlsx_extract --rows 50000 --cols 40
+
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, List, Optional, Tuple
+
+import pandas as pd
+from openpyxl import Workbook
+
+from gskeleton.drive_etl import CellBox, DriveETL, Sheet
+
+
+def write_workbook(path: str, rows: int, cols: int) -> None:
+    wb = Workbook(write_only=True)
+    for title in ["Data", "Other"]:
+        ws = wb.create_sheet(title)
+        ws.append(["Exported report"])
+        ws.append([f"Column {c}" for c in range(cols)])
+        for r in range(rows):
+            ws.append([r * cols + c for c in range(cols)])
+    wb.save(path)
+
+
+def full_sheet(path: str, sheets: List[Sheet]) -> List[pd.DataFrame]:
+    etl = DriveETL()
+    dfs = []
+    with pd.ExcelFile(path) as excel:
+        for sheet in sheets:
+            df = excel.parse(
+                sheet_name=sheet.name,
+                header=None,
+                index_col=None,
+                keep_default_na=False,
+            )
+            dfs.append(etl._get_df_box(df, sheet.box))
+    return dfs
+
+
+def pruned(
+    path: str, sheets: List[Sheet], engine: Optional[str] = None
+) -> List[pd.DataFrame]:
+    with pd.ExcelFile(path, engine=engine) as excel:
+        return DriveETL()._get_xlsx_sheets(excel, sheets)
+
+
+def timed(
+    fn: Callable[[], List[pd.DataFrame]]
+) -> Tuple[float, List[pd.DataFrame]]:
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--cols", type=int, default=40)
+    parser.add_argument("--engine", default=None)
+    args = parser.parse_args()
+
+    sheets = [
+        Sheet(name="Data", box=CellBox(header_row=1, start_row=2, end_col=2)),
+        Sheet(
+            name="Data",
+            box=CellBox(header_row=1, start_row=2, start_col=3, end_col=5),
+        ),
+        Sheet(
+            name="Other",
+            box=CellBox(header_row=1, start_row=2, end_row=1002, end_col=3),
+        ),
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "synthetic.xlsx")
+        write_workbook(path, args.rows, args.cols)
+        size = os.path.getsize(path) / 2**20
+        print(f"workbook: {args.rows} rows x {args.cols} cols, {size:.1f} MB")
+        full_time, expected = timed(lambda: full_sheet(path, sheets))
+        pruned_time, actual = timed(lambda: pruned(path, sheets, args.engine))
+    for df, expected_df in zip(actual, expected):
+        pd.testing.assert_frame_equal(df, expected_df)
+    print(f"full sheet:    {full_time:8.2f} s")
+    print(f"column pruned: {pruned_time:8.2f} s")
+    print(f"speedup:       {full_time / pruned_time:8.2f} x")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,39 @@ Google Drive ETL library.
 __version__ = "0.1.0"
 __author__ = "John R"
 
-from .drive_etl import DriveETL
+from typing import TYPE_CHECKING, Any, Dict, Optional
 
+if TYPE_CHECKING:
+    from .drive_etl import DriveETL
 
-def authorize(secret_path: str) -> DriveETL:
-    etl = DriveETL()
+__all__ = ["DriveETL", "authorize"]
+
+
+def __getattr__(name: str) -> Any:
+    # drive_etl pulls in pandas and the Google clients, so it is only
+    # imported once DriveETL is first used
+    if name == "DriveETL":
+        from .drive_etl import DriveETL
+
+        globals()["DriveETL"] = DriveETL
+        return DriveETL
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def authorize(
+    secret_path: str,
+    cache_dir: Optional[str] = None,
+    cache_max_bytes: Optional[int] = None,
+    listing_ttl: Optional[float] = None,
+    rate_limits: Optional[Dict[str, float]] = None,
+) -> "DriveETL":
+    from .drive_etl import DriveETL
+
+    etl = DriveETL(
+        cache_dir=cache_dir,
+        cache_max_bytes=cache_max_bytes,
+        listing_ttl=listing_ttl,
+        rate_limits=rate_limits,
+    )
     etl.service_auth(secret_path)
     return etl
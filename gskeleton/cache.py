@@ -0,0 +1,88 @@
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def _digest(s: str) -> str:
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()[:20]
+
+
+class DownloadCache:
+    def __init__(self, directory: str, max_bytes: Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_path(self, key: str, version: str) -> str:
+        # Entries are named <key digest>-<version digest> so every cached
+        # version of a file can be found from its key alone.
+        name = f"{_digest(key)}-{_digest(version)}"
+        return os.path.join(self.directory, name)
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def get(self, key: str, version: str) -> Optional[str]:
+        path = self._entry_path(key, version)
+        with self._lock:
+            if not os.path.exists(path):
+                self.misses += 1
+                return None
+            self.hits += 1
+            # The modification time doubles as the LRU clock
+            os.utime(path)
+        return path
+
+    def put(
+        self, key: str, version: str, write: Callable[[str], None]
+    ) -> str:
+        path = self._entry_path(key, version)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            prefix = f"{_digest(key)}-"
+            for _, _, entry_path in self._entries():
+                name = os.path.basename(entry_path)
+                if name.startswith(prefix) and entry_path != path:
+                    os.remove(entry_path)
+            self._evict(keep=path)
+        return path
+
+    def _evict(self, keep: str) -> None:
+        if self.max_bytes is None:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._entries()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+            }
@@ -1,100 +1,254 @@
+import copy
+import csv
+import gzip
 import hashlib
+import io
+import json
+import logging
 import os
 import re
+import shutil
 import sqlite3
+import tempfile
+import threading
 import time
+import warnings
+from collections import deque
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextlib import closing
+from datetime import date
 from datetime import datetime as dt
+from datetime import time as day_time
+from pathlib import Path
 from sqlite3 import Error
-from typing import Dict, List, Optional, Union, ClassVar
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    get_args,
+)
 
 import gspread
+import httplib2
 import pandas as pd
 import yaml
+from googleapiclient.http import MediaFileUpload
 from oauth2client.service_account import ServiceAccountCredentials
-from pydantic import BaseModel
+from openpyxl.worksheet.worksheet import Worksheet
 from pydrive2.auth import GoogleAuth
 from pydrive2.drive import GoogleDrive
 
+from .cache import DownloadCache
+from .metrics import RunMetrics
+from .models import (
+    BULK_LOAD_PROFILE,
+    DEFAULT_PROFILE,
+    SPILL_PROFILE,
+    CellBox,
+    ColumnType,
+    Database,
+    ETLConfig,
+    Extractor,
+    Function,
+    GFile,
+    GFileSelector,
+    GFolder,
+    Loader,
+    Sheet,
+    SQLiteProfile,
+    Table,
+    TableIndex,
+    Transformer,
+)
+from .planner import TransformUnit, plan_units
+from .throttle import Scheduler
+from .udfs import (
+    FUNCTIONS,
+    UDF,
+    import_target,
+    intHash,
+    register_udfs,
+)
+from .uploads import md5_file, resumable_upload
 
-class GFile(BaseModel):
-    key: str
-    name: Optional[str] = None
 
+# The models and intHash were defined here before, and are still
+# importable from here
+__all__ = [
+    "DriveETL",
+    "BULK_LOAD_PROFILE",
+    "DEFAULT_PROFILE",
+    "SPILL_PROFILE",
+    "CellBox",
+    "ColumnType",
+    "Database",
+    "ETLConfig",
+    "Extractor",
+    "Function",
+    "GFile",
+    "GFileSelector",
+    "GFolder",
+    "Loader",
+    "Sheet",
+    "SQLiteProfile",
+    "Table",
+    "TableIndex",
+    "Transformer",
+    "intHash",
+]
 
-class GFolder(BaseModel):
-    key: str
-    name: Optional[str] = None
+logger = logging.getLogger(__name__)
 
+MANIFEST_TABLE = "_gskeleton_manifest"
+SOURCE_COLUMN = "_source_key"
+MODIFIED_COLUMN = "_source_modified"
+STAGE_PREFIX = "_gskeleton_stage_"
+SHARD_PREFIX = "_gskeleton_shard_"
+MEMO_TABLE = "_gskeleton_transform_memo"
+CREATE_AS_RE = re.compile(
+    r"\s*CREATE\s.*?\bAS\s+((?:SELECT|WITH|VALUES)\b.*)", re.I | re.S
+)
+PRAGMA_VALUES = {
+    "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+    "temp_store": {"DEFAULT", "FILE", "MEMORY"},
+}
+COLUMN_TYPES: List[str] = list(get_args(ColumnType))
+BOOL_VALUES = {
+    "true": True,
+    "t": True,
+    "yes": True,
+    "y": True,
+    "1": True,
+    "false": False,
+    "f": False,
+    "no": False,
+    "n": False,
+    "0": False,
+}
+MAX_COERCION_EXAMPLES = 5
+# The largest page Drive returns. Without maxResults a page has 100 files.
+LIST_PAGE_SIZE = 1000
+# Drive orderBy keys that can also bound a listing with maxResults
+SERVER_ORDER_BY = {"createdDate", "modifiedDate"}
+LIST_FIELDS = (
+    "items(id,title,mimeType,createdDate,modifiedDate,md5Checksum,"
+    "version,fileSize,quotaBytesUsed),nextPageToken"
+)
+# Stay well under SQLite's limit on host parameters per statement
+MAX_SQL_PARAMS = 500
+# SQLite's default limit on the terms of one compound SELECT
+MAX_COMPOUND_SELECT = 500
+# Resumable uploads send the file in chunks, which must be multiples of
+# 256 KiB
+UPLOAD_CHUNKSIZE = 8 * 1024 * 1024
+# Native spreadsheets have no fileSize, so each counts as this much input
+GSHEET_SIZE_ESTIMATE = 1024 * 1024
+# Rows per values update are capped at about this many bytes of JSON, the
+# request size Google recommends for the Sheets API
+GSHEET_PAYLOAD_BYTES = 2 * 1024 * 1024
+# Text values written to spreadsheets as booleans
+EXPORT_BOOLS = {
+    "TRUE": True,
+    "True": True,
+    "true": True,
+    "FALSE": False,
+    "False": False,
+    "false": False,
+}
 
-class GFileSelector(BaseModel):
-    folder: GFolder
-    top: Optional[int] = None
-    extension: Optional[str] = None
-    order_by: str = "modifiedDate"
-    desc: bool = False
-    # extension in ["title", "createdDate", "modifiedDate"]
-    # order_by in ["json", "gsheet", "xlsx", "yaml", "csv"]
+# md5Checksum, modifiedDate and the tables extracted from an input file
+FileFingerprint = Tuple[Optional[str], Optional[str], Tuple[str, ...]]
+# A downloaded xlsx path or the raw values of each table's worksheet
+FetchedFile = Union[None, str, List[pd.DataFrame]]
+T = TypeVar("T")
 
 
-class CellBox(BaseModel):
-    header_row: int = 0
-    start_row: int = 1
-    start_col: int = 0
-    end_row: Optional[int] = None
-    end_col: Optional[int] = None
+def _sql_value(value: Any) -> Any:
+    # Dates and times are bound as text the way pandas' to_sql stored
+    # them. sqlite3 can't bind times and its date adapters are deprecated.
+    if isinstance(value, dt):
+        return value.isoformat(" ")
+    elif isinstance(value, date):
+        return value.isoformat()
+    elif isinstance(value, day_time):
+        return value.strftime("%H:%M:%S.%f")
+    return value
 
 
-class Sheet(BaseModel):
-    index: int = 0
-    name: Optional[str] = None
-    box: CellBox = CellBox()
+def _export_bool(value: Any) -> Any:
+    return EXPORT_BOOLS.get(value, value) if isinstance(value, str) else value
 
 
-class Table(BaseModel):
-    name: str
-    sheet: Sheet = Sheet()
+def _sql_literal(value: Optional[str]) -> str:
+    if value is None:
+        return "NULL"
+    return "'" + value.replace("'", "''") + "'"
 
 
-class Extractor(BaseModel):
-    name: str
-    inputs: GFileSelector
-    tables: List[Table]
+def _json_default(value: Any) -> str:
+    return value.hex() if isinstance(value, bytes) else str(value)
 
 
-class Transformer(BaseModel):
-    sql_command: str
-
-
-class Loader(BaseModel):
-    name: str
-    suffix_type: Optional[str] = None  # Allowed values: ["unix", "timestamp"]
-    extension: str
-    template: Optional[GFile] = None
-    exports: GFolder
-    tables: List[Table]
-
-
-class Database(BaseModel):
-    key: str
-    update: bool = False
-
-
-class ETLConfig(BaseModel):
-    db: Optional[Database] = None
-    extractors: Optional[List[Extractor]] = None
-    transformers: Optional[List[Transformer]] = None
-    loaders: Optional[List[Loader]] = None
-
-
-def intHash(s: str) -> int:
-    return int(hashlib.sha256(s.encode("utf-8")).hexdigest(), 16) % 10 ** 12
+def _json_line(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, default=_json_default) + "\n"
 
 
 class DriveETL:
-    def __init__(self):
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        cache_max_bytes: Optional[int] = None,
+        on_report: Optional[Callable[[Dict[str, Any]], None]] = None,
+        listing_ttl: Optional[float] = None,
+        rate_limits: Optional[Dict[str, float]] = None,
+        work_dir: Optional[str] = None,
+    ):
+        # rate_limits caps the calls per second to the "drive" and "sheets"
+        # APIs. Retryable errors are retried with backoff either way.
+        # Downloads and exports without an absolute path go to work_dir.
         self.start_unix = str(int(time.time()))
+        self.on_report = on_report
+        self.metrics = RunMetrics()
+        self.listing_ttl = listing_ttl
+        self.work_dir = work_dir or ""
+        self._spill_path: Optional[str] = None
+        self.scheduler = Scheduler(
+            rate_limits, on_event=lambda name: self.metrics.incr(name)
+        )
+        self._listing_cache: Dict[
+            str, Tuple[float, List[Dict[str, Any]]]
+        ] = {}
+        self._listing_lock = threading.Lock()
+        # Column types inferred for each table during an extraction
+        self._inferred_types: Dict[str, Dict[str, str]] = {}
+        # Listings made during the current run. They are reused within the
+        # run whatever listing_ttl is, so the spill estimate and the
+        # extraction list each folder once.
+        self._run_listings: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._http_local = threading.local()
+        self.cache: Optional[DownloadCache] = None
+        if cache_dir:
+            self.cache = DownloadCache(cache_dir, cache_max_bytes)
         self.mime_types: ClassVar[Dict[str, str]] = {
             "json": "application/json",
+            "jsonl": "application/x-ndjson",
             "gsheet": "application/vnd.google-apps.spreadsheet",
             "xlsx": (
                 "application/"
@@ -106,7 +260,70 @@ class DriveETL:
         }
         self.config: Optional[ETLConfig] = None
 
-    def _select_files(self, fs: GFileSelector) -> List[GFile]:
+    def _get_listing(
+        self, param: Dict[str, Any], limit: Optional[int]
+    ) -> List[Dict[str, Any]]:
+        if limit is None:
+            param = {"maxResults": LIST_PAGE_SIZE, **param}
+        cache_key = json.dumps(param, sort_keys=True)
+        with self._listing_lock:
+            run_listings = self._run_listings
+            listed = None
+            if run_listings is not None:
+                listed = run_listings.get(cache_key)
+        if listed is not None:
+            self.metrics.incr("drive.list_cached")
+            return list(listed)
+        if self.listing_ttl:
+            with self._listing_lock:
+                cached = self._listing_cache.get(cache_key)
+            if cached and time.monotonic() - cached[0] < self.listing_ttl:
+                self.metrics.incr("drive.list_cached")
+                return list(cached[1])
+        # Pages are fetched one call at a time, so a retry repeats only the
+        # failed page, and paging stops once enough files arrived
+        pages = iter(self.drive.ListFile(param))
+        self.metrics.incr("drive.list")
+        files: List[Dict[str, Any]] = []
+        while not limit or len(files) < limit:
+            page = self._call("drive", next, pages, None)
+            if page is None:
+                break
+            files.extend(page)
+        with self._listing_lock:
+            if run_listings is not None:
+                run_listings[cache_key] = files
+            if self.listing_ttl:
+                self._listing_cache[cache_key] = (time.monotonic(), files)
+        return list(files)
+
+    def _work_path(self, filename: str) -> str:
+        return os.path.join(self.work_dir, filename)
+
+    def _call(
+        self, api: str, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        return self.scheduler.call(api, func, *args, **kwargs)
+
+    def _call_nonidempotent(
+        self, api: str, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        return self.scheduler.call_nonidempotent(api, func, *args, **kwargs)
+
+    def _invalidate_listings(self, folder_key: Optional[str] = None) -> None:
+        with self._listing_lock:
+            caches: List[Dict[str, Any]] = [
+                self._listing_cache,
+                self._run_listings or {},
+            ]
+            for cache in caches:
+                for cache_key in list(cache):
+                    if folder_key is None or (
+                        f"'{folder_key}' in parents" in cache_key
+                    ):
+                        del cache[cache_key]
+
+    def _list_files(self, fs: GFileSelector) -> List[Dict[str, Any]]:
         def extension_match(file: Dict):
             match = True
             if fs.extension:
@@ -115,24 +332,67 @@ class DriveETL:
                     match = file.get("mimeType") == mime_type
             return match
 
-        query = {"q": f"'{fs.folder.key}' in parents and trashed=false"}
-        list_file = self.drive.ListFile(query)
-        files = list_file.GetList()
+        # Filtering, ordering and top are pushed into the Drive query when
+        # Drive supports them. The local pass below keeps the result exact.
+        query = f"'{fs.folder.key}' in parents and trashed=false"
+        mime_type = self.mime_types.get(fs.extension or "")
+        if mime_type:
+            query += f" and mimeType='{mime_type}'"
+        param: Dict[str, Any] = {"q": query, "fields": LIST_FIELDS}
+        limit = None
+        if fs.order_by in SERVER_ORDER_BY:
+            desc = " desc" if fs.desc else ""
+            param["orderBy"] = f"{fs.order_by}{desc}"
+            if fs.top:
+                param["maxResults"] = limit = fs.top
+        files = self._get_listing(param, limit)
         filtered = filter(extension_match, files)
         sorted_files = sorted(
             filtered, key=(lambda x: x[fs.order_by]), reverse=fs.desc
         )
-        return_files = [GFile(key=f["id"]) for f in sorted_files]
         if fs.top:
-            return_files = return_files[: fs.top]
-        return return_files
+            sorted_files = sorted_files[: fs.top]
+        return sorted_files
+
+    def _select_files(self, fs: GFileSelector) -> List[GFile]:
+        return [GFile(key=f["id"]) for f in self._list_files(fs)]
 
-    def _download_drive_file(self, file: GFile) -> str:
+    def _download_drive_file(
+        self, file: GFile, path: Optional[str] = None
+    ) -> str:
         f = self.drive.CreateFile({"id": file.key})
-        f.FetchMetadata(fetch_all=True)
-        path = f.metadata["title"]
-        f.GetContentFile(path)
-        return path
+        self.metrics.incr("drive.metadata")
+
+        def download(download_path: str) -> None:
+            self._call("drive", f.GetContentFile, download_path)
+            self.metrics.incr("drive.download")
+            size = int(f.metadata.get("fileSize", 0))
+            self.metrics.incr("bytes_downloaded", size)
+
+        if self.cache is None:
+            self._call("drive", f.FetchMetadata, fetch_all=True)
+            path = path or self._work_path(f.metadata["title"])
+            download(path)
+            return path
+        # Only the metadata is fetched on a cache hit. Callers that modify
+        # the file must pass a path so they work on a copy of the entry.
+        self._call(
+            "drive",
+            f.FetchMetadata,
+            fields="md5Checksum,version,modifiedDate,fileSize",
+        )
+        metadata = f.metadata
+        version = metadata.get("md5Checksum") or metadata.get(
+            "version", metadata["modifiedDate"]
+        )
+        version = str(version)
+        cached_path = self.cache.get(file.key, version)
+        if cached_path is None:
+            cached_path = self.cache.put(file.key, version, download)
+        if path:
+            shutil.copyfile(cached_path, path)
+            return path
+        return cached_path
 
     def service_auth(self, secret_path: str) -> None:
         self.gspread_client = gspread.service_account(filename=secret_path)
@@ -181,31 +441,133 @@ class DriveETL:
     def _get_workbook_sheet(
         self, workbook: gspread.Spreadsheet, sheet: Sheet
     ) -> pd.DataFrame:
-        worksheet = None
-        if sheet.name:
-            worksheet = workbook.worksheet(sheet.name)
-        else:
-            worksheet = workbook.get_worksheet(sheet.index)
-        if not worksheet:
-            val_err = f"Worksheet cannot be found at {sheet} in {workbook.id}"
-            raise ValueError(val_err)
-        df = pd.DataFrame(worksheet.get_all_values())
+        df = self._get_workbook_values(workbook, [sheet])[0]
         return self._get_df_box(df, sheet.box)
 
+    def _get_col_letters(self, index: int) -> str:
+        letters = ""
+        index += 1
+        while index:
+            index, remainder = divmod(index - 1, 26)
+            letters = chr(ord("A") + remainder) + letters
+        return letters
+
+    def _get_box_range(
+        self, worksheet: gspread.Worksheet, box: CellBox
+    ) -> Tuple[str, int]:
+        # Returns the A1 range covering the box's header and data rows
+        # along with the first sheet row it includes.
+        first_row = min(box.header_row, box.start_row)
+        end_col = box.end_col if box.end_col else worksheet.col_count - 1
+        start = f"{self._get_col_letters(box.start_col)}{first_row + 1}"
+        end = self._get_col_letters(max(end_col, box.start_col))
+        if box.end_row is not None and box.end_row >= 0:
+            end += str(max(box.end_row, box.header_row + 1, first_row + 1))
+        title = worksheet.title.replace("'", "''")
+        return f"'{title}'!{start}:{end}", first_row
+
+    def _get_workbook_values(
+        self, workbook: gspread.Spreadsheet, sheets: List[Sheet]
+    ) -> List[pd.DataFrame]:
+        # Fetches only the cells inside each sheet's box, with one request
+        # for all sheets. The frames are padded back to sheet coordinates
+        # so _get_df_box slices them exactly like full worksheet values.
+        worksheets = self._call("sheets", workbook.worksheets)
+        self.metrics.incr("sheets.metadata")
+        ranges = []
+        offsets = []
+        for sheet in sheets:
+            worksheet = None
+            if sheet.name:
+                matches = [ws for ws in worksheets if ws.title == sheet.name]
+                worksheet = matches[0] if matches else None
+            elif 0 <= sheet.index < len(worksheets):
+                worksheet = worksheets[sheet.index]
+            if not worksheet:
+                val_err = (
+                    f"Worksheet cannot be found at {sheet} in {workbook.id}"
+                )
+                raise ValueError(val_err)
+            a1_range, first_row = self._get_box_range(worksheet, sheet.box)
+            ranges.append(a1_range)
+            offsets.append((first_row, sheet.box.start_col))
+        response = self._call("sheets", workbook.values_batch_get, ranges)
+        self.metrics.incr("sheets.values")
+        dfs = []
+        for value_range, (first_row, first_col) in zip(
+            response.get("valueRanges", []), offsets
+        ):
+            values = value_range.get("values", [])
+            width = max((len(row) for row in values), default=0)
+            pad = [""] * first_col
+            rows = [[""] * (first_col + width)] * first_row
+            rows += [pad + row + [""] * (width - len(row)) for row in values]
+            dfs.append(pd.DataFrame(rows))
+        return dfs
+
     def _get_xlsx_sheet(
         self, excel: pd.ExcelFile, sheet: Sheet
     ) -> pd.DataFrame:
-        sheet_name = sheet.name
-        if not sheet_name:
-            sheet_name = excel.sheet_names[sheet.index]
-        df = excel.parse(
-            sheet_name=sheet_name,
-            header=None,
-            index_col=None,
-            keep_default_na=False,
+        return self._get_xlsx_sheets(excel, [sheet])[0]
+
+    def _get_xlsx_sheets(
+        self, excel: pd.ExcelFile, sheets: List[Sheet]
+    ) -> List[pd.DataFrame]:
+        # Each worksheet is parsed once, limited to the rows and columns
+        # covered by the boxes of all sheets that point at it.
+        groups: Dict[str, List[int]] = {}
+        for i, sheet in enumerate(sheets):
+            sheet_name = sheet.name or excel.sheet_names[sheet.index]
+            groups.setdefault(sheet_name, []).append(i)
+        dfs: List[pd.DataFrame] = [pd.DataFrame()] * len(sheets)
+        for sheet_name, indices in groups.items():
+            boxes = [sheets[i].box for i in indices]
+            first_row = min(min(b.header_row, b.start_row) for b in boxes)
+            first_col = min(b.start_col for b in boxes)
+            end_rows = [b.end_row for b in boxes]
+            nrows = None
+            if all(r is not None and r >= 0 for r in end_rows):
+                last_row = max(
+                    max(b.end_row or 0, b.header_row + 1) for b in boxes
+                )
+                nrows = max(last_row - first_row, 0)
+            end_cols = [b.end_col for b in boxes]
+            last_col = max(c for c in end_cols if c) if all(end_cols) else None
+
+            def use_col(x: int) -> bool:
+                start = first_col <= x
+                return (start and (x <= last_col)) if last_col else start
+
+            df = excel.parse(
+                sheet_name=sheet_name,
+                header=None,
+                index_col=None,
+                keep_default_na=False,
+                usecols=use_col,
+                skiprows=first_row,
+                nrows=nrows,
+            )
+            # Columns keep their sheet positions as labels, so padding the
+            # skipped ones back lets _get_df_box select by position.
+            width = max(df.columns, default=-1) + 1
+            df = df.reindex(columns=range(width), fill_value="")
+            df.index = df.index + first_row
+            for i in indices:
+                box = self._get_local_box(sheets[i].box, first_row)
+                dfs[i] = self._get_df_box(df, box)
+        return dfs
+
+    def _get_local_box(self, box: CellBox, first_row: int) -> CellBox:
+        end_row = box.end_row
+        if end_row is not None and end_row >= 0:
+            end_row = max(end_row - first_row, 0)
+        return box.model_copy(
+            update={
+                "header_row": box.header_row - first_row,
+                "start_row": box.start_row - first_row,
+                "end_row": end_row,
+            }
         )
-        box = self._get_df_box(df, sheet.box)
-        return box
 
     def _get_sql_col(self, column_name: str) -> str:
         first_line = column_name.split("\n")[0]
@@ -216,75 +578,888 @@ class DriveETL:
             raise ValueError(f"column name is invalid: {column_name}")
         return col
 
-    def _extract_tables(self, extractor: Extractor):
-        df_lists: Dict[str, List[pd.DataFrame]] = {
-            table.name: [] for table in extractor.tables
-        }
-        files = self._select_files(extractor.inputs)
-        for file in files:
-            print(file)
+    def _get_workers(self, extractor: Extractor) -> int:
+        if extractor.workers:
+            return extractor.workers
+        return self.config.workers if self.config else 1
+
+    def _fetch_file(
+        self, extractor: Extractor, file: GFile
+    ) -> FetchedFile:
+        labels = {"extractor": extractor.name, "file": file.key}
+        with self.metrics.stage("fetch", **labels):
             if extractor.inputs.extension == "gsheet":
-                wb = self.gspread_client.open_by_key(file.key)
-                for table in extractor.tables:
-                    df = self._get_workbook_sheet(wb, table.sheet)
-                    df.columns = [self._get_sql_col(c) for c in df.columns]
-                    df_lists[table.name].append(df)
+                wb = self._call(
+                    "sheets", self.gspread_client.open_by_key, file.key
+                )
+                self.metrics.incr("sheets.open")
+                sheets = [table.sheet for table in extractor.tables]
+                return self._get_workbook_values(wb, sheets)
             elif extractor.inputs.extension == "xlsx":
-                path = self._download_drive_file(file)
-                xl = pd.ExcelFile(path)
+                return self._download_drive_file(
+                    file, self._work_path(f"{file.key}.xlsx")
+                )
+            return None
+
+    def _parse_file(
+        self,
+        extractor: Extractor,
+        fetched: FetchedFile,
+    ) -> List[pd.DataFrame]:
+        dfs = []
+        if isinstance(fetched, str):
+            sheets = [table.sheet for table in extractor.tables]
+            with pd.ExcelFile(fetched, engine=extractor.engine) as xl:
+                dfs = self._get_xlsx_sheets(xl, sheets)
+        elif fetched is not None:
+            for table, values in zip(extractor.tables, fetched):
+                dfs.append(self._get_df_box(values, table.sheet.box))
+        for df in dfs:
+            df.columns = [self._get_sql_col(c) for c in df.columns]
+        return [
+            self._coerce_frame(table, df)
+            for table, df in zip(extractor.tables, dfs)
+        ]
+
+    def _coerce_series(self, series: pd.Series, column_type: str) -> pd.Series:
+        if column_type in ["int", "float"]:
+            numbers = pd.to_numeric(series, errors="coerce")
+            if column_type == "float":
+                return numbers.astype("float64")
+            whole = numbers.where(numbers.round() == numbers)
+            return whole.astype("Int64")
+        elif column_type == "bool":
+            text = series.astype(str).str.strip().str.lower()
+            return text.map(BOOL_VALUES).astype("boolean")
+        elif column_type == "date":
+            with warnings.catch_warnings():
+                # Raised when values don't share one format
+                warnings.simplefilter("ignore", UserWarning)
+                return pd.to_datetime(series, errors="coerce")
+        elif column_type == "text":
+            return series.where(series.isna(), series.astype(str))
+        raise ValueError(f"Unsupported column type: {column_type}")
+
+    def _infer_column_type(self, series: pd.Series) -> Optional[str]:
+        values = series[~self._is_blank(series)]
+        if values.empty:
+            return None
+        for column_type in COLUMN_TYPES[:-1]:
+            if self._coerce_series(values, column_type).notna().all():
+                return column_type
+        return "text"
+
+    def _is_blank(self, series: pd.Series) -> pd.Series:
+        text = series.astype(str).str.strip()
+        return series.isna() | (text == "")
+
+    def _coerce_frame(self, table: Table, df: pd.DataFrame) -> pd.DataFrame:
+        # Blank cells become NULL. Values that cannot be converted become
+        # NULL too, and are counted per column in the run report.
+        column_types: Dict[str, str] = {
+            self._get_sql_col(col): column_type
+            for col, column_type in table.column_types.items()
+        }
+        if not column_types and not table.infer_types:
+            return df
+        inferred = self._inferred_types.setdefault(table.name, {})
+        df = df.copy()
+        for i, col in enumerate(df.columns):
+            column_type = column_types.get(col)
+            if column_type is None and table.infer_types:
+                if col not in inferred:
+                    inferred_type = self._infer_column_type(df.iloc[:, i])
+                    if inferred_type:
+                        inferred[col] = inferred_type
+                column_type = inferred.get(col)
+                if column_type == "text":
+                    continue
+            if column_type is None:
+                continue
+            blank = self._is_blank(df.iloc[:, i])
+            values = df.iloc[:, i].mask(blank)
+            coerced = self._coerce_series(values, column_type)
+            failed = coerced.isna() & ~blank
+            if failed.any():
+                examples = values[failed].head(MAX_COERCION_EXAMPLES)
+                logger.warning(
+                    "%s.%s: %d values are not %s",
+                    table.name,
+                    col,
+                    failed.sum(),
+                    column_type,
+                )
+                self.metrics.add_coercion_failures(
+                    table.name,
+                    col,
+                    int(failed.sum()),
+                    [str(v) for v in examples],
+                )
+            df.isetitem(i, coerced)
+        return df
+
+    def _iter_fetched_files(
+        self, extractor: Extractor, files: List[GFile]
+    ) -> Generator[Tuple[GFile, FetchedFile], None, None]:
+        workers = self._get_workers(extractor)
+        if workers <= 1:
+            for file in files:
+                yield file, self._fetch_file(extractor, file)
+            return
+        # Results are yielded in submission order so that the tables come
+        # out exactly as they would from the sequential path. At most
+        # 2 * workers fetches are held in memory at any time.
+        remaining = iter(files)
+        pending: Deque[Tuple[GFile, "Future[FetchedFile]"]] = deque()
+        pool = ThreadPoolExecutor(max_workers=workers)
+
+        def submit_next() -> None:
+            file = next(remaining, None)
+            if file is not None:
+                future = pool.submit(self._fetch_file, extractor, file)
+                pending.append((file, future))
+
+        try:
+            for _ in range(2 * workers):
+                submit_next()
+            while pending:
+                file, future = pending.popleft()
+                fetched = future.result()
+                submit_next()
+                yield file, fetched
+        finally:
+            for _, future in pending:
+                future.cancel()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _extract_tables(self, extractor: Extractor):
+        for table in extractor.tables:
+            self._inferred_types.pop(table.name, None)
+        if extractor.sharded:
+            self._extract_tables_sharded(extractor)
+            return
+        elif extractor.incremental:
+            self._extract_tables_incremental(extractor)
+            return
+        # Rows are streamed into staging tables one file at a time and the
+        # staging tables replace the real ones once every file is read.
+        with self._db_conn:
+            if any(self._is_view(table.name) for table in extractor.tables):
+                self._reset_extractor(extractor)
+            for table in extractor.tables:
+                self._db_conn.execute(
+                    f'DROP TABLE IF EXISTS "{STAGE_PREFIX}{table.name}";'
+                )
+        files = self._select_files(extractor.inputs)
+        fetched_files = self._iter_fetched_files(extractor, files)
+        with closing(fetched_files):
+            for file, fetched in fetched_files:
+                logger.info("Extracting %s from %s", extractor.name, file.key)
+                with self.metrics.stage(
+                    "extract_file", extractor=extractor.name, file=file.key
+                ):
+                    dfs = self._parse_file(extractor, fetched)
+                    with self._db_conn:
+                        for table, df in zip(extractor.tables, dfs):
+                            stage_name = f"{STAGE_PREFIX}{table.name}"
+                            self._insert_frame(stage_name, df)
+                            self.metrics.add_rows(table.name, rows_in=len(df))
+        # The legacy rename leaves views over the real tables as they are.
+        # The default one checks them and fails, as their table is gone.
+        self._db_conn.execute("PRAGMA legacy_alter_table = ON;")
+        try:
+            with self._db_conn:
                 for table in extractor.tables:
-                    df = self._get_xlsx_sheet(xl, table.sheet)
-                    df.columns = [self._get_sql_col(c) for c in df.columns]
-                    df_lists[table.name].append(df)
+                    stage_name = f"{STAGE_PREFIX}{table.name}"
+                    self._drop_relation(table.name)
+                    if self._get_table_columns(stage_name):
+                        self._db_conn.execute(
+                            f'ALTER TABLE "{stage_name}" '
+                            f'RENAME TO "{table.name}";'
+                        )
+        finally:
+            self._db_conn.execute("PRAGMA legacy_alter_table = OFF;")
+
+    def _get_sql_type(self, series: pd.Series) -> str:
+        if pd.api.types.is_bool_dtype(series):
+            return "INTEGER"
+        elif pd.api.types.is_integer_dtype(series):
+            return "INTEGER"
+        elif pd.api.types.is_float_dtype(series):
+            return "REAL"
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            return "TIMESTAMP"
+        return "TEXT"
+
+    def _iter_frame_rows(
+        self, df: pd.DataFrame
+    ) -> Iterator[List[Tuple[Any, ...]]]:
+        chunksize = self.config.chunksize if self.config else 10000
+        for start in range(0, len(df), chunksize):
+            chunk = df.iloc[start : start + chunksize]
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for col, dtype in zip(chunk.columns, df.dtypes):
+                if pd.api.types.is_datetime64_any_dtype(dtype):
+                    chunk[col] = [
+                        None if v is None else v.isoformat(" ")
+                        for v in chunk[col]
+                    ]
+                elif dtype == object:
+                    chunk[col] = [_sql_value(v) for v in chunk[col]]
+            yield list(chunk.itertuples(index=False, name=None))
+
+    def _insert_frame(self, table_name: str, df: pd.DataFrame) -> None:
+        # The first frame defines the table. Columns first seen in a later
+        # frame are appended to the table, and columns that a frame lacks
+        # are left NULL for its rows.
+        existing = self._get_table_columns(table_name)
+        cursor = self._db_conn.cursor()
+        column_defs = [
+            f'"{col}" {self._get_sql_type(df[col])}'
+            for col in df.columns
+            if col not in existing
+        ]
+        if not existing:
+            cursor.execute(
+                f'CREATE TABLE "{table_name}" ({", ".join(column_defs)});'
+            )
+        else:
+            for column_def in column_defs:
+                cursor.execute(
+                    f'ALTER TABLE "{table_name}" ADD COLUMN {column_def};'
+                )
+        cols = ", ".join(f'"{col}"' for col in df.columns)
+        marks = ", ".join("?" * len(df.columns))
+        query = f'INSERT INTO "{table_name}" ({cols}) VALUES ({marks});'
+        for rows in self._iter_frame_rows(df):
+            cursor.executemany(query, rows)
+
+    def _get_table_columns(self, table_name: str) -> List[str]:
+        cursor = self._db_conn.cursor()
+        cursor.execute(f'PRAGMA table_info("{table_name}");')
+        return [row[1] for row in cursor.fetchall()]
+
+    def _get_relation_type(self, name: str) -> Optional[str]:
+        row = self._db_conn.execute(
+            "SELECT type FROM sqlite_master "
+            "WHERE type IN ('table', 'view') AND lower(name) = lower(?);",
+            (name,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _is_view(self, name: str) -> bool:
+        return self._get_relation_type(name) == "view"
+
+    def _drop_relation(self, name: str) -> None:
+        relation_type = self._get_relation_type(name)
+        if relation_type:
+            self._db_conn.execute(f'DROP {relation_type.upper()} "{name}";')
+
+    def _read_manifest(
+        self, extractor: Extractor
+    ) -> Dict[str, FileFingerprint]:
+        cursor = self._db_conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                extractor TEXT NOT NULL,
+                file_key TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                md5_checksum TEXT,
+                modified_date TEXT,
+                row_count INTEGER,
+                PRIMARY KEY (extractor, file_key, table_name)
+            );"""
+        )
+        cursor.execute(
+            f"""SELECT file_key, md5_checksum, modified_date, table_name
+                FROM {MANIFEST_TABLE} WHERE extractor = ?
+                ORDER BY file_key, table_name;""",
+            (extractor.name,),
+        )
+        manifest: Dict[str, FileFingerprint] = {}
+        for key, md5, modified, table_name in cursor.fetchall():
+            tables = manifest[key][2] if key in manifest else ()
+            manifest[key] = (md5, modified, tables + (table_name,))
+        return manifest
+
+    def _delete_source_rows(
+        self, extractor: Extractor, keys: List[str]
+    ) -> None:
+        cursor = self._db_conn.cursor()
+        for i in range(0, len(keys), MAX_SQL_PARAMS):
+            chunk = keys[i : i + MAX_SQL_PARAMS]
+            marks = ", ".join("?" * len(chunk))
+            for table in extractor.tables:
+                cursor.execute(
+                    f'DELETE FROM "{table.name}" '
+                    f"WHERE {SOURCE_COLUMN} IN ({marks});",
+                    chunk,
+                )
+            cursor.execute(
+                f"DELETE FROM {MANIFEST_TABLE} "
+                f"WHERE extractor = ? AND file_key IN ({marks});",
+                [extractor.name] + chunk,
+            )
+
+    def _get_shard_key(self, table_name: str, file_key: str) -> str:
+        # A hash of both parts, as either may contain the separator
+        key = json.dumps([table_name, file_key]).encode("utf-8")
+        return hashlib.blake2b(key, digest_size=8).hexdigest()
+
+    def _get_shard_name(self, table_name: str, file_key: str) -> str:
+        shard_key = self._get_shard_key(table_name, file_key)
+        return f"{SHARD_PREFIX}{table_name}_{shard_key}"
+
+    def _drop_shards(
+        self, extractor: Extractor, manifest: Dict[str, FileFingerprint]
+    ) -> None:
+        for key, (_, _, table_names) in manifest.items():
+            for table_name in table_names:
+                shard = self._get_shard_name(table_name, key)
+                self._db_conn.execute(f'DROP TABLE IF EXISTS "{shard}";')
+        keys = list(manifest)
+        for i in range(0, len(keys), MAX_SQL_PARAMS):
+            chunk = keys[i : i + MAX_SQL_PARAMS]
+            marks = ", ".join("?" * len(chunk))
+            self._db_conn.execute(
+                f"DELETE FROM {MANIFEST_TABLE} "
+                f"WHERE extractor = ? AND file_key IN ({marks});",
+                [extractor.name] + chunk,
+            )
+
+    def _reset_extractor(self, extractor: Extractor) -> None:
+        # Drops the extractor's tables or views, its shards and its manifest
+        self._drop_shards(extractor, self._read_manifest(extractor))
         for table in extractor.tables:
-            df = pd.concat(df_lists[table.name])
-            df.to_sql(
-                table.name, self._db_conn, if_exists="replace", index=False
+            self._drop_relation(table.name)
+        self._db_conn.execute(
+            f"DELETE FROM {MANIFEST_TABLE} WHERE extractor = ?;",
+            (extractor.name,),
+        )
+
+    def _union_all(self, selects: List[str]) -> str:
+        # Terms beyond SQLite's compound SELECT limit are nested in
+        # subqueries, each of which has its own limit
+        size = MAX_COMPOUND_SELECT
+        while len(selects) > size:
+            selects = [
+                f"SELECT * FROM ({' UNION ALL '.join(selects[i : i + size])})"
+                for i in range(0, len(selects), size)
+            ]
+        return " UNION ALL ".join(selects)
+
+    def _create_shard_view(
+        self, table: Table, listing: List[Dict[str, Any]]
+    ) -> None:
+        # Shards may have different columns, so each one selects the union
+        # of all their columns, with NULL for the ones it lacks. The source
+        # columns are literals, so SQLite skips the shards that a filter on
+        # them excludes without reading their rows.
+        shards = []
+        columns: List[str] = []
+        for file in listing:
+            shard = self._get_shard_name(table.name, file["id"])
+            shard_columns = self._get_table_columns(shard)
+            if shard_columns:
+                shards.append((file, shard, set(shard_columns)))
+                columns += [col for col in shard_columns if col not in columns]
+        self._drop_relation(table.name)
+        if not shards:
+            return
+        selects = []
+        for file, shard, present in shards:
+            values = [
+                f'"{col}"' if col in present else f'NULL AS "{col}"'
+                for col in columns
+            ]
+            values.append(f"{_sql_literal(file['id'])} AS {SOURCE_COLUMN}")
+            modified = _sql_literal(file.get("modifiedDate"))
+            values.append(f"{modified} AS {MODIFIED_COLUMN}")
+            selects.append(f'SELECT {", ".join(values)} FROM "{shard}"')
+        self._db_conn.execute(
+            f'CREATE VIEW "{table.name}" AS {self._union_all(selects)};'
+        )
+
+    def _extract_tables_sharded(self, extractor: Extractor) -> None:
+        # Each file's rows go to a shard table per extractor table, tagged
+        # with the file's key and modifiedDate through the view. Only new
+        # and changed files are fetched, and only their shards are written.
+        table_names = tuple(sorted(table.name for table in extractor.tables))
+        listing = self._list_files(extractor.inputs)
+        current = {
+            f["id"]: (f.get("md5Checksum"), f.get("modifiedDate"), table_names)
+            for f in listing
+        }
+        manifest = self._read_manifest(extractor)
+        views_ready = all(
+            self._is_view(table.name) for table in extractor.tables
+        )
+        with self._db_conn:
+            if not views_ready:
+                self._reset_extractor(extractor)
+                manifest = {}
+            changed = [
+                GFile(key=f["id"])
+                for f in listing
+                if manifest.get(f["id"]) != current[f["id"]]
+            ]
+            stale = {
+                key: fingerprint
+                for key, fingerprint in manifest.items()
+                if current.get(key) != fingerprint
+            }
+            self._drop_shards(extractor, stale)
+        fetched_files = self._iter_fetched_files(extractor, changed)
+        with closing(fetched_files):
+            for file, fetched in fetched_files:
+                logger.info("Extracting %s from %s", extractor.name, file.key)
+                with self.metrics.stage(
+                    "extract_file", extractor=extractor.name, file=file.key
+                ):
+                    self._insert_shards(
+                        extractor, file, fetched, current[file.key]
+                    )
+        with self._db_conn:
+            for table in extractor.tables:
+                self._create_shard_view(table, listing)
+        self.metrics.incr("extract.shards_written", len(changed))
+
+    def _insert_shards(
+        self,
+        extractor: Extractor,
+        file: GFile,
+        fetched: FetchedFile,
+        fingerprint: FileFingerprint,
+    ) -> None:
+        dfs = self._parse_file(extractor, fetched)
+        md5, modified, _ = fingerprint
+        manifest_rows = [
+            (extractor.name, file.key, table.name, md5, modified, len(df))
+            for table, df in zip(extractor.tables, dfs)
+        ]
+        with self._db_conn:
+            for table, df in zip(extractor.tables, dfs):
+                shard = self._get_shard_name(table.name, file.key)
+                self._insert_frame(shard, df)
+                shard_key = self._get_shard_key(table.name, file.key)
+                self._index_table(table, shard, f"_{shard_key}")
+                self.metrics.add_rows(table.name, rows_in=len(df))
+            self._db_conn.executemany(
+                f"INSERT INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, ?);",
+                manifest_rows,
+            )
+
+    def _extract_tables_incremental(self, extractor: Extractor) -> None:
+        # Only files whose md5Checksum/modifiedDate differ from the manifest
+        # are fetched. Their previous rows, and the rows of files that are
+        # no longer selected, are found through SOURCE_COLUMN and deleted.
+        table_names = tuple(sorted(table.name for table in extractor.tables))
+        listing = self._list_files(extractor.inputs)
+        current = {
+            f["id"]: (f.get("md5Checksum"), f.get("modifiedDate"), table_names)
+            for f in listing
+        }
+        manifest = self._read_manifest(extractor)
+        tables_ready = not any(
+            self._is_view(table.name) for table in extractor.tables
+        ) and all(
+            SOURCE_COLUMN in self._get_table_columns(table.name)
+            for table in extractor.tables
+        )
+        with self._db_conn:
+            if not tables_ready:
+                self._reset_extractor(extractor)
+                manifest = {}
+            changed = [
+                GFile(key=f["id"])
+                for f in listing
+                if manifest.get(f["id"]) != current[f["id"]]
+            ]
+            stale = [file.key for file in changed]
+            stale += [key for key in manifest if key not in current]
+            if tables_ready:
+                self._delete_source_rows(extractor, stale)
+        fetched_files = self._iter_fetched_files(extractor, changed)
+        with closing(fetched_files):
+            for file, fetched in fetched_files:
+                logger.info("Extracting %s from %s", extractor.name, file.key)
+                with self.metrics.stage(
+                    "extract_file", extractor=extractor.name, file=file.key
+                ):
+                    self._insert_incremental_file(
+                        extractor, file, fetched, current[file.key]
+                    )
+
+    def _insert_incremental_file(
+        self,
+        extractor: Extractor,
+        file: GFile,
+        fetched: FetchedFile,
+        fingerprint: FileFingerprint,
+    ) -> None:
+        dfs = self._parse_file(extractor, fetched)
+        md5, modified, _ = fingerprint
+        manifest_rows = []
+        for table, df in zip(extractor.tables, dfs):
+            df[SOURCE_COLUMN] = file.key
+            manifest_rows.append(
+                (extractor.name, file.key, table.name, md5, modified, len(df))
+            )
+        with self._db_conn:
+            for table, df in zip(extractor.tables, dfs):
+                self._insert_frame(table.name, df)
+                self.metrics.add_rows(table.name, rows_in=len(df))
+            self._db_conn.executemany(
+                f"INSERT INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, ?);",
+                manifest_rows,
+            )
+
+    def _index_table(
+        self, table: Table, target: str, suffix: str = ""
+    ) -> None:
+        for index in table.indexes:
+            cols = ", ".join(f'"{col}"' for col in index.columns)
+            name = index.name or "_".join(["ix", table.name] + index.columns)
+            unique = "UNIQUE " if index.unique else ""
+            self._db_conn.execute(
+                f'CREATE {unique}INDEX IF NOT EXISTS "{name}{suffix}" '
+                f'ON "{target}" ({cols});'
             )
 
+    def _create_indexes(self, extractor: Extractor) -> None:
+        # Shards are indexed as they are written, so a unique index only
+        # holds within each input file
+        if extractor.sharded:
+            return
+        with self._db_conn:
+            for table in extractor.tables:
+                if table.indexes and not self._get_table_columns(table.name):
+                    logger.warning("No table %s to index", table.name)
+                    continue
+                self._index_table(table, table.name)
+
+    def _get_db_profiles(self) -> Tuple[SQLiteProfile, SQLiteProfile]:
+        if self.config and self.config.db:
+            profile = self.config.db.profile
+            bulk_profile = self.config.db.bulk_profile or SQLiteProfile()
+        elif self._spill_path:
+            profile = SPILL_PROFILE
+            bulk_profile = BULK_LOAD_PROFILE.model_copy(
+                update=SPILL_PROFILE.model_dump(exclude_none=True)
+            )
+        else:
+            profile, bulk_profile = SQLiteProfile(), BULK_LOAD_PROFILE
+        return profile, bulk_profile
+
+    def _apply_profile(self, profile: SQLiteProfile) -> None:
+        self._db_conn.commit()
+        for pragma, value in profile.model_dump(exclude_none=True).items():
+            if pragma in PRAGMA_VALUES:
+                value = str(value).upper()
+                if value not in PRAGMA_VALUES[pragma]:
+                    raise ValueError(f"Invalid {pragma}: {value}")
+            else:
+                value = int(value)
+            self._db_conn.execute(f"PRAGMA {pragma} = {value};")
+
     def _run_extractors(self):
-        for extractor in self.config.extractors:
-            self._extract_tables(extractor)
-
-    def _connect_to_db(self):
-        conn_path = ":memory:"
-        if self.config.db and self.config.db.key:
-            db_file = GFile(**{"key": self.config.db.key})
-            conn_path = self._download_drive_file(db_file)
+        profile, bulk_profile = self._get_db_profiles()
+        self._apply_profile(bulk_profile)
+        try:
+            for extractor in self.config.extractors:
+                with self.metrics.stage("extractor", name=extractor.name):
+                    self._extract_tables(extractor)
+                    self._create_indexes(extractor)
+        finally:
+            restore = DEFAULT_PROFILE.model_dump(
+                include=set(bulk_profile.model_dump(exclude_none=True))
+            )
+            restore.update(profile.model_dump(exclude_none=True))
+            self._apply_profile(SQLiteProfile(**restore))
+
+    def _get_config_udfs(self) -> Dict[str, List[UDF]]:
+        udfs: Dict[str, List[UDF]] = {}
+        for function in self.config.functions if self.config else []:
+            udf = UDF(
+                function.narg,
+                import_target(function.target),
+                aggregate=function.aggregate,
+                deterministic=function.deterministic,
+            )
+            udfs.setdefault(function.name, []).append(udf)
+        return udfs
+
+    def _get_volatile_functions(self) -> Set[str]:
+        return {
+            name
+            for functions in [FUNCTIONS, self._get_config_udfs()]
+            for name, udfs in functions.items()
+            if any(not udf.deterministic for udf in udfs)
+        }
+
+    def _estimate_input_bytes(self, extractors: List[Extractor]) -> int:
+        total = 0
+        for extractor in extractors:
+            for file in self._list_files(extractor.inputs):
+                size = file.get("fileSize")
+                if size is None:
+                    total += GSHEET_SIZE_ESTIMATE
+                else:
+                    total += int(size)
+        return total
+
+    def _get_spill_path(self, config: ETLConfig) -> Optional[str]:
+        spill_bytes = config.spill_bytes
+        if spill_bytes is None:
+            return None
+        estimate = self._estimate_input_bytes(config.extractors or [])
+        if estimate < spill_bytes:
+            return None
+        fd, spill_path = tempfile.mkstemp(
+            prefix="gskeleton_", suffix=".db", dir=config.spill_dir
+        )
+        os.close(fd)
+        logger.info(
+            "Inputs are about %d bytes, using %s as the working DB",
+            estimate,
+            spill_path,
+        )
+        self.metrics.incr("db.spilled")
+        return spill_path
+
+    def _remove_spill_file(self, keep: bool) -> None:
+        if not self._spill_path:
+            return
+        if keep:
+            logger.warning("Kept working DB %s", self._spill_path)
+        else:
+            os.remove(self._spill_path)
+        self._spill_path = None
+
+    def _connect_to_db(self, conn_path: Optional[str] = None) -> None:
+        db = self.config.db if self.config else None
+        if conn_path is None and db and db.key:
+            db_file = GFile(**{"key": db.key})
+            conn_path = self._download_drive_file(
+                db_file, self._work_path(f"{db_file.key}.db")
+            )
             self._conn_path = conn_path
+        elif conn_path is None and self.config:
+            self._spill_path = self._get_spill_path(self.config)
+            conn_path = self._spill_path
+        conn_path = conn_path or ":memory:"
         try:
             self._db_conn = sqlite3.connect(conn_path)
-            self._db_conn.create_function("intHash", 1, intHash)
-            self._db_conn.create_function('regexp', 2, lambda x, y: 1 if re.search(x, y) else 0)
+            self._apply_profile(self._get_db_profiles()[0])
+            register_udfs(self._db_conn, self._get_config_udfs())
         except Error as e:
-            print(e)
+            logger.error("Cannot connect to %s: %s", conn_path, e)
 
     def _update_db_source(self):
         if self.config.db and self.config.db.update and self._conn_path:
-            self._update_file(self._conn_path, self.config.db.key)
+            with self.metrics.stage("upload_db"):
+                if self.config.db.vacuum:
+                    with closing(sqlite3.connect(self._conn_path)) as conn:
+                        conn.execute("VACUUM;")
+                self._update_file(self._conn_path, self.config.db.key)
 
     def _close_db(self):
         if self._db_conn:
             self._db_conn.close()
             del self._db_conn
 
+    def _get_sql_command(self, transformer: Transformer) -> str:
+        sql_command = transformer.sql_command.strip()
+        return sql_command[:-1] if sql_command[-1] == ";" else sql_command
+
+    def _fingerprint_table(self, table_name: str) -> Optional[str]:
+        columns = self._get_table_columns(table_name)
+        if not columns:
+            return None
+        digest = hashlib.blake2b(repr(columns).encode("utf-8"), digest_size=16)
+        chunksize = self.config.chunksize if self.config else 10000
+        cursor = self._db_conn.cursor()
+        cursor.execute(f'SELECT * FROM "{table_name}";')
+        for rows in iter(lambda: cursor.fetchmany(chunksize), []):
+            digest.update(repr(rows).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _get_fingerprints(
+        self, tables: Iterable[str], fingerprints: Dict[str, Optional[str]]
+    ) -> Dict[str, Optional[str]]:
+        for table in tables:
+            if table not in fingerprints:
+                fingerprints[table] = self._fingerprint_table(table)
+        return {table: fingerprints[table] for table in sorted(tables)}
+
+    def _get_transform_statements(self) -> List[str]:
+        transformers = self.config.transformers if self.config else None
+        return [self._get_sql_command(t) for t in transformers or []]
+
+    def _read_transform_memo(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        config = self.config
+        if not (config and config.db and config.memoize_transformers):
+            return None
+        with self._db_conn:
+            self._db_conn.execute(
+                f"""CREATE TABLE IF NOT EXISTS {MEMO_TABLE} (
+                    unit TEXT PRIMARY KEY,
+                    sql_hash TEXT,
+                    inputs TEXT,
+                    outputs TEXT
+                );"""
+            )
+        cursor = self._db_conn.cursor()
+        cursor.execute(f"SELECT * FROM {MEMO_TABLE};")
+        return {
+            unit: {
+                "sql_hash": sql_hash,
+                "inputs": json.loads(inputs),
+                "outputs": json.loads(outputs),
+            }
+            for unit, sql_hash, inputs, outputs in cursor.fetchall()
+        }
+
+    def _get_unit_hash(
+        self, unit: TransformUnit, statements: List[str]
+    ) -> str:
+        sql = "\n;\n".join(statements[i] for i in unit.statements)
+        return hashlib.blake2b(sql.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _is_unit_fresh(
+        self,
+        unit: TransformUnit,
+        statements: List[str],
+        memo: Dict[str, Dict[str, Any]],
+        inputs: Dict[str, Optional[str]],
+        fingerprints: Dict[str, Optional[str]],
+    ) -> bool:
+        entry = memo.get(unit.name)
+        if not entry or entry["inputs"] != inputs:
+            return False
+        if entry["sql_hash"] != self._get_unit_hash(unit, statements):
+            return False
+        outputs = self._get_fingerprints(unit.writes, fingerprints)
+        return None not in outputs.values() and entry["outputs"] == outputs
+
+    def _write_transform_memo(
+        self,
+        unit: TransformUnit,
+        statements: List[str],
+        inputs: Dict[str, Optional[str]],
+        fingerprints: Dict[str, Optional[str]],
+    ) -> None:
+        outputs = self._get_fingerprints(unit.writes, fingerprints)
+        with self._db_conn:
+            self._db_conn.execute(
+                f"INSERT OR REPLACE INTO {MEMO_TABLE} VALUES (?, ?, ?, ?);",
+                (
+                    unit.name,
+                    self._get_unit_hash(unit, statements),
+                    json.dumps(inputs),
+                    json.dumps(outputs),
+                ),
+            )
+
     def _run_transformers(self):
+        # Statements run in the configured order. A unit of statements
+        # writing the same tables is skipped when the fingerprints of the
+        # tables it reads and writes match those recorded when it last ran.
+        statements = self._get_transform_statements()
+        units = plan_units(statements, self._get_volatile_functions())
+        unit_of = {i: unit for unit in units for i in unit.statements}
+        memo = self._read_transform_memo()
+        fingerprints: Dict[str, Optional[str]] = {}
+        inputs: Dict[str, Dict[str, Optional[str]]] = {}
+        skipped: Set[str] = set()
         cursor = self._db_conn.cursor()
-        for transformer in self.config.transformers:
-            try:
-                sql_command = transformer.sql_command
-                sql_command = (
-                    sql_command[:-1] if sql_command[-1] == ";" else sql_command
+        for i, sql_command in enumerate(statements):
+            unit = unit_of[i]
+            first = i == unit.statements[0]
+            if first and memo is not None and unit.memoize:
+                inputs[unit.name] = self._get_fingerprints(
+                    unit.reads, fingerprints
                 )
-                print(transformer.sql_command)
-                cursor.execute(sql_command)
-                result = cursor.fetchall()
-                print(result)
+                if self._is_unit_fresh(
+                    unit, statements, memo, inputs[unit.name], fingerprints
+                ):
+                    logger.info("Skipping unchanged transformer %s", unit.name)
+                    skipped.add(unit.name)
+                    self.metrics.incr(
+                        "transformer.skipped", len(unit.statements)
+                    )
+            if unit.name in skipped:
+                continue
+            try:
+                logger.debug("Running transformer %d: %s", i, sql_command)
+                with self.metrics.stage("transformer", index=i):
+                    cursor.execute(sql_command)
+                    result = cursor.fetchall()
+                logger.debug("Transformer %d returned %d rows", i, len(result))
             except Error as e:
                 self._close_db()
                 raise Exception(e)
+            if not unit.writes:
+                fingerprints.clear()
+            for table in unit.writes:
+                fingerprints.pop(table, None)
+            if i == unit.statements[-1] and unit.name in inputs:
+                self._write_transform_memo(
+                    unit, statements, inputs[unit.name], fingerprints
+                )
+
+    def _explain_query_plan(self, sql_command: str) -> List[str]:
+        # The query of a CREATE ... AS statement can be explained even when
+        # the table it creates already exists
+        create_as = CREATE_AS_RE.match(sql_command)
+        if create_as:
+            sql_command = create_as.group(1)
+        cursor = self._db_conn.cursor()
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql_command}")
+            rows = cursor.fetchall()
+        except Error as e:
+            return [f"(no query plan: {e})"]
+        depth = {0: 0}
+        lines = []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, 0) + 1
+            lines.append("  " * (depth[node] - 1) + detail)
+        return lines
 
-    def _get_loader_filename(self, loader: Loader) -> str:
+    def _format_transform_plan(self) -> str:
+        statements = self._get_transform_statements()
+        units = plan_units(statements, self._get_volatile_functions())
+        memo = self._read_transform_memo()
+        fingerprints: Dict[str, Optional[str]] = {}
+        stale: Set[str] = set()
+        lines = []
+        for unit in units:
+            fresh = False
+            if memo is not None and unit.memoize:
+                if not stale.intersection(unit.upstream):
+                    fresh = self._is_unit_fresh(
+                        unit,
+                        statements,
+                        memo,
+                        self._get_fingerprints(unit.reads, fingerprints),
+                        fingerprints,
+                    )
+            if not fresh:
+                stale.add(unit.name)
+            status = "fresh" if fresh else "stale" if unit.memoize else "run"
+            reads = ", ".join(sorted(unit.reads)) or "-"
+            lines.append(f"[{status}] {unit.name} <- {reads}")
+            for i in unit.statements:
+                lines.append(f"  #{i} {' '.join(statements[i].split())}")
+                for line in self._explain_query_plan(statements[i]):
+                    lines.append(f"      {line}")
+        lines.insert(0, f"{len(stale)} of {len(units)} transformer steps run")
+        return "\n".join(lines)
+
+    def _get_loader_filename(
+        self, loader: Loader, table: Optional[Table] = None
+    ) -> str:
         suffix = ""
         if loader.suffix_type == "unix":
             suffix = self.start_unix
@@ -293,89 +1468,657 @@ class DriveETL:
             suffix = utc.strftime("%Y-%m-%dT%H:%M:%SZ")
         elif loader.suffix_type:
             raise ValueError(f"Invalid suffix type: {loader.suffix_type}")
-        filename = f"{loader.name}_{suffix}.{loader.extension}"
-        return filename
-
-    def _xlsx_load_sheet(self, sheet: Sheet, path: str, df: pd.DataFrame):
-        sheet_name = sheet.name
-        if not sheet_name:
-            xl = pd.ExcelFile(path)
-            sheet_name = xl.sheet_names[sheet.index]
-        of = pd.read_excel(path, sheet_name)
-        df.columns = of.columns
-        ef = pd.concat([of, df], ignore_index=True)
-        ef = ef.replace(
-            {
-                "TRUE": True,
-                "True": True,
-                "true": True,
-                "FALSE": False,
-                "False": False,
-                "false": False,
-            }
+        name = f"{loader.name}_{table.name}" if table else loader.name
+        filename = f"{name}_{suffix}.{loader.extension}"
+        if loader.compression == "gzip":
+            filename += ".gz"
+        elif loader.compression:
+            raise ValueError(f"Invalid compression: {loader.compression}")
+        return self._work_path(filename)
+
+    def _select_table(
+        self, table_name: str, conn: Optional[sqlite3.Connection] = None
+    ) -> sqlite3.Cursor:
+        cursor = (conn or self._db_conn).cursor()
+        cursor.execute(f'SELECT * FROM "{table_name}";')
+        return cursor
+
+    def _has_rows(
+        self, table_name: str, conn: Optional[sqlite3.Connection] = None
+    ) -> bool:
+        cursor = (conn or self._db_conn).execute(
+            f'SELECT 1 FROM "{table_name}" LIMIT 1;'
         )
-        ef.columns = [
-            re.split(r"\.\d+", c)[0] if "." in c else c for c in ef.columns
-        ]
-        writer_options = {
-            "engine": "openpyxl",
-            "mode": "a",
-            "if_sheet_exists": "replace",
-        }
+        return cursor.fetchone() is not None
+
+    def _iter_cursor_rows(
+        self, cursor: sqlite3.Cursor
+    ) -> Iterator[List[Any]]:
+        chunksize = self.config.chunksize if self.config else 10000
+        try:
+            for rows in iter(lambda: cursor.fetchmany(chunksize), []):
+                yield rows
+        finally:
+            cursor.close()
+
+    def _iter_table_chunks(
+        self,
+        table_name: str,
+        conn: Optional[sqlite3.Connection] = None,
+    ) -> Iterator[pd.DataFrame]:
+        # Streams a table in ETLConfig.chunksize row frames so exporters
+        # never hold more than one chunk of it in memory.
+        cursor = self._select_table(table_name, conn)
+        columns = [d[0] for d in cursor.description]
+        for rows in self._iter_cursor_rows(cursor):
+            yield pd.DataFrame(rows, columns=columns)
+
+    def _get_sheet_end_row(self, worksheet: Worksheet) -> int:
+        # max_row also counts formatted but empty rows at the bottom
+        for row in range(worksheet.max_row, 0, -1):
+            if any(cell.value is not None for cell in worksheet[row]):
+                return row
+        return 0
+
+    def _xlsx_load_sheets(
+        self,
+        tables: List[Table],
+        path: str,
+        conn: Optional[sqlite3.Connection] = None,
+    ) -> int:
+        # Rows are appended below each template sheet's existing content,
+        # one chunk at a time, and the workbook is saved once at the end.
+        # Without a template, a workbook needs at least one non-empty sheet.
+        writer_options: Dict[str, Any] = {"engine": "openpyxl", "mode": "w"}
+        if os.path.exists(path):
+            writer_options.update(mode="a", if_sheet_exists="overlay")
+        elif not any(self._has_rows(table.name, conn) for table in tables):
+            logger.info("Nothing to load into %s", path)
+            return 0
+        rows_written = 0
         with pd.ExcelWriter(path, **writer_options) as writer:
-            ef.to_excel(writer, sheet_name, index=False)
+            sheet_names = writer.book.sheetnames
+            for table in tables:
+                logger.info("Loading %s into %s", table.name, path)
+                sheet_name = table.sheet.name
+                if not sheet_name:
+                    sheet_name = (
+                        sheet_names[table.sheet.index]
+                        if sheet_names
+                        else table.name
+                    )
+                start_row = None
+                header = False
+                if sheet_name in writer.book.sheetnames:
+                    worksheet = writer.book[sheet_name]
+                    start_row = self._get_sheet_end_row(worksheet)
+                for df in self._iter_table_chunks(table.name, conn):
+                    if start_row is None:
+                        start_row, header = 0, True
+                    for i, dtype in enumerate(df.dtypes):
+                        if dtype == object:
+                            df.isetitem(i, df.iloc[:, i].map(_export_bool))
+                    df.to_excel(
+                        writer,
+                        sheet_name=sheet_name,
+                        startrow=start_row,
+                        header=header,
+                        index=False,
+                    )
+                    start_row += len(df) + int(header)
+                    header = False
+                    rows_written += len(df)
+                    self.metrics.add_rows(table.name, rows_out=len(df))
+        return rows_written
+
+    def _open_loader_spreadsheet(self, loader: Loader) -> gspread.Spreadsheet:
+        if loader.target:
+            spreadsheet = self._call(
+                "sheets", self.gspread_client.open_by_key, loader.target.key
+            )
+            self.metrics.incr("sheets.open")
+            return spreadsheet
+        filename = os.path.basename(self._get_loader_filename(loader))
+        title = os.path.splitext(filename)[0]
+        if loader.template:
+            spreadsheet = self._call_nonidempotent(
+                "sheets",
+                self.gspread_client.copy,
+                loader.template.key,
+                title=title,
+                folder_id=loader.exports.key,
+            )
+        else:
+            spreadsheet = self._call_nonidempotent(
+                "sheets",
+                self.gspread_client.create,
+                title,
+                folder_id=loader.exports.key,
+            )
+        self.metrics.incr("sheets.create")
+        self._invalidate_listings(loader.exports.key)
+        return spreadsheet
+
+    def _get_cell_value(self, value: Any) -> Any:
+        if value is None:
+            return ""
+        elif isinstance(value, bytes):
+            return value.hex()
+        return _export_bool(value)
+
+    def _iter_payload_chunks(
+        self, cursor: sqlite3.Cursor
+    ) -> Iterator[List[List[Any]]]:
+        chunk: List[List[Any]] = []
+        size = 0
+        for rows in self._iter_cursor_rows(cursor):
+            for row in rows:
+                values = [self._get_cell_value(value) for value in row]
+                row_size = len(json.dumps(values, ensure_ascii=False)) + 1
+                if chunk and size + row_size > GSHEET_PAYLOAD_BYTES:
+                    yield chunk
+                    chunk, size = [], 0
+                chunk.append(values)
+                size += row_size
+        if chunk:
+            yield chunk
 
-    def _load_tables(self, loader: Loader):
-        df_dict: Dict[str, pd.DataFrame] = {}
+    def _gsheet_load_sheets(
+        self, loader: Loader, conn: Optional[sqlite3.Connection] = None
+    ) -> int:
+        # Sheets are added, resized to fit and cleared from each box's
+        # header row down in one batch_update. Rows are then written in
+        # values updates of up to GSHEET_PAYLOAD_BYTES, and content above
+        # the header row, such as a template's title, is kept.
+        source = conn or self._db_conn
+        spreadsheet = self._open_loader_spreadsheet(loader)
+        worksheets = self._call("sheets", spreadsheet.worksheets)
+        next_id = max([ws.id for ws in worksheets] + [0]) + 1
+        requests: List[Dict[str, Any]] = []
+        targets = []
+        claimed: Set[str] = set()
         for table in loader.tables:
-            print(table.name)
-            query = f"SELECT * FROM {table.name};"
-            cursor = self._db_conn.cursor()
-            cursor.execute(query)
-            result = cursor.fetchall()
-            df = pd.DataFrame(result)
-            if len(df) > 0:
-                df.columns = next(zip(*cursor.description))
-                df_dict[table.name] = df
+            cursor = source.execute(f'SELECT COUNT(*) FROM "{table.name}";')
+            row_count = cursor.fetchone()[0]
+            cursor = source.execute(f'SELECT * FROM "{table.name}" LIMIT 0;')
+            columns = [d[0] for d in cursor.description]
+            box = table.sheet.box
+            data_row = max(box.start_row, box.header_row + 1)
+            grid = {
+                "rowCount": data_row + row_count,
+                "columnCount": box.start_col + len(columns),
+            }
+            # A table without a sheet name goes to the sheet at its index,
+            # or to a sheet of its own once an earlier table took that one
+            title = table.sheet.name
+            if not title:
+                indexed = worksheets[table.sheet.index :][:1]
+                title = indexed[0].title if indexed else table.name
+                if title in claimed:
+                    title = table.name
+            if title in claimed:
+                raise ValueError(
+                    f"Loader {loader.name} loads two tables into sheet "
+                    f"{title}"
+                )
+            claimed.add(title)
+            matches = [ws for ws in worksheets if ws.title == title]
+            if matches:
+                sheet_id = matches[0].id
+                grid["columnCount"] = max(
+                    grid["columnCount"], matches[0].col_count
+                )
+                requests.append(
+                    {
+                        "updateSheetProperties": {
+                            "properties": {
+                                "sheetId": sheet_id,
+                                "gridProperties": grid,
+                            },
+                            "fields": "gridProperties(rowCount,columnCount)",
+                        }
+                    }
+                )
+                requests.append(
+                    {
+                        "updateCells": {
+                            "range": {
+                                "sheetId": sheet_id,
+                                "startRowIndex": box.header_row,
+                                "startColumnIndex": box.start_col,
+                            },
+                            "fields": "userEnteredValue",
+                        }
+                    }
+                )
+            else:
+                sheet_id = next_id
+                next_id += 1
+                properties = {
+                    "sheetId": sheet_id,
+                    "title": title,
+                    "gridProperties": grid,
+                }
+                requests.append({"addSheet": {"properties": properties}})
+            targets.append((table, title, columns, row_count, data_row))
+        # Resizing and clearing can be repeated, adding a sheet can't
+        adds = any("addSheet" in request for request in requests)
+        call = self._call_nonidempotent if adds else self._call
+        call("sheets", spreadsheet.batch_update, {"requests": requests})
+        self.metrics.incr("sheets.batch_update")
+
+        rows_written = 0
+        for table, title, columns, row_count, data_row in targets:
+            logger.info("Loading %s into %s", table.name, title)
+            col = self._get_col_letters(table.sheet.box.start_col)
+            sheet = title.replace("'", "''")
+            header_row = table.sheet.box.header_row + 1
+            data = [
+                {"range": f"'{sheet}'!{col}{header_row}", "values": [columns]}
+            ]
+            table_rows = 0
+            cursor = self._select_table(table.name, conn)
+            for chunk in self._iter_payload_chunks(cursor):
+                start = data_row + table_rows + 1
+                data.append(
+                    {"range": f"'{sheet}'!{col}{start}", "values": chunk}
+                )
+                self._write_sheet_values(spreadsheet, table, data, len(chunk))
+                table_rows += len(chunk)
+                data = []
+                logger.info(
+                    "Wrote %d of %d rows of %s", table_rows, row_count, title
+                )
+            if data:
+                self._write_sheet_values(spreadsheet, table, data, 0)
+            rows_written += table_rows
+        return rows_written
+
+    def _write_sheet_values(
+        self,
+        spreadsheet: gspread.Spreadsheet,
+        table: Table,
+        data: List[Dict[str, Any]],
+        rows: int,
+    ) -> None:
+        with self.metrics.stage("sheets_values", table=table.name, rows=rows):
+            self._call(
+                "sheets",
+                spreadsheet.values_batch_update,
+                {"valueInputOption": "RAW", "data": data},
+            )
+        self.metrics.incr("sheets.values_update")
+        self.metrics.add_rows(table.name, rows_out=rows)
+
+    def _export_text(
+        self,
+        loader: Loader,
+        table: Table,
+        path: str,
+        conn: Optional[sqlite3.Connection] = None,
+    ) -> int:
+        # Rows go from the cursor to the file one chunk at a time. Gzip
+        # headers carry no timestamp, so unchanged content gives an
+        # identical file.
+        cursor = self._select_table(table.name, conn)
+        columns = [d[0] for d in cursor.description]
+        rows_written = 0
+        with open(path, "wb") as raw:
+            binary: Union[io.BufferedWriter, gzip.GzipFile] = raw
+            if loader.compression == "gzip":
+                binary = gzip.GzipFile(
+                    os.path.basename(path), "wb", fileobj=raw, mtime=0
+                )
+            with binary, io.TextIOWrapper(
+                binary, encoding="utf-8", newline=""
+            ) as stream:
+                writer = csv.writer(stream)
+                if loader.extension == "csv":
+                    writer.writerow(columns)
+                for rows in self._iter_cursor_rows(cursor):
+                    if loader.extension == "csv":
+                        writer.writerows(rows)
+                    else:
+                        stream.writelines(
+                            _json_line(dict(zip(columns, row)))
+                            for row in rows
+                        )
+                    rows_written += len(rows)
+        self.metrics.add_rows(table.name, rows_out=rows_written)
+        return rows_written
+
+    def _export_sqlite(
+        self,
+        tables: List[Table],
+        path: str,
+        conn: Optional[sqlite3.Connection] = None,
+    ) -> int:
+        # Copies each table, with its declared column types, into a new
+        # SQLite file that holds nothing else
+        if os.path.exists(path):
+            os.remove(path)
+        source = conn or self._db_conn
+        rows_written = 0
+        with closing(sqlite3.connect(path)) as export:
+            export.execute("PRAGMA journal_mode = OFF;")
+            export.execute("PRAGMA synchronous = OFF;")
+            for table in tables:
+                info = source.execute(f'PRAGMA table_info("{table.name}");')
+                types = {row[1]: row[2] for row in info.fetchall()}
+                cursor = self._select_table(table.name, source)
+                columns = [d[0] for d in cursor.description]
+                column_defs = ", ".join(
+                    f'"{col}" {types.get(col, "")}'.rstrip() for col in columns
+                )
+                marks = ", ".join("?" * len(columns))
+                table_rows = 0
+                with export:
+                    export.execute(
+                        f'CREATE TABLE "{table.name}" ({column_defs});'
+                    )
+                    for rows in self._iter_cursor_rows(cursor):
+                        export.executemany(
+                            f'INSERT INTO "{table.name}" VALUES ({marks});',
+                            rows,
+                        )
+                        table_rows += len(rows)
+                self.metrics.add_rows(table.name, rows_out=table_rows)
+                rows_written += table_rows
+        return rows_written
+
+    def _load_tables(
+        self, loader: Loader, conn: Optional[sqlite3.Connection] = None
+    ) -> None:
+        if loader.compression and loader.extension not in ["csv", "jsonl"]:
+            raise ValueError(f"{loader.extension} exports can't be compressed")
         if loader.extension == "xlsx":
-            upload = False
             load_path = self._get_loader_filename(loader)
             if loader.template:
-                template_path = self._download_drive_file(loader.template)
-                os.rename(template_path, load_path)
+                self._download_drive_file(loader.template, load_path)
+            if self._xlsx_load_sheets(loader.tables, load_path, conn):
+                self._upload_to_folder(load_path, loader.exports.key)
+        elif loader.extension == "gsheet":
+            self._gsheet_load_sheets(loader, conn)
+        elif loader.extension == "db":
+            load_path = self._get_loader_filename(loader)
+            self._export_sqlite(loader.tables, load_path, conn)
+            self._upload_to_folder(load_path, loader.exports.key)
+        elif loader.extension in ["csv", "jsonl"]:
+            # One file per table, named after the table when there are more
             for table in loader.tables:
-                if table.name in df_dict.keys():
-                    upload = True
-                    self._xlsx_load_sheet(
-                        table.sheet, load_path, df_dict[table.name]
-                    )
-            if upload:
+                load_path = self._get_loader_filename(
+                    loader, table if len(loader.tables) > 1 else None
+                )
+                self._export_text(loader, table, load_path, conn)
                 self._upload_to_folder(load_path, loader.exports.key)
+        else:
+            raise ValueError(
+                f"Unsupported loader extension: {loader.extension}"
+            )
 
-    def _upload_to_folder(self, filepath: str, key: str):
-        options = {"parents": [{"kind": "drive#fileLink", "id": key}]}
-        f = self.drive.CreateFile(options)
-        f.SetContentFile(filepath)
-        f.Upload()
+    def _get_http(self) -> httplib2.Http:
+        # httplib2.Http is not thread-safe, so concurrent uploads each go
+        # through an authorized Http of their own thread
+        if not hasattr(self._http_local, "http"):
+            self._http_local.http = self.drive.auth.Get_Http_Object()
+        return self._http_local.http
 
-    def _update_file(self, filepath: str, key: str):
-        options = {"id": key}
-        f = self.drive.CreateFile(options)
-        f.SetContentFile(filepath)
-        f.Upload()
-
-    def _run_loaders(self):
-        for loader in self.config.loaders:
-            self._load_tables(loader)
-
-    def run_etl_config(self, key: str, from_folder: bool = False):
-        if from_folder:
-            self._load_config_from_folder(GFolder(key=key))
+    def _upload_file(
+        self,
+        filepath: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        file_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        media = MediaFileUpload(
+            filepath, chunksize=UPLOAD_CHUNKSIZE, resumable=True
+        )
+        files = self.drive.auth.service.files()
+        if file_id:
+            request = files.update(
+                fileId=file_id, media_body=media, supportsAllDrives=True
+            )
         else:
-            self._load_config_from_file(GFile(key=key))
-        self._connect_to_db()
-        self._run_extractors()
-        self._run_transformers()
-        self._run_loaders()
-        self._close_db()
-        self._update_db_source()
+            request = files.insert(
+                body=metadata, media_body=media, supportsAllDrives=True
+            )
+        response = resumable_upload(
+            request,
+            lambda next_chunk: self._call(
+                "drive", next_chunk, http=self._get_http()
+            ),
+        )
+        self.metrics.incr("drive.upload")
+        self.metrics.incr("bytes_uploaded", os.path.getsize(filepath))
+        return response
+
+    def _upload_to_folder(self, filepath: str, key: str) -> None:
+        # Not uploaded when the folder already has a file with the same
+        # title and content
+        title = os.path.basename(filepath)
+        query = f"'{key}' in parents and trashed=false"
+        listing = self._get_listing({"q": query, "fields": LIST_FIELDS}, None)
+        md5 = md5_file(filepath)
+        for file in listing:
+            if file["title"] == title and file.get("md5Checksum") == md5:
+                logger.info("Skipping upload of unchanged %s", title)
+                self.metrics.incr("drive.upload_skipped")
+                return
+        metadata = {
+            "title": title,
+            "parents": [{"kind": "drive#fileLink", "id": key}],
+        }
+        self._upload_file(filepath, metadata)
+        self._invalidate_listings(key)
+
+    def _update_file(self, filepath: str, key: str):
+        f = self.drive.CreateFile({"id": key})
+        self._call("drive", f.FetchMetadata, fields="md5Checksum")
+        self.metrics.incr("drive.metadata")
+        if f.metadata.get("md5Checksum") == md5_file(filepath):
+            logger.info("Skipping upload of unchanged %s", filepath)
+            self.metrics.incr("drive.upload_skipped")
+            return
+        self._upload_file(filepath, file_id=key)
+        self._invalidate_listings()
+
+    def _run_loader(
+        self, loader: Loader, conn: Optional[sqlite3.Connection] = None
+    ) -> None:
+        with self.metrics.stage("loader", name=loader.name):
+            self._load_tables(loader, conn)
+
+    def _snapshot_db(self) -> str:
+        # Loaders only read the DB, so concurrent ones share a file copy of
+        # it, which also works when the DB itself is in memory. It is as
+        # large as the DB, so it goes with the spill files or the exports.
+        self._db_conn.commit()
+        spill_dir = self.config.spill_dir if self.config else None
+        fd, snapshot_path = tempfile.mkstemp(
+            prefix="gskeleton_",
+            suffix=".db",
+            dir=spill_dir or self.work_dir or os.curdir,
+        )
+        os.close(fd)
+        with closing(sqlite3.connect(snapshot_path)) as snapshot:
+            self._db_conn.backup(snapshot)
+        return snapshot_path
+
+    def _run_loaders(self) -> None:
+        if not self.config:
+            return
+        loaders = self.config.loaders or []
+        workers = min(self.config.loader_workers, len(loaders))
+        if workers <= 1:
+            for loader in loaders:
+                self._run_loader(loader)
+            return
+        snapshot_path = self._snapshot_db()
+        uri = f"{Path(snapshot_path).as_uri()}?mode=ro"
+        local = threading.local()
+        conns: List[sqlite3.Connection] = []
+        conns_lock = threading.Lock()
+
+        def run(loader: Loader) -> None:
+            if not hasattr(local, "conn"):
+                local.conn = sqlite3.connect(
+                    uri, uri=True, check_same_thread=False
+                )
+                register_udfs(local.conn, self._get_config_udfs())
+                with conns_lock:
+                    conns.append(local.conn)
+            self._run_loader(loader, local.conn)
+
+        # After a failure, loaders that have not started are cancelled and
+        # the first failure in loader order is raised.
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = [pool.submit(run, loader) for loader in loaders]
+            wait(futures, return_when=FIRST_EXCEPTION)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            for conn in conns:
+                conn.close()
+            os.remove(snapshot_path)
+        for future in futures:
+            if not future.cancelled():
+                future.result()
+
+    def _write_report(
+        self, key: str, status: str, report_path: Optional[str]
+    ) -> Dict[str, Any]:
+        extra: Dict[str, Any] = {"config_key": key, "status": status}
+        if self.cache:
+            extra["cache"] = self.cache.stats()
+        if self._spill_path:
+            extra["spill_path"] = self._spill_path
+        report = self.metrics.report(**extra)
+        report_path = report_path or f"etl_report_{self.start_unix}.json"
+        with open(report_path, "w") as stream:
+            json.dump(report, stream, indent=2)
+        if self.on_report:
+            self.on_report(report)
+        return report
+
+    def run_etl_config(
+        self,
+        key: str,
+        from_folder: bool = False,
+        report_path: Optional[str] = None,
+        dry_run: bool = False,
+    ) -> None:
+        # A dry run prints the transformer plan against the DB as it is,
+        # without extracting, transforming or loading anything.
+        self.metrics = RunMetrics()
+        self._run_listings = {}
+        status = "failed"
+        try:
+            with self.metrics.stage("config_load"):
+                if from_folder:
+                    self._load_config_from_folder(GFolder(key=key))
+                else:
+                    self._load_config_from_file(GFile(key=key))
+            with self.metrics.stage("connect"):
+                self._connect_to_db()
+            if dry_run:
+                print(self._format_transform_plan())
+                self._close_db()
+                status = "dry_run"
+                return
+            self._run_extractors()
+            self._run_transformers()
+            self._run_loaders()
+            self._close_db()
+            self._update_db_source()
+            status = "ok"
+        finally:
+            self._run_listings = None
+            self._write_report(key, status, report_path)
+            # A failed run's working DB is kept for debugging
+            self._remove_spill_file(keep=status == "failed")
+
+    def _fork(self, work_dir: str) -> "DriveETL":
+        # A DriveETL for one config of a batch. It shares the clients, rate
+        # limits and caches, and has its own config, DB and metrics.
+        etl = DriveETL(
+            on_report=self.on_report,
+            listing_ttl=self.listing_ttl,
+            work_dir=work_dir,
+        )
+        for attr in ["drive", "gspread_client"]:
+            if hasattr(self, attr):
+                setattr(etl, attr, getattr(self, attr))
+        etl.cache = self.cache
+        etl._listing_cache = self._listing_cache
+        etl._listing_lock = self._listing_lock
+        etl.scheduler = copy.copy(self.scheduler)
+        etl.scheduler.on_event = lambda name: etl.metrics.incr(name)
+        return etl
+
+    def run_batch(
+        self,
+        keys: Optional[List[str]] = None,
+        folder: Optional[str] = None,
+        from_folder: bool = False,
+        workers: int = 4,
+        report_dir: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        # Runs the configs in keys, then every yaml file in folder, in up to
+        # workers threads. Each run gets its own work directory and report,
+        # and a failed run doesn't stop the others.
+        keys = list(keys or [])
+        if folder:
+            selector = GFileSelector(
+                folder=GFolder(key=folder), extension="yaml", order_by="title"
+            )
+            keys += [file.key for file in self._select_files(selector)]
+        report_dir = report_dir or ""
+        started_at = time.time()
+        start = time.perf_counter()
+
+        def run(index: int, key: str) -> Dict[str, Any]:
+            report_path = os.path.join(
+                report_dir, f"etl_report_{self.start_unix}_{index}.json"
+            )
+            result: Dict[str, Any] = {"config_key": key, "status": "failed"}
+            run_start = time.perf_counter()
+            with tempfile.TemporaryDirectory(prefix="gskeleton_") as work_dir:
+                try:
+                    self._fork(work_dir).run_etl_config(
+                        key, from_folder=from_folder, report_path=report_path
+                    )
+                except Exception as e:
+                    logger.exception("Config %s failed", key)
+                    result["error"] = f"{type(e).__name__}: {e}"
+            result["seconds"] = round(time.perf_counter() - run_start, 6)
+            if os.path.exists(report_path):
+                with open(report_path) as stream:
+                    report = json.load(stream)
+                result["status"] = report["status"]
+                result["counters"] = report["counters"]
+                result["report_path"] = report_path
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            results = list(pool.map(run, range(len(keys)), keys))
+        counters: Dict[str, int] = {}
+        for result in results:
+            for name, value in result.get("counters", {}).items():
+                counters[name] = counters.get(name, 0) + value
+        failed = [r["config_key"] for r in results if r["status"] == "failed"]
+        summary: Dict[str, Any] = {
+            "started_at": started_at,
+            "seconds": round(time.perf_counter() - start, 6),
+            "configs": len(results),
+            "failed": failed,
+            "counters": counters,
+            "results": results,
+        }
+        if self.cache:
+            summary["cache"] = self.cache.stats()
+        summary_path = os.path.join(
+            report_dir, f"batch_report_{self.start_unix}.json"
+        )
+        with open(summary_path, "w") as stream:
+            json.dump(summary, stream, indent=2)
+        logger.info("%d of %d configs failed", len(failed), len(results))
+        return summary
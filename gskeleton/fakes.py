@@ -0,0 +1,639 @@
+"""
+gskeleton.fakes
+~~~~~~~~~~~~~~~
+
+In-process stand-ins for PyDrive2's GoogleDrive and gspread's Client that
+serve a local directory, for tests and benchmarks without network access.
+
+Every subdirectory of the root is a Drive folder whose key is the
+directory name. Files ending in ``.gsheet`` hold a native spreadsheet as
+JSON: ``{"sheets": [{"title": "Sheet1", "values": [[...], ...]}]}``.
+
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import httplib2
+import requests
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaUpload
+from gspread.exceptions import APIError
+from pydrive2.files import ApiRequestError
+
+GSHEET_MIME_TYPE = "application/vnd.google-apps.spreadsheet"
+MIME_TYPES = {
+    ".gsheet": GSHEET_MIME_TYPE,
+    ".json": "application/json",
+    ".xlsx": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    ),
+    ".yaml": "application/x-yaml",
+    ".yml": "application/x-yaml",
+    ".csv": "text/csv",
+    ".db": "application/x-sqlite3",
+}
+
+
+def _file_id(relpath: str) -> str:
+    return hashlib.sha1(relpath.encode("utf-8")).hexdigest()[:20]
+
+
+def _rfc3339(timestamp: float) -> str:
+    utc = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    return utc.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _md5(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class FakeBackend(ABC):
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self._calls_lock = threading.Lock()
+        self._failures: Dict[str, List[int]] = {}
+
+    def fail_next(
+        self, name: str, times: int = 1, status: int = 429
+    ) -> None:
+        # The next calls named name fail with the given HTTP status
+        with self._calls_lock:
+            self._failures.setdefault(name, []).extend([status] * times)
+
+    @abstractmethod
+    def _error(self, status: int) -> Exception:
+        # The client library's exception for an HTTP error status
+        ...
+
+    def _call(self, name: str) -> None:
+        with self._calls_lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            failures = self._failures.get(name)
+            status = failures.pop(0) if failures else None
+        if self.latency:
+            time.sleep(self.latency)
+        if status:
+            raise self._error(status)
+
+
+def _error_content(status: int) -> bytes:
+    error = {"code": status, "message": f"Injected HTTP {status}"}
+    return json.dumps({"error": error}).encode("utf-8")
+
+
+class FakeDrive(FakeBackend):
+    def __init__(self, root: str, latency: float = 0.0):
+        super().__init__(latency)
+        self.root = root
+        self.auth = FakeAuth(self)
+        # Byte offsets at which a resumable upload chunk fails once
+        self.fail_chunks_at: Set[int] = set()
+        self.bytes_received = 0
+
+    def _error(self, status: int) -> Exception:
+        # PyDrive2 wraps googleapiclient errors in ApiRequestError
+        response = httplib2.Response({"status": status})
+        return ApiRequestError(HttpError(response, _error_content(status)))
+
+    def _paths(self) -> Dict[str, str]:
+        paths = {}
+        for folder in os.listdir(self.root):
+            folder_path = os.path.join(self.root, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for title in os.listdir(folder_path):
+                relpath = f"{folder}/{title}"
+                paths[_file_id(relpath)] = relpath
+        return paths
+
+    def _path(self, file_id: str) -> str:
+        relpath = self._paths().get(file_id)
+        if relpath is None:
+            raise FileNotFoundError(f"File not found: {file_id}")
+        return os.path.join(self.root, relpath)
+
+    def _metadata(self, relpath: str) -> Dict[str, Any]:
+        folder, title = relpath.split("/", 1)
+        path = os.path.join(self.root, relpath)
+        stat = os.stat(path)
+        mime_type = MIME_TYPES.get(os.path.splitext(title)[1], "")
+        metadata = {
+            "id": _file_id(relpath),
+            "title": title,
+            "mimeType": mime_type,
+            "parents": [{"id": folder}],
+            "createdDate": _rfc3339(stat.st_mtime),
+            "modifiedDate": _rfc3339(stat.st_mtime),
+            "version": str(stat.st_mtime_ns),
+        }
+        if mime_type != GSHEET_MIME_TYPE:
+            metadata["md5Checksum"] = _md5(path)
+            metadata["fileSize"] = str(stat.st_size)
+        return metadata
+
+    def _list(self, param: Dict[str, Any]) -> List[Dict[str, Any]]:
+        query = param.get("q", "")
+        folder_match = re.search(r"'([^']+)' in parents", query)
+        mime_match = re.search(r"mimeType\s*=\s*'([^']+)'", query)
+        files = []
+        for relpath in self._paths().values():
+            metadata = self._metadata(relpath)
+            if folder_match and metadata["parents"][0]["id"] != (
+                folder_match.group(1)
+            ):
+                continue
+            if mime_match and metadata["mimeType"] != mime_match.group(1):
+                continue
+            files.append(metadata)
+        if param.get("orderBy"):
+            field, _, direction = param["orderBy"].partition(" ")
+            files.sort(key=lambda f: f[field], reverse=direction == "desc")
+        return files
+
+    def _store(self, metadata: Dict[str, Any], data: bytes) -> Dict[str, Any]:
+        if "id" in metadata:
+            path = self._path(metadata["id"])
+        else:
+            folder = metadata["parents"][0]["id"]
+            os.makedirs(os.path.join(self.root, folder), exist_ok=True)
+            path = os.path.join(self.root, folder, metadata["title"])
+        with open(path, "wb") as stream:
+            stream.write(data)
+        relpath = os.path.relpath(path, self.root).replace(os.sep, "/")
+        return self._metadata(relpath)
+
+    def ListFile(
+        self, param: Optional[Dict[str, Any]] = None
+    ) -> "FakeListFile":
+        return FakeListFile(self, param or {})
+
+    def CreateFile(
+        self, metadata: Optional[Dict[str, Any]] = None
+    ) -> "FakeDriveFile":
+        return FakeDriveFile(self, metadata or {})
+
+    def add_file(self, folder: str, source_path: str) -> str:
+        folder_path = os.path.join(self.root, folder)
+        os.makedirs(folder_path, exist_ok=True)
+        title = os.path.basename(source_path)
+        shutil.copyfile(source_path, os.path.join(folder_path, title))
+        return _file_id(f"{folder}/{title}")
+
+    def folder_files(self, folder: str) -> Dict[str, str]:
+        return {
+            os.path.basename(relpath): file_id
+            for file_id, relpath in self._paths().items()
+            if relpath.split("/", 1)[0] == folder
+        }
+
+
+class FakeListFile:
+    # Pages like PyDrive2's ListFile: every next() is one call, and a
+    # failed call can be repeated without losing the position
+    def __init__(self, drive: FakeDrive, param: Dict[str, Any]):
+        self.drive = drive
+        self.param = param
+        self.offset: Optional[int] = 0
+
+    def GetList(self) -> List[Dict[str, Any]]:
+        return [f for page in self for f in page]
+
+    def __iter__(self) -> Iterator[List[Dict[str, Any]]]:
+        return self
+
+    def __next__(self) -> List[Dict[str, Any]]:
+        if self.offset is None:
+            raise StopIteration
+        self.drive._call("list")
+        files = self.drive._list(self.param)
+        # Drive's default page size
+        page_size = self.param.get("maxResults") or 100
+        page = files[self.offset : self.offset + page_size]
+        self.offset += page_size
+        if self.offset >= len(files):
+            self.offset = None
+        return page
+
+
+class FakeDriveFile:
+    def __init__(self, drive: FakeDrive, metadata: Dict[str, Any]):
+        self.drive = drive
+        self.metadata = dict(metadata)
+        self.content_path: Optional[str] = None
+
+    def FetchMetadata(
+        self, fields: Optional[str] = None, fetch_all: bool = False
+    ) -> None:
+        self.drive._call("metadata")
+        path = self.drive._path(self.metadata["id"])
+        relpath = os.path.relpath(path, self.drive.root).replace(os.sep, "/")
+        self.metadata.update(self.drive._metadata(relpath))
+
+    def GetContentFile(self, filename: str) -> None:
+        self.drive._call("download")
+        shutil.copyfile(self.drive._path(self.metadata["id"]), filename)
+
+    def SetContentFile(self, filename: str) -> None:
+        self.content_path = filename
+
+    def Upload(self) -> None:
+        self.drive._call("upload")
+        if not self.content_path:
+            raise ValueError("No content to upload")
+        self.metadata.setdefault(
+            "title", os.path.basename(self.content_path)
+        )
+        with open(self.content_path, "rb") as stream:
+            data = stream.read()
+        self.metadata.update(self.drive._store(self.metadata, data))
+
+
+class FakeAuth:
+    def __init__(self, drive: FakeDrive):
+        self.service = FakeService(drive)
+
+    def Get_Http_Object(self) -> httplib2.Http:
+        return httplib2.Http()
+
+
+class FakeService:
+    def __init__(self, drive: FakeDrive):
+        self.drive = drive
+
+    def files(self) -> "FakeFilesResource":
+        return FakeFilesResource(self.drive)
+
+
+class FakeFilesResource:
+    def __init__(self, drive: FakeDrive):
+        self.drive = drive
+
+    def insert(
+        self, body: Dict[str, Any], media_body: Any, **kwargs: Any
+    ) -> "FakeUploadRequest":
+        return FakeUploadRequest(self.drive, dict(body), media_body)
+
+    def update(
+        self, fileId: str, media_body: Any, **kwargs: Any
+    ) -> "FakeUploadRequest":
+        return FakeUploadRequest(self.drive, {"id": fileId}, media_body)
+
+
+class FakeUploadProgress(NamedTuple):
+    resumable_progress: int
+    total_size: int
+
+
+class FakeUploadRequest:
+    # Sends a googleapiclient MediaUpload body one chunk per next_chunk
+    def __init__(
+        self, drive: FakeDrive, metadata: Dict[str, Any], media: MediaUpload
+    ):
+        self.drive = drive
+        self.metadata = metadata
+        self.media = media
+        self.data = bytearray()
+
+    def next_chunk(
+        self, http: Any = None, num_retries: int = 0
+    ) -> Tuple[Optional[FakeUploadProgress], Optional[Dict[str, Any]]]:
+        self.drive._call("upload_chunk")
+        offset, total = len(self.data), self.media.size()
+        if offset in self.drive.fail_chunks_at:
+            self.drive.fail_chunks_at.discard(offset)
+            raise ConnectionError(f"Upload failed at byte {offset}")
+        chunk = self.media.getbytes(offset, self.media.chunksize())
+        self.data += chunk
+        self.drive.bytes_received += len(chunk)
+        if len(self.data) < total:
+            return FakeUploadProgress(len(self.data), total), None
+        self.drive._call("upload")
+        return None, self.drive._store(self.metadata, bytes(self.data))
+
+
+def _col_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+def _parse_a1(a1_range: str) -> Tuple[str, int, int, int, Optional[int]]:
+    # Returns the sheet title, first row, first column, last column and
+    # last row (None when open-ended), all zero-based.
+    title, cells = a1_range.rsplit("!", 1)
+    if title.startswith("'"):
+        title = title[1:-1].replace("''", "'")
+    start, _, end = cells.partition(":")
+    end = end or start
+    start_match = re.match(r"([A-Z]+)(\d+)$", start)
+    end_match = re.match(r"([A-Z]+)(\d*)$", end)
+    if not start_match or not end_match:
+        raise ValueError(f"Unsupported range: {a1_range}")
+    end_row = int(end_match.group(2)) - 1 if end_match.group(2) else None
+    return (
+        title,
+        int(start_match.group(2)) - 1,
+        _col_index(start_match.group(1)),
+        _col_index(end_match.group(1)),
+        end_row,
+    )
+
+
+def _trim(values: List[List[Any]]) -> List[List[Any]]:
+    # The Sheets API leaves out trailing empty rows and cells
+    rows = [list(row) for row in values]
+    for row in rows:
+        while row and row[-1] in ("", None):
+            row.pop()
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+
+class FakeWorksheet:
+    def __init__(
+        self,
+        title: str,
+        index: int,
+        values: List[List[Any]],
+        sheet_id: Optional[int] = None,
+        row_count: Optional[int] = None,
+        col_count: Optional[int] = None,
+    ):
+        self.title = title
+        self.index = index
+        self.id = index if sheet_id is None else sheet_id
+        self.values = values
+        self.row_count = row_count or max(len(values), 1000)
+        self.col_count = col_count or max([len(row) for row in values] + [26])
+
+    def get_all_values(self) -> List[List[Any]]:
+        rows = _trim(self.values)
+        width = max((len(row) for row in rows), default=0)
+        return [row + [""] * (width - len(row)) for row in rows]
+
+    def _resize(self, rows: Optional[int], cols: Optional[int]) -> None:
+        self.row_count = rows or self.row_count
+        self.col_count = cols or self.col_count
+        self.values = [
+            row[: self.col_count] for row in self.values[: self.row_count]
+        ]
+
+    def _clear(self, grid_range: Dict[str, int]) -> None:
+        end_row = grid_range.get("endRowIndex", len(self.values))
+        for row in self.values[grid_range.get("startRowIndex", 0) : end_row]:
+            start_col = grid_range.get("startColumnIndex", 0)
+            end_col = grid_range.get("endColumnIndex", len(row))
+            for c in range(start_col, min(end_col, len(row))):
+                row[c] = ""
+
+    def _write(self, row: int, col: int, values: List[List[Any]]) -> None:
+        while len(self.values) < row + len(values):
+            self.values.append([])
+        for r, row_values in enumerate(values, row):
+            cells = self.values[r]
+            cells.extend([""] * (col + len(row_values) - len(cells)))
+            cells[col : col + len(row_values)] = row_values
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: "FakeGspreadClient", key: str):
+        self.client = client
+        self.id = key
+        self._file_path = client.drive._path(key)
+        with open(self._file_path) as stream:
+            data = json.load(stream)
+        self._worksheets = [
+            FakeWorksheet(
+                sheet["title"],
+                i,
+                sheet["values"],
+                sheet.get("id"),
+                sheet.get("rows"),
+                sheet.get("cols"),
+            )
+            for i, sheet in enumerate(data["sheets"])
+        ]
+
+    def _save(self) -> None:
+        sheets = [
+            {
+                "title": ws.title,
+                "values": ws.values,
+                "id": ws.id,
+                "rows": ws.row_count,
+                "cols": ws.col_count,
+            }
+            for ws in self._worksheets
+        ]
+        with open(self._file_path, "w") as stream:
+            json.dump({"sheets": sheets}, stream)
+
+    def _find(self, title: str) -> FakeWorksheet:
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise ValueError(f"Worksheet not found: {title}")
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        self.client._call("metadata")
+        return list(self._worksheets)
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.client._call("metadata")
+        return self._find(title)
+
+    def get_worksheet(self, index: int) -> Optional[FakeWorksheet]:
+        self.client._call("metadata")
+        if 0 <= index < len(self._worksheets):
+            return self._worksheets[index]
+        return None
+
+    def values_batch_get(self, ranges: List[str]) -> Dict[str, Any]:
+        self.client._call("values")
+        value_ranges = []
+        for a1_range in ranges:
+            title, first_row, first_col, last_col, last_row = _parse_a1(
+                a1_range
+            )
+            values = self.worksheet(title).values
+            end = None if last_row is None else last_row + 1
+            block = [
+                row[first_col : last_col + 1] for row in values[first_row:end]
+            ]
+            value_ranges.append({"range": a1_range, "values": _trim(block)})
+        return {"valueRanges": value_ranges}
+
+    def batch_update(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        # Supports adding sheets, resizing them and clearing cell values
+        self.client._call("batch_update")
+        self.client.payload_bytes.append(len(json.dumps(body)))
+        by_id = {ws.id: ws for ws in self._worksheets}
+        for request in body["requests"]:
+            ((kind, params),) = request.items()
+            properties = params.get("properties", {})
+            grid = properties.get("gridProperties", {})
+            if kind == "addSheet":
+                worksheet = FakeWorksheet(
+                    properties["title"],
+                    len(self._worksheets),
+                    [],
+                    properties.get("sheetId"),
+                    grid.get("rowCount"),
+                    grid.get("columnCount"),
+                )
+                self._worksheets.append(worksheet)
+                by_id[worksheet.id] = worksheet
+            elif kind == "updateSheetProperties":
+                by_id[properties["sheetId"]]._resize(
+                    grid.get("rowCount"), grid.get("columnCount")
+                )
+            elif kind == "updateCells" and "rows" not in params:
+                by_id[params["range"]["sheetId"]]._clear(params["range"])
+            else:
+                raise NotImplementedError(kind)
+        self._save()
+        return {"spreadsheetId": self.id, "replies": []}
+
+    def values_batch_update(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        self.client._call("values_update")
+        self.client.payload_bytes.append(len(json.dumps(body)))
+        for value_range in body["data"]:
+            title, row, col, _, _ = _parse_a1(value_range["range"])
+            worksheet = self._find(title)
+            values = value_range["values"]
+            width = max((len(cells) for cells in values), default=0)
+            # Like the API, writes beyond the grid are rejected
+            rows_fit = row + len(values) <= worksheet.row_count
+            if not rows_fit or col + width > worksheet.col_count:
+                raise self.client._error(400)
+            worksheet._write(row, col, values)
+        self._save()
+        return {"spreadsheetId": self.id}
+
+
+class FakeGspreadClient(FakeBackend):
+    def __init__(self, drive: FakeDrive, latency: float = 0.0):
+        super().__init__(latency)
+        self.drive = drive
+        # Request body sizes of batch_update and values_batch_update calls
+        self.payload_bytes: List[int] = []
+
+    def _error(self, status: int) -> Exception:
+        response = requests.Response()
+        response.status_code = status
+        response._content = _error_content(status)
+        return APIError(response)
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self._call("open")
+        return FakeSpreadsheet(self, key)
+
+    def create(
+        self, title: str, folder_id: Optional[str] = None
+    ) -> FakeSpreadsheet:
+        self._call("create")
+        relpath = f"{folder_id or 'root'}/{title}.gsheet"
+        path = os.path.join(self.drive.root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_gsheet(path, {"Sheet1": []})
+        return FakeSpreadsheet(self, _file_id(relpath))
+
+    def copy(
+        self,
+        file_id: str,
+        title: Optional[str] = None,
+        copy_permissions: bool = False,
+        folder_id: Optional[str] = None,
+        copy_comments: bool = True,
+    ) -> FakeSpreadsheet:
+        self._call("copy")
+        source = self.drive._path(file_id)
+        folder = folder_id or os.path.basename(os.path.dirname(source))
+        title = title or f"Copy of {os.path.basename(source)[:-7]}"
+        relpath = f"{folder}/{title}.gsheet"
+        path = os.path.join(self.drive.root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(source, path)
+        return FakeSpreadsheet(self, _file_id(relpath))
+
+
+def write_gsheet(path: str, sheets: Dict[str, List[List[Any]]]) -> None:
+    data = {
+        "sheets": [
+            {"title": title, "values": values}
+            for title, values in sheets.items()
+        ]
+    }
+    with open(path, "w") as stream:
+        json.dump(data, stream)
+
+
+def synthetic_values(
+    rows: int, cols: int, seed: int = 0
+) -> List[List[str]]:
+    header = ["ID", "Name", "Category", "Amount"]
+    header += [f"Field {c}" for c in range(4, cols)]
+    values = [header[:cols]]
+    for r in range(rows):
+        row = [
+            f"{seed}-{r}",
+            f"name {r % 997}",
+            f"category {r % 13}",
+            str((r * 7919 + seed) % 10000 / 100),
+        ]
+        row += [f"v{(r + c) % 101}" for c in range(4, cols)]
+        values.append(row[:cols])
+    return values
+
+
+def generate_inputs(
+    root: str,
+    folder: str,
+    kind: str = "gsheet",
+    files: int = 10,
+    rows: int = 1000,
+    cols: int = 8,
+) -> List[str]:
+    folder_path = os.path.join(root, folder)
+    os.makedirs(folder_path, exist_ok=True)
+    for i in range(files):
+        values = synthetic_values(rows, cols, seed=i)
+        path = os.path.join(folder_path, f"input_{i:05d}.{kind}")
+        if kind == "gsheet":
+            write_gsheet(path, {"Data": values})
+        elif kind == "xlsx":
+            from openpyxl import Workbook
+
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet("Data")
+            for row in values:
+                ws.append(row)
+            wb.save(path)
+        else:
+            raise ValueError(f"Unsupported input kind: {kind}")
+    drive = FakeDrive(root)
+    return list(drive.folder_files(folder).values())
@@ -0,0 +1,80 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None  # type: ignore
+
+
+def peak_rss_bytes() -> int:
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RunMetrics:
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.stages: List[Dict[str, Any]] = []
+        self.counters: Dict[str, int] = {}
+        self.tables: Dict[str, Dict[str, int]] = {}
+        self.coercion_failures: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, stage_name: str, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        status = "failed"
+        try:
+            yield
+            status = "ok"
+        finally:
+            record = {"stage": stage_name, **labels}
+            record["seconds"] = round(time.perf_counter() - start, 6)
+            record["status"] = status
+            with self._lock:
+                self.stages.append(record)
+
+    def incr(self, counter: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def add_rows(
+        self, table: str, rows_in: int = 0, rows_out: int = 0
+    ) -> None:
+        with self._lock:
+            counts = self.tables.setdefault(table, {"in": 0, "out": 0})
+            counts["in"] += rows_in
+            counts["out"] += rows_out
+
+    def add_coercion_failures(
+        self, table: str, column: str, rows: int, examples: List[str]
+    ) -> None:
+        with self._lock:
+            columns = self.coercion_failures.setdefault(table, {})
+            failures = columns.setdefault(column, {"rows": 0, "examples": []})
+            failures["rows"] += rows
+            failures["examples"] = (failures["examples"] + examples)[:5]
+
+    def report(self, **extra: Any) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **extra,
+                "started_at": self.started_at,
+                "seconds": round(time.perf_counter() - self._start, 6),
+                "peak_rss_bytes": peak_rss_bytes(),
+                "counters": dict(self.counters),
+                "tables": {k: dict(v) for k, v in self.tables.items()},
+                "coercion_failures": {
+                    table: {col: dict(f) for col, f in columns.items()}
+                    for table, columns in self.coercion_failures.items()
+                },
+                "stages": list(self.stages),
+            }
@@ -0,0 +1,154 @@
+from typing import Dict, List, Literal, Optional
+
+from pydantic import BaseModel
+
+
+class GFile(BaseModel):
+    key: str
+    name: Optional[str] = None
+
+
+class GFolder(BaseModel):
+    key: str
+    name: Optional[str] = None
+
+
+class GFileSelector(BaseModel):
+    folder: GFolder
+    top: Optional[int] = None
+    extension: Optional[str] = None
+    order_by: str = "modifiedDate"
+    desc: bool = False
+    # extension in ["title", "createdDate", "modifiedDate"]
+    # order_by in ["json", "gsheet", "xlsx", "yaml", "csv"]
+
+
+class CellBox(BaseModel):
+    header_row: int = 0
+    start_row: int = 1
+    start_col: int = 0
+    end_row: Optional[int] = None
+    end_col: Optional[int] = None
+
+
+class Sheet(BaseModel):
+    index: int = 0
+    name: Optional[str] = None
+    box: CellBox = CellBox()
+
+
+# In the order they are tried when inferring a column's type
+ColumnType = Literal["int", "float", "bool", "date", "text"]
+
+
+class TableIndex(BaseModel):
+    columns: List[str]
+    unique: bool = False
+    name: Optional[str] = None
+
+
+class Table(BaseModel):
+    name: str
+    sheet: Sheet = Sheet()
+    indexes: List[TableIndex] = []  # Created after extraction
+    column_types: Dict[str, ColumnType] = {}  # By SQL column name
+    # Infers the types of columns not listed above from the first file
+    # that has values in them. Later files are coerced to those types.
+    infer_types: bool = False
+
+
+class Extractor(BaseModel):
+    name: str
+    inputs: GFileSelector
+    tables: List[Table]
+    workers: Optional[int] = None  # Falls back to ETLConfig.workers
+    incremental: bool = False
+    # Each input file gets its own table and the table becomes a view over
+    # them. Only new and changed files are extracted, as with incremental.
+    sharded: bool = False
+    engine: Optional[str] = None  # pandas Excel engine, e.g. "calamine"
+
+
+class Transformer(BaseModel):
+    sql_command: str
+
+
+class Loader(BaseModel):
+    name: str
+    suffix_type: Optional[str] = None  # Allowed values: ["unix", "timestamp"]
+    extension: str  # Allowed values: ["xlsx", "gsheet", "csv", "jsonl", "db"]
+    compression: Optional[str] = None  # "gzip" for csv and jsonl
+    template: Optional[GFile] = None
+    # gsheet loaders write into this spreadsheet instead of a new one
+    target: Optional[GFile] = None
+    exports: GFolder
+    tables: List[Table]
+
+
+class SQLiteProfile(BaseModel):
+    journal_mode: Optional[str] = None
+    synchronous: Optional[str] = None
+    cache_size: Optional[int] = None
+    mmap_size: Optional[int] = None
+    temp_store: Optional[str] = None
+
+
+# SQLite's own defaults, restored after bulk loading
+DEFAULT_PROFILE = SQLiteProfile(
+    journal_mode="DELETE",
+    synchronous="FULL",
+    cache_size=-2000,
+    mmap_size=0,
+    temp_store="DEFAULT",
+)
+# Trades durability for speed while extracted tables are written. The DB
+# is a local working copy that is only uploaded after a successful run.
+BULK_LOAD_PROFILE = SQLiteProfile(
+    journal_mode="MEMORY",
+    synchronous="OFF",
+    cache_size=-262144,
+    temp_store="MEMORY",
+)
+# Bounds the memory of a spilled working DB: a 64 MiB page cache, reads
+# through a 256 MiB memory map and temporary tables on disk
+SPILL_PROFILE = SQLiteProfile(
+    cache_size=-65536,
+    mmap_size=256 * 1024 * 1024,
+    temp_store="FILE",
+)
+
+
+class Database(BaseModel):
+    key: str
+    update: bool = False
+    profile: SQLiteProfile = SQLiteProfile()
+    bulk_profile: Optional[SQLiteProfile] = BULK_LOAD_PROFILE
+    vacuum: bool = False  # Compacts the DB before it is uploaded
+
+
+class Function(BaseModel):
+    name: str
+    target: str  # "module:attribute"
+    narg: int = -1  # -1 accepts any number of arguments
+    aggregate: bool = False  # target is a class with step() and finalize()
+    deterministic: bool = True
+
+
+class ETLConfig(BaseModel):
+    db: Optional[Database] = None
+    extractors: Optional[List[Extractor]] = None
+    transformers: Optional[List[Transformer]] = None
+    loaders: Optional[List[Loader]] = None
+    workers: int = 1
+    loader_workers: int = 1  # Loaders run concurrently when above 1
+    chunksize: int = 10000  # Rows per INSERT batch when extracting
+    functions: List[Function] = []  # SQL functions for transformers
+    # Skips transformers whose input and output tables are unchanged since
+    # they last ran. Only applies when the DB is kept in Drive, and to
+    # transformers that drop, create or empty the tables they write and
+    # call no non-deterministic functions.
+    memoize_transformers: bool = False
+    # Without a db, the working DB is a temporary file instead of memory
+    # once the listed inputs add up to spill_bytes. None never spills.
+    spill_bytes: Optional[int] = 512 * 1024 * 1024
+    spill_dir: Optional[str] = None  # Defaults to the system temp dir
@@ -0,0 +1,297 @@
+import re
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+TOKEN_RE = re.compile(
+    r"""
+    (?P<skip>'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/)
+    | "(?P<dquote>(?:[^"]|"")*)"
+    | `(?P<bquote>(?:[^`]|``)*)`
+    | \[(?P<bracket>[^\]]*)\]
+    | (?P<word>[A-Za-z_][\w$]*)
+    | (?P<punct>\S)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+# Words that can follow FROM/JOIN/UPDATE/... without being a table name
+KEYWORDS = {
+    "SELECT",
+    "SET",
+    "VALUES",
+    "DEFAULT",
+    "CASCADE",
+    "RESTRICT",
+    "NO",
+    "NOTHING",
+    "WHERE",
+    "ON",
+}
+JOIN_KEYWORDS = {"JOIN", "LEFT", "RIGHT", "FULL", "INNER", "CROSS", "NATURAL"}
+# Built-in SQL whose result differs between runs on the same tables. The
+# date and time functions are only volatile with a 'now' argument.
+VOLATILE_FUNCTIONS = {
+    "RANDOM",
+    "RANDOMBLOB",
+    "CHANGES",
+    "TOTAL_CHANGES",
+    "LAST_INSERT_ROWID",
+}
+VOLATILE_KEYWORDS = {"CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP"}
+Token = Tuple[str, str]  # (kind, value); kind is "word", "name" or "punct"
+
+
+class TransformUnit(NamedTuple):
+    name: str
+    statements: List[int]  # Indexes into the transformer list
+    reads: FrozenSet[str]  # Tables read, not counting its own outputs
+    writes: FrozenSet[str]
+    upstream: List[str]  # Names of the units it reads from
+    memoize: bool  # False when it has to run every time
+
+
+def _tokens(sql: str) -> List[Token]:
+    tokens = []
+    for match in TOKEN_RE.finditer(sql):
+        if match.group("skip"):
+            continue
+        elif match.group("word"):
+            tokens.append(("word", match.group("word")))
+        elif match.group("punct"):
+            tokens.append(("punct", match.group("punct")))
+        else:
+            quoted = next(g for g in match.groups()[1:4] if g is not None)
+            tokens.append(("name", quoted))
+    return tokens
+
+
+class _Scanner:
+    def __init__(self, sql: str):
+        self.tokens = _tokens(sql)
+        self.i = 0
+
+    def peek(self, offset: int = 0) -> Token:
+        i = self.i + offset
+        return self.tokens[i] if i < len(self.tokens) else ("punct", "")
+
+    def keyword(self, offset: int = 0) -> str:
+        kind, value = self.peek(offset)
+        return value.upper() if kind == "word" else ""
+
+    def accept(self, *keywords: str) -> bool:
+        if self.keyword() in keywords:
+            self.i += 1
+            return True
+        return False
+
+    def name(self, columns: bool = False) -> Optional[str]:
+        # Reads a possibly schema-qualified table name. Returns None for
+        # subqueries, keywords and, unless a column list may follow,
+        # table-valued functions.
+        kind, value = self.peek()
+        if kind == "punct" or self.keyword() in KEYWORDS:
+            return None
+        self.i += 1
+        while self.peek() == ("punct", ".") and self.peek(1)[0] != "punct":
+            value = self.peek(1)[1]
+            self.i += 2
+        if self.peek() == ("punct", "(") and not columns:
+            return None
+        return value.lower()
+
+
+def is_volatile(sql: str, functions: Iterable[str] = ()) -> bool:
+    # True when sql calls a non-deterministic function, either built in or
+    # one of the given function names
+    volatile = VOLATILE_FUNCTIONS | {name.upper() for name in functions}
+    matches = list(TOKEN_RE.finditer(sql))
+    for match, after in zip(matches, matches[1:] + [None]):
+        word = (match.group("word") or "").upper()
+        if word in VOLATILE_KEYWORDS:
+            return True
+        if word in volatile and after and after.group("punct") == "(":
+            return True
+        if (match.group("skip") or "").lower() == "'now'":
+            return True
+    return False
+
+
+def statement_tables(sql: str) -> Tuple[Set[str], Set[str]]:
+    reads, writes, _ = _statement_tables(sql)
+    return reads, writes
+
+
+def _statement_tables(sql: str) -> Tuple[Set[str], Set[str], Set[str]]:
+    # Also returns the tables the statement replaces whole, whatever they
+    # held before: dropped, newly created or emptied
+    reads: Set[str] = set()
+    writes: Set[str] = set()
+    rebuilds: Set[str] = set()
+    ctes: Set[str] = set()
+    scanner = _Scanner(sql)
+    while scanner.i < len(scanner.tokens):
+        keyword = scanner.keyword()
+        kind, value = scanner.peek()
+        scanner.i += 1
+        if kind != "punct" and scanner.keyword() == "AS":
+            materialized = 2 if scanner.keyword(1) == "NOT" else 1
+            if scanner.keyword(materialized) == "MATERIALIZED":
+                materialized += 1
+            else:
+                materialized = 1
+            if scanner.peek(materialized) == ("punct", "("):
+                ctes.add(value.lower())
+        if keyword in ["FROM", "JOIN"]:
+            name = scanner.name()
+            if name:
+                reads.add(name)
+            while keyword == "FROM":
+                scanner.accept("AS")
+                if scanner.peek()[0] != "punct" and (
+                    scanner.keyword() not in KEYWORDS | JOIN_KEYWORDS
+                ):
+                    scanner.i += 1
+                if scanner.peek() != ("punct", ","):
+                    break
+                scanner.i += 1
+                name = scanner.name()
+                if name:
+                    reads.add(name)
+        elif keyword == "DELETE" and scanner.accept("FROM"):
+            name = scanner.name()
+            if name:
+                writes.add(name)
+                if scanner.peek() in [("punct", ""), ("punct", ";")]:
+                    rebuilds.add(name)
+        elif keyword == "INTO":
+            name = scanner.name(columns=True)
+            if name:
+                writes.add(name)
+        elif keyword == "UPDATE":
+            if scanner.accept("OR"):
+                scanner.i += 1
+            name = scanner.name()
+            if name:
+                writes.add(name)
+        elif keyword == "CREATE":
+            scanner.accept("TEMP", "TEMPORARY")
+            scanner.accept("VIRTUAL")
+            scanner.accept("UNIQUE")
+            if scanner.accept("INDEX", "TRIGGER"):
+                # Indexes and triggers belong with the table they are on
+                while scanner.i < len(scanner.tokens):
+                    if scanner.accept("ON"):
+                        name = scanner.name(columns=True)
+                        if name:
+                            writes.add(name)
+                        break
+                    scanner.i += 1
+            elif scanner.accept("TABLE", "VIEW"):
+                exists = scanner.accept("IF")
+                if exists:
+                    scanner.accept("NOT")
+                    scanner.accept("EXISTS")
+                name = scanner.name(columns=True)
+                if name:
+                    writes.add(name)
+                    if not exists:
+                        rebuilds.add(name)
+        elif keyword == "DROP" and scanner.accept("TABLE", "VIEW"):
+            if scanner.accept("IF"):
+                scanner.accept("EXISTS")
+            name = scanner.name()
+            if name:
+                writes.add(name)
+                rebuilds.add(name)
+        elif keyword == "ALTER" and scanner.accept("TABLE"):
+            name = scanner.name()
+            if name:
+                writes.add(name)
+        elif keyword == "RENAME" and scanner.accept("TO"):
+            name = scanner.name()
+            if name:
+                writes.add(name)
+    return reads - ctes, writes, rebuilds
+
+
+def plan_units(
+    statements: List[str], volatile_functions: Iterable[str] = ()
+) -> List[TransformUnit]:
+    # Statements writing a common table form one unit. A unit is only
+    # memoized when its first write to each of its tables replaces the
+    # table whole, none of its statements is volatile, and no other unit
+    # reads its tables, or writes the tables it reads, in between its
+    # first and last statement.
+    scans = [_statement_tables(sql) for sql in statements]
+    tables = [(reads, writes) for reads, writes, _ in scans]
+    groups: List[List[int]] = []
+    for i, (_, writes) in enumerate(tables):
+        overlapping = [
+            g
+            for g in groups
+            if writes and writes & set().union(*(tables[j][1] for j in g))
+        ]
+        merged = sorted(sum(overlapping, [i]))
+        groups = [g for g in groups if g not in overlapping] + [merged]
+    groups.sort(key=lambda g: g[0])
+
+    unit_reads: List[Set[str]] = []
+    unit_writes: List[Set[str]] = []
+    for group in groups:
+        writes = set().union(*(tables[i][1] for i in group))
+        reads = set().union(*(tables[i][0] for i in group)) - writes
+        unit_writes.append(writes)
+        unit_reads.append(reads)
+
+    memoize = []
+    for group, writes in zip(groups, unit_writes):
+        written: Set[str] = set()
+        rebuilt: Set[str] = set()
+        for i in group:
+            _, statement_writes, rebuilds = scans[i]
+            rebuilt |= (statement_writes - written) & rebuilds
+            written |= statement_writes
+        volatile = any(
+            is_volatile(statements[i], volatile_functions) for i in group
+        )
+        memoize.append(bool(writes) and rebuilt == writes and not volatile)
+    for u, group in enumerate(groups):
+        for v, other in enumerate(groups):
+            inside = [i for i in other if group[0] < i < group[-1]]
+            if u == v or not inside:
+                continue
+            if unit_reads[v] & unit_writes[u]:
+                memoize[u] = memoize[v] = False
+            if unit_writes[v] & unit_reads[u]:
+                memoize[u] = False
+
+    names = [
+        ",".join(sorted(writes)) if writes else f"#{group[0]}"
+        for group, writes in zip(groups, unit_writes)
+    ]
+    writers: Dict[str, List[str]] = {}
+    units = []
+    for u, group in enumerate(groups):
+        upstream = sorted(
+            {w for table in unit_reads[u] for w in writers.get(table, [])}
+        )
+        units.append(
+            TransformUnit(
+                names[u],
+                group,
+                frozenset(unit_reads[u]),
+                frozenset(unit_writes[u]),
+                upstream,
+                memoize[u],
+            )
+        )
+        for table in unit_writes[u]:
+            writers.setdefault(table, []).append(names[u])
+    return units
@@ -0,0 +1,161 @@
+import logging
+import random
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import httplib2
+import requests
+from googleapiclient.errors import HttpError
+from gspread.exceptions import APIError
+from pydrive2.files import ApiRequestError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# Dropped connections and timeouts. Other OSErrors, like a missing local
+# file, fail the same way on every attempt.
+TRANSPORT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    socket.timeout,
+    httplib2.HttpLib2Error,
+    requests.ConnectionError,
+    requests.Timeout,
+)
+
+
+def error_status(error: Exception) -> Optional[int]:
+    if isinstance(error, HttpError):
+        return int(error.resp.status)
+    elif isinstance(error, ApiRequestError):
+        return error.error.get("code")
+    elif isinstance(error, APIError):
+        return error.response.status_code
+    return None
+
+
+def is_retryable(error: Exception, idempotent: bool = True) -> bool:
+    status = error_status(error)
+    if not idempotent:
+        # Any other failure may come after the call took effect
+        return status == 429
+    if status is not None:
+        return status in RETRY_STATUSES
+    return isinstance(error, TRANSPORT_ERRORS)
+
+
+class TokenBucket:
+    # Allows rate calls per second on average and bursts of up to burst
+    # calls. The rate is halved on every 429 and grows back by a tenth of
+    # the configured rate on every success.
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._updated
+                self.tokens = min(
+                    self.capacity, self.tokens + elapsed * self.rate
+                )
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def slow_down(self) -> None:
+        with self._lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def speed_up(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class Scheduler:
+    def __init__(
+        self,
+        rates: Optional[Dict[str, float]] = None,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 64.0,
+        on_event: Optional[Callable[[str], None]] = None,
+    ):
+        self.buckets = {
+            api: TokenBucket(rate) for api, rate in (rates or {}).items()
+        }
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_event = on_event
+
+    def _event(self, name: str) -> None:
+        if self.on_event:
+            self.on_event(name)
+
+    def backoff_delay(self, attempt: int) -> float:
+        # Full jitter keeps concurrent workers from retrying in lockstep
+        cap = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    def call(
+        self, api: str, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        return self._call(api, True, func, *args, **kwargs)
+
+    def call_nonidempotent(
+        self, api: str, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        # For calls that create something, which are only retried when
+        # rate limited, so a retry can't create it twice
+        return self._call(api, False, func, *args, **kwargs)
+
+    def _call(
+        self,
+        api: str,
+        idempotent: bool,
+        func: Callable[..., T],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        bucket = self.buckets.get(api)
+        attempt = 0
+        while True:
+            if bucket and bucket.acquire() > 0:
+                self._event(f"{api}.throttled")
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if bucket and error_status(e) == 429:
+                    bucket.slow_down()
+                retryable = is_retryable(e, idempotent)
+                if attempt >= self.max_retries or not retryable:
+                    raise
+                delay = self.backoff_delay(attempt)
+                attempt += 1
+                self._event(f"{api}.retried")
+                logger.warning(
+                    "%s call failed (%s), retry %d in %.1fs",
+                    api,
+                    e,
+                    attempt,
+                    delay,
+                )
+                time.sleep(delay)
+                continue
+            if bucket:
+                bucket.speed_up()
+            return result
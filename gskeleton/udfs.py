@@ -0,0 +1,116 @@
+import hashlib
+import importlib
+import re
+import sqlite3
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+
+class UDF(NamedTuple):
+    narg: int
+    func: Any  # A callable, or a class with step() and finalize()
+    aggregate: bool = False
+    deterministic: bool = True
+
+
+FUNCTIONS: Dict[str, List[UDF]] = {}
+
+
+def register_function(
+    name: str,
+    narg: int,
+    func: Callable[..., Any],
+    deterministic: bool = True,
+) -> None:
+    FUNCTIONS.setdefault(name, []).append(
+        UDF(narg, func, deterministic=deterministic)
+    )
+
+
+def register_aggregate(name: str, narg: int, cls: type) -> None:
+    FUNCTIONS.setdefault(name, []).append(UDF(narg, cls, aggregate=True))
+
+
+def intHash(s: str) -> int:
+    digest = hashlib.sha256(s.encode("utf-8")).digest()
+    return int.from_bytes(digest, "big") % 10 ** 12
+
+
+def fastHash(s: Optional[str]) -> Optional[int]:
+    # A stable signed 64-bit hash, so it fits an SQLite INTEGER
+    if s is None:
+        return None
+    digest = hashlib.blake2b(str(s).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+@lru_cache(maxsize=256)
+def _compile(pattern: str) -> "re.Pattern[str]":
+    return re.compile(pattern)
+
+
+def regexp(pattern: Optional[str], value: Any) -> Optional[int]:
+    # Called by SQLite for "value REGEXP pattern"
+    if pattern is None or value is None:
+        return None
+    return 1 if _compile(pattern).search(str(value)) else 0
+
+
+def regexp_replace(
+    value: Any, pattern: Optional[str], replacement: Optional[str]
+) -> Optional[str]:
+    if value is None or pattern is None or replacement is None:
+        return None
+    return _compile(pattern).sub(replacement, str(value))
+
+
+def regexp_extract(value: Any, pattern: Optional[str]) -> Optional[str]:
+    # Returns the first group when the pattern has one, else the match
+    if value is None or pattern is None:
+        return None
+    match = _compile(pattern).search(str(value))
+    if not match:
+        return None
+    return match.group(1) if match.re.groups else match.group(0)
+
+
+register_function("intHash", 1, intHash)
+register_function("fastHash", 1, fastHash)
+register_function("regexp", 2, regexp)
+register_function("regexp_replace", 3, regexp_replace)
+register_function("regexp_extract", 2, regexp_extract)
+
+
+def import_target(target: str) -> Any:
+    module_name, _, attr = target.partition(":")
+    if not module_name or not attr:
+        raise ValueError(f"Expected 'module:attribute', got: {target}")
+    module = importlib.import_module(module_name)
+    try:
+        return getattr(module, attr)
+    except AttributeError:
+        raise ValueError(f"{module_name} has no attribute {attr}") from None
+
+
+def _create_function(
+    conn: sqlite3.Connection, name: str, udf: UDF
+) -> None:
+    if udf.aggregate:
+        conn.create_aggregate(name, udf.narg, udf.func)
+        return
+    try:
+        conn.create_function(
+            name, udf.narg, udf.func, deterministic=udf.deterministic
+        )
+    except sqlite3.NotSupportedError:
+        # SQLite older than 3.8.3 has no deterministic flag
+        conn.create_function(name, udf.narg, udf.func)
+
+
+def register_udfs(
+    conn: sqlite3.Connection, extra: Optional[Dict[str, List[UDF]]] = None
+) -> None:
+    for functions in [FUNCTIONS, extra or {}]:
+        for name, udfs in functions.items():
+            for udf in udfs:
+                _create_function(conn, name, udf)
@@ -0,0 +1,32 @@
+import hashlib
+import logging
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+def md5_file(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def resumable_upload(
+    request: Any,
+    call: Callable[[Callable[[], Any]], Any] = lambda f: f(),
+) -> Dict[str, Any]:
+    # Each chunk goes through call, which retries failures. After a failed
+    # chunk the client asks Drive how many bytes it has confirmed and
+    # continues from there, so a retry only resends the chunk that failed.
+    response = None
+    while response is None:
+        status, response = call(request.next_chunk)
+        if status:
+            logger.debug(
+                "Uploaded %d of %d bytes",
+                status.resumable_progress,
+                status.total_size,
+            )
+    return response
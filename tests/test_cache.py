@@ -0,0 +1,64 @@
+import os
+
+from gskeleton.cache import DownloadCache
+
+
+def write_bytes(n):
+    def write(path):
+        with open(path, "wb") as f:
+            f.write(b"x" * n)
+
+    return write
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = DownloadCache(str(tmp_path))
+    assert cache.get("key", "v1") is None
+    path = cache.put("key", "v1", write_bytes(10))
+    assert os.path.getsize(path) == 10
+    assert cache.get("key", "v1") == path
+    assert cache.get("key", "v2") is None
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 2,
+        "entries": 1,
+        "bytes": 10,
+    }
+
+
+def test_cache_replaces_old_versions(tmp_path):
+    cache = DownloadCache(str(tmp_path))
+    old_path = cache.put("key", "v1", write_bytes(10))
+    new_path = cache.put("key", "v2", write_bytes(20))
+    assert not os.path.exists(old_path)
+    assert cache.get("key", "v2") == new_path
+    assert cache.stats()["entries"] == 1
+
+
+def test_cache_lru_eviction(tmp_path):
+    cache = DownloadCache(str(tmp_path), max_bytes=25)
+    a = cache.put("a", "v", write_bytes(10))
+    os.utime(a, (1, 1))
+    b = cache.put("b", "v", write_bytes(10))
+    os.utime(b, (2, 2))
+    assert cache.get("a", "v") == a
+    cache.put("c", "v", write_bytes(10))
+    assert os.path.exists(a)
+    assert not os.path.exists(b)
+    assert cache.stats()["bytes"] == 20
+
+
+def test_cache_failed_write_leaves_no_entry(tmp_path):
+    cache = DownloadCache(str(tmp_path))
+
+    def failing_write(path):
+        with open(path, "wb") as f:
+            f.write(b"partial")
+        raise IOError("connection reset")
+
+    try:
+        cache.put("key", "v1", failing_write)
+    except IOError:
+        pass
+    assert cache.get("key", "v1") is None
+    assert os.listdir(tmp_path) == []
@@ -1,13 +1,41 @@
+import json
+import os
+import re
+import shutil
+import sqlite3
+from datetime import date, datetime, time
+
+import openpyxl
 import pandas as pd
 import pytest
 
-from gskeleton.drive_etl import DriveETL, GFile, GFileSelector, GFolder
+from gskeleton.drive_etl import (
+    BULK_LOAD_PROFILE,
+    CellBox,
+    Database,
+    DriveETL,
+    ETLConfig,
+    Extractor,
+    GFile,
+    GFileSelector,
+    GFolder,
+    Loader,
+    Sheet,
+    SQLiteProfile,
+    Table,
+    TableIndex,
+    Transformer,
+)
+from gskeleton.metrics import RunMetrics
 
 
 class MockedListFile:
     def __init__(self, get_list):
         self.GetList = lambda: get_list
 
+    def __iter__(self):
+        yield self.GetList()
+
 
 class MockedCreateFile:
     def __init__(self):
@@ -179,3 +207,951 @@ def test_sqlite_init(mocker):
     ]
 
     etl._close_db()
+
+
+class MockedWorksheet:
+    def __init__(self, values, title=None):
+        self.title = title
+        self.values = values
+        self.col_count = 26
+        self.get_all_values = lambda: values
+
+
+def col_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+class MockedWorkbook:
+    def __init__(self, key, sheets):
+        self.id = key
+        self.sheets = sheets
+        for title, worksheet in sheets.items():
+            worksheet.title = title
+        self.requested_ranges = []
+
+    def worksheets(self):
+        return list(self.sheets.values())
+
+    def values_batch_get(self, ranges):
+        self.requested_ranges += ranges
+        value_ranges = []
+        for a1_range in ranges:
+            title, cells = a1_range.rsplit("!", 1)
+            values = self.sheets[title[1:-1].replace("''", "'")].values
+            start, end = cells.split(":")
+            start_col, start_row = re.match(r"([A-Z]+)(\d+)", start).groups()
+            end_col, end_row = re.match(r"([A-Z]+)(\d*)", end).groups()
+            rows = values[int(start_row) - 1 : int(end_row or len(values))]
+            block = [
+                row[col_index(start_col) : col_index(end_col) + 1]
+                for row in rows
+            ]
+            while block and not any(block[-1]):
+                block.pop()
+            block = [
+                row[: max([i + 1 for i, v in enumerate(row) if v] or [0])]
+                for row in block
+            ]
+            value_ranges.append({"range": a1_range, "values": block})
+        return {"valueRanges": value_ranges}
+
+
+def mocked_workbooks(n_files):
+    workbooks = {}
+    for i in range(n_files):
+        users = [["User ID", "Name"]] + [
+            [f"{i}-{j}", f"name {j}"] for j in range(i % 3 + 1)
+        ]
+        orders = [["Order", "Total"], [f"o{i}", str(i * 10)]]
+        workbooks[f"{i}key"] = MockedWorkbook(
+            f"{i}key",
+            {
+                "Users": MockedWorksheet(users),
+                "Orders": MockedWorksheet(orders),
+            },
+        )
+    return workbooks
+
+
+def extracted_rows(etl, table_name):
+    cursor = etl._db_conn.cursor()
+    cursor.execute(f"SELECT * FROM {table_name};")
+    return cursor.fetchall()
+
+
+def test_extract_tables_concurrent_matches_sequential(mocker):
+    workbooks = mocked_workbooks(12)
+    files = [GFile(key=key) for key in workbooks]
+    extractor = Extractor(
+        name="users_and_orders",
+        inputs=GFileSelector(
+            folder=GFolder(key="folder"), extension="gsheet"
+        ),
+        tables=[
+            Table(name="users", sheet=Sheet(name="Users")),
+            Table(name="orders", sheet=Sheet(index=1)),
+        ],
+    )
+    results = {}
+    for workers in [1, 4]:
+        etl = DriveETL()
+        etl.config = ETLConfig(workers=workers)
+        etl.gspread_client = mocker.Mock()
+        etl.gspread_client.open_by_key.side_effect = workbooks.get
+        mocker.patch.object(etl, "_select_files", return_value=files)
+        etl._db_conn = sqlite3.connect(":memory:")
+        etl._extract_tables(extractor)
+        results[workers] = (
+            extracted_rows(etl, "users"),
+            extracted_rows(etl, "orders"),
+        )
+        etl._close_db()
+    assert results[1] == results[4]
+    assert results[4][0][:3] == [
+        ("0-0", "name 0"),
+        ("1-0", "name 0"),
+        ("1-1", "name 1"),
+    ]
+    assert len(results[4][1]) == 12
+
+
+def test_extract_tables_twice_under_dependent_view(mocker):
+    workbooks = mocked_workbooks(2)
+    extractor = Extractor(
+        name="users",
+        inputs=GFileSelector(
+            folder=GFolder(key="folder"), extension="gsheet"
+        ),
+        tables=[Table(name="users", sheet=Sheet(name="Users"))],
+    )
+    etl = DriveETL()
+    etl.gspread_client = mocker.Mock()
+    etl.gspread_client.open_by_key.side_effect = workbooks.get
+    files = [GFile(key=key) for key in workbooks]
+    mocker.patch.object(etl, "_select_files", return_value=files)
+    etl._db_conn = sqlite3.connect(":memory:")
+    for _ in range(2):
+        etl._extract_tables(extractor)
+        etl._db_conn.execute(
+            'CREATE VIEW IF NOT EXISTS names AS SELECT "Name" FROM users;'
+        )
+    assert len(extracted_rows(etl, "names")) == 3
+    etl._close_db()
+
+
+def test_extract_tables_concurrent_failure(mocker):
+    workbooks = mocked_workbooks(20)
+    files = [GFile(key=key) for key in workbooks]
+    opened = []
+
+    def open_by_key(key):
+        opened.append(key)
+        if key == "2key":
+            raise ValueError("cannot open 2key")
+        return workbooks[key]
+
+    extractor = Extractor(
+        name="users",
+        inputs=GFileSelector(
+            folder=GFolder(key="folder"), extension="gsheet"
+        ),
+        tables=[Table(name="users", sheet=Sheet(name="Users"))],
+        workers=2,
+    )
+    etl = DriveETL()
+    etl.gspread_client = mocker.Mock()
+    etl.gspread_client.open_by_key.side_effect = open_by_key
+    mocker.patch.object(etl, "_select_files", return_value=files)
+    etl._db_conn = sqlite3.connect(":memory:")
+    with pytest.raises(ValueError):
+        etl._extract_tables(extractor)
+    assert len(opened) < len(files)
+    etl._close_db()
+
+
+def test_extract_tables_incremental(mocker):
+    workbooks = mocked_workbooks(3)
+    listing = [
+        {"id": key, "md5Checksum": None, "modifiedDate": "1"}
+        for key in workbooks
+    ]
+    extractor = Extractor(
+        name="users",
+        inputs=GFileSelector(
+            folder=GFolder(key="folder"), extension="gsheet"
+        ),
+        tables=[Table(name="users", sheet=Sheet(name="Users"))],
+        incremental=True,
+    )
+    etl = DriveETL()
+    etl.gspread_client = mocker.Mock()
+    etl.gspread_client.open_by_key.side_effect = workbooks.get
+    mocker.patch.object(etl, "_list_files", return_value=listing)
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._extract_tables(extractor)
+    assert etl.gspread_client.open_by_key.call_count == 3
+    assert len(extracted_rows(etl, "users")) == 6
+
+    etl.gspread_client.open_by_key.reset_mock()
+    etl._extract_tables(extractor)
+    assert etl.gspread_client.open_by_key.call_count == 0
+    assert len(extracted_rows(etl, "users")) == 6
+
+    workbooks["1key"].sheets["Users"] = MockedWorksheet(
+        [["User ID", "Name"], ["1-9", "changed"]], title="Users"
+    )
+    listing[1]["modifiedDate"] = "2"
+    del listing[2]
+    etl._extract_tables(extractor)
+    assert etl.gspread_client.open_by_key.call_args_list == [
+        mocker.call("1key")
+    ]
+    assert extracted_rows(etl, "users") == [
+        ("0-0", "name 0", "0key"),
+        ("1-9", "changed", "1key"),
+    ]
+    cursor = etl._db_conn.cursor()
+    cursor.execute("SELECT file_key, row_count FROM _gskeleton_manifest;")
+    assert sorted(cursor.fetchall()) == [("0key", 1), ("1key", 1)]
+    etl._close_db()
+
+
+def test_extract_tables_sharded(mocker):
+    workbooks = mocked_workbooks(3)
+    listing = [
+        {"id": key, "md5Checksum": None, "modifiedDate": "1"}
+        for key in workbooks
+    ]
+    extractor = Extractor(
+        name="users",
+        inputs=GFileSelector(
+            folder=GFolder(key="folder"), extension="gsheet"
+        ),
+        tables=[
+            Table(
+                name="users",
+                sheet=Sheet(name="Users"),
+                indexes=[TableIndex(columns=["name"])],
+            )
+        ],
+        sharded=True,
+    )
+    etl = DriveETL()
+    etl.gspread_client = mocker.Mock()
+    etl.gspread_client.open_by_key.side_effect = workbooks.get
+    mocker.patch.object(etl, "_list_files", return_value=listing)
+    etl._db_conn = sqlite3.connect(":memory:")
+
+    def objects(object_type):
+        cursor = etl._db_conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = ? ORDER BY name;",
+            (object_type,),
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    etl._extract_tables(extractor)
+    etl._create_indexes(extractor)
+    assert etl.gspread_client.open_by_key.call_count == 3
+    assert objects("view") == ["users"]
+    assert objects("index")[:3] == sorted(
+        f"ix_users_name_{etl._get_shard_key('users', key)}"
+        for key in ["0key", "1key", "2key"]
+    )
+    assert extracted_rows(etl, "users")[:2] == [
+        ("0-0", "name 0", "0key", "1"),
+        ("1-0", "name 0", "1key", "1"),
+    ]
+    assert len(extracted_rows(etl, "users")) == 6
+
+    etl.gspread_client.open_by_key.reset_mock()
+    etl._extract_tables(extractor)
+    assert etl.gspread_client.open_by_key.call_count == 0
+
+    workbooks["1key"].sheets["Users"] = MockedWorksheet(
+        [["User ID", "Name", "Email"], ["1-9", "changed", "a@b"]],
+        title="Users",
+    )
+    listing[1]["modifiedDate"] = "2"
+    del listing[2]
+    etl._extract_tables(extractor)
+    assert etl.gspread_client.open_by_key.call_args_list == [
+        mocker.call("1key")
+    ]
+    assert extracted_rows(etl, "users") == [
+        ("0-0", "name 0", None, "0key", "1"),
+        ("1-9", "changed", "a@b", "1key", "2"),
+    ]
+    assert objects("table") == ["_gskeleton_manifest"] + sorted(
+        etl._get_shard_name("users", key) for key in ["0key", "1key"]
+    )
+    assert etl._get_shard_name("users", "0key").startswith(
+        "_gskeleton_shard_users_"
+    )
+    assert etl._get_shard_name("a_b", "c") != etl._get_shard_name("a", "b_c")
+    cursor = etl._db_conn.execute(
+        "SELECT name FROM users WHERE _source_key = '1key';"
+    )
+    assert cursor.fetchall() == [("changed",)]
+
+    etl._extract_tables(extractor.model_copy(update={"sharded": False}))
+    assert objects("view") == []
+    assert objects("table") == ["_gskeleton_manifest", "users"]
+    assert len(extracted_rows(etl, "users")) == 2
+
+    selects = [f"SELECT {i} AS n" for i in range(1200)]
+    union = etl._union_all(selects)
+    cursor = etl._db_conn.execute(f"SELECT COUNT(*), SUM(n) FROM ({union});")
+    assert cursor.fetchone() == (1200, sum(range(1200)))
+    etl._close_db()
+
+
+class MockedCachedFile:
+    def __init__(self, downloads):
+        self.downloads = downloads
+
+    def FetchMetadata(self, fields=None, fetch_all=None):
+        self.metadata = {"md5Checksum": "abc", "modifiedDate": "1"}
+
+    def GetContentFile(self, path):
+        self.downloads.append(path)
+        with open(path, "w") as f:
+            f.write("mocked content")
+
+
+def test_download_drive_file_cache(mocker, tmp_path):
+    downloads = []
+    etl = DriveETL(cache_dir=str(tmp_path / "cache"))
+    etl.drive = mocker.Mock()
+    etl.drive.CreateFile.side_effect = lambda x: MockedCachedFile(downloads)
+    path = etl._download_drive_file(GFile(key="1key"))
+    assert etl._download_drive_file(GFile(key="1key")) == path
+    copy_path = str(tmp_path / "copy.db")
+    assert etl._download_drive_file(GFile(key="1key"), copy_path) == copy_path
+    with open(copy_path) as f:
+        assert f.read() == "mocked content"
+    assert len(downloads) == 1
+    assert etl.cache.stats()["hits"] == 2
+
+
+def test_insert_frame_reconciles_columns():
+    etl = DriveETL()
+    etl.config = ETLConfig(chunksize=2)
+    etl._db_conn = sqlite3.connect(":memory:")
+    first = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]})
+    second = pd.DataFrame(
+        {
+            "c": [pd.Timestamp("2024-01-02 03:04:05"), pd.NaT],
+            "a": [4.5, None],
+        }
+    )
+    etl._insert_frame("t", first)
+    etl._insert_frame("t", second)
+    assert etl._get_table_columns("t") == ["a", "b", "c"]
+    assert extracted_rows(etl, "t") == [
+        (1, "x", None),
+        (2, "y", None),
+        (3, "z", None),
+        (4.5, None, "2024-01-02 03:04:05"),
+        (None, None, None),
+    ]
+    etl._close_db()
+
+
+def pragma(etl, name):
+    return etl._db_conn.execute(f"PRAGMA {name};").fetchone()[0]
+
+
+def test_run_extractors_profile_and_indexes(mocker, tmp_path):
+    workbooks = mocked_workbooks(3)
+    extractor = Extractor(
+        name="users",
+        inputs=GFileSelector(
+            folder=GFolder(key="folder"), extension="gsheet"
+        ),
+        tables=[
+            Table(
+                name="users",
+                sheet=Sheet(name="Users"),
+                indexes=[
+                    TableIndex(columns=["user_id"], unique=True),
+                    TableIndex(columns=["name", "user_id"], name="by_name"),
+                ],
+            )
+        ],
+    )
+    etl = DriveETL()
+    etl.config = ETLConfig(
+        db=Database(key="db", profile=SQLiteProfile(synchronous="normal")),
+        extractors=[extractor],
+    )
+    etl.gspread_client = mocker.Mock()
+    etl.gspread_client.open_by_key.side_effect = workbooks.get
+    mocker.patch.object(
+        etl, "_select_files", return_value=[GFile(key=k) for k in workbooks]
+    )
+    etl._db_conn = sqlite3.connect(str(tmp_path / "etl.db"))
+    synchronous = []
+    insert_frame = etl._insert_frame
+
+    def spy_insert_frame(table_name, df):
+        synchronous.append(pragma(etl, "synchronous"))
+        return insert_frame(table_name, df)
+
+    mocker.patch.object(etl, "_insert_frame", side_effect=spy_insert_frame)
+    etl._run_extractors()
+    assert synchronous == [0, 0, 0]
+    assert pragma(etl, "synchronous") == 1
+    assert pragma(etl, "journal_mode") == "delete"
+    assert pragma(etl, "temp_store") == 0
+    indexes = etl._db_conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+        "ORDER BY name;"
+    ).fetchall()
+    assert indexes == [
+        ("by_name", 'CREATE INDEX "by_name" ON "users" ("name", "user_id")'),
+        (
+            "ix_users_user_id",
+            'CREATE UNIQUE INDEX "ix_users_user_id" ON "users" ("user_id")',
+        ),
+    ]
+    etl._close_db()
+
+
+def test_apply_profile_rejects_unknown_values():
+    etl = DriveETL()
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._apply_profile(BULK_LOAD_PROFILE)
+    assert pragma(etl, "synchronous") == 0
+    with pytest.raises(ValueError):
+        etl._apply_profile(SQLiteProfile(journal_mode="wal; DROP TABLE x"))
+    etl._close_db()
+
+
+def test_parse_file_coerces_column_types():
+    extractor = Extractor(
+        name="users",
+        inputs=GFileSelector(folder=GFolder(key="folder")),
+        tables=[
+            Table(
+                name="users",
+                column_types={"User ID": "int", "active": "bool"},
+                infer_types=True,
+            )
+        ],
+    )
+    values = pd.DataFrame(
+        [
+            ["User ID", "Active", "Score", "Joined", "Name"],
+            ["1", "TRUE", "1.5", "2024-01-02", "a"],
+            ["2.0", "no", "2", "2024-02-03", ""],
+            ["x", "maybe", "", "", "c"],
+        ]
+    )
+    etl = DriveETL()
+    df = etl._parse_file(extractor, [values])[0]
+    assert df.dtypes.astype(str).to_dict() == {
+        "user_id": "Int64",
+        "active": "boolean",
+        "score": "float64",
+        "joined": "datetime64[ns]",
+        "name": "object",
+    }
+    assert df["user_id"].tolist()[:2] == [1, 2]
+    assert df["user_id"].isna().tolist() == [False, False, True]
+    assert df["name"].tolist() == ["a", "", "c"]
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._insert_frame("users", df)
+    assert extracted_rows(etl, "users") == [
+        (1, 1, 1.5, "2024-01-02 00:00:00", "a"),
+        (2, 0, 2.0, "2024-02-03 00:00:00", ""),
+        (None, None, None, None, "c"),
+    ]
+    etl._close_db()
+    assert etl.metrics.report()["coercion_failures"] == {
+        "users": {
+            "user_id": {"rows": 1, "examples": ["x"]},
+            "active": {"rows": 1, "examples": ["maybe"]},
+        }
+    }
+
+
+def test_parse_file_infers_types_once_per_table():
+    extractor = Extractor(
+        name="events",
+        inputs=GFileSelector(folder=GFolder(key="folder")),
+        tables=[Table(name="events", infer_types=True)],
+    )
+    first = pd.DataFrame(
+        [["id", "when", "note"], ["1", "2024-01-02", ""], ["2", "", ""]]
+    )
+    second = pd.DataFrame(
+        [["id", "when", "note"], ["x3", "tbd", "5"], ["4", "2024-01-05", ""]]
+    )
+    etl = DriveETL()
+    etl._parse_file(extractor, [first])
+    df = etl._parse_file(extractor, [second])[0]
+    assert df.dtypes.astype(str).to_dict() == {
+        "id": "Int64",
+        "when": "datetime64[ns]",
+        "note": "Int64",
+    }
+    assert df["id"].isna().tolist() == [True, False]
+    assert etl.metrics.report()["coercion_failures"] == {
+        "events": {
+            "id": {"rows": 1, "examples": ["x3"]},
+            "when": {"rows": 1, "examples": ["tbd"]},
+        }
+    }
+    with pytest.raises(ValueError):
+        Table(name="events", column_types={"id": "integer"})
+
+
+def test_run_transformers_skips_unchanged_units(tmp_path):
+    etl = DriveETL()
+    etl.config = ETLConfig(
+        db=Database(key="db"),
+        memoize_transformers=True,
+        transformers=[
+            Transformer(sql_command=sql)
+            for sql in [
+                "DROP TABLE IF EXISTS x;",
+                "CREATE TABLE x AS SELECT a * 2 AS a FROM a;",
+                "DROP TABLE IF EXISTS y;",
+                "CREATE TABLE y AS SELECT * FROM b;",
+                "DROP TABLE IF EXISTS z;",
+                "CREATE TABLE z AS SELECT x.a FROM x JOIN y ON x.a = y.b;",
+            ]
+        ],
+    )
+    etl._db_conn = sqlite3.connect(str(tmp_path / "etl.db"))
+    with etl._db_conn:
+        etl._db_conn.execute("CREATE TABLE a (a INTEGER);")
+        etl._db_conn.execute("CREATE TABLE b (b INTEGER);")
+        etl._db_conn.executemany("INSERT INTO a VALUES (?);", [(1,), (2,)])
+        etl._db_conn.executemany("INSERT INTO b VALUES (?);", [(2,), (3,)])
+
+    def run():
+        etl.metrics = RunMetrics()
+        etl._run_transformers()
+        return [s["index"] for s in etl.metrics.stages]
+
+    assert run() == [0, 1, 2, 3, 4, 5]
+    assert run() == []
+    assert etl.metrics.counters["transformer.skipped"] == 6
+    with etl._db_conn:
+        etl._db_conn.execute("INSERT INTO b VALUES (4);")
+    assert run() == [2, 3, 4, 5]
+    assert extracted_rows(etl, "z") == [(2,), (4,)]
+    with etl._db_conn:
+        etl._db_conn.execute("DELETE FROM z;")
+    assert run() == [4, 5]
+    plan = etl._format_transform_plan().splitlines()
+    assert plan[:3] == [
+        "0 of 3 transformer steps run",
+        "[fresh] x <- a",
+        "  #0 DROP TABLE IF EXISTS x",
+    ]
+    assert "      SCAN a" in plan
+    etl.config.transformers[1].sql_command = "CREATE TABLE x AS SELECT 1;"
+    assert etl._format_transform_plan().splitlines()[0] == (
+        "2 of 3 transformer steps run"
+    )
+    etl._close_db()
+
+
+def test_update_db_source_vacuum(mocker, tmp_path):
+    db_path = str(tmp_path / "etl.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE t AS SELECT zeroblob(100000) AS b;")
+        conn.execute("DELETE FROM t;")
+    conn.close()
+    size = os.path.getsize(db_path)
+    etl = DriveETL()
+    etl.config = ETLConfig(db=Database(key="db", update=True, vacuum=True))
+    etl._conn_path = db_path
+    update = mocker.patch.object(etl, "_update_file")
+    etl._update_db_source()
+    update.assert_called_once_with(db_path, "db")
+    assert os.path.getsize(db_path) < size
+
+
+def test_get_workbook_values_matches_full_sheet():
+    values = [
+        ["Report", "", "", "", ""],
+        ["", "", "", "", ""],
+        ["ID", "Name", "Price", "Notes", "Extra"],
+        ["1", "a", "10", "", "x"],
+        ["2", "b", "20", "n", ""],
+        ["3", "c", "", "", ""],
+    ]
+    workbook = MockedWorkbook(
+        "key", {"It's": MockedWorksheet(values), "Other": MockedWorksheet([])}
+    )
+    etl = DriveETL()
+    boxes = [
+        CellBox(),
+        CellBox(header_row=2, start_row=3),
+        CellBox(header_row=2, start_row=3, end_row=5),
+        CellBox(header_row=2, start_row=4, start_col=1, end_col=2),
+        CellBox(header_row=2, start_row=3, start_col=1, end_col=0),
+        CellBox(header_row=2, start_row=3, end_row=-1, end_col=3),
+    ]
+    sheets = [Sheet(name="It's", box=box) for box in boxes]
+    dfs = etl._get_workbook_values(workbook, sheets)
+    assert len(workbook.requested_ranges) == len(boxes)
+    assert workbook.requested_ranges[1] == "'It''s'!A3:Z"
+    assert workbook.requested_ranges[3] == "'It''s'!B3:C"
+    for box, df in zip(boxes, dfs):
+        expected = etl._get_df_box(pd.DataFrame(values), box)
+        actual = etl._get_df_box(df, box)
+        pd.testing.assert_frame_equal(actual, expected)
+    with pytest.raises(ValueError):
+        etl._get_workbook_values(workbook, [Sheet(index=2)])
+
+
+def test_get_xlsx_sheets_matches_full_sheet(tmp_path):
+    path = str(tmp_path / "input.xlsx")
+    values = pd.DataFrame(
+        [
+            ["Report", None, None, None, None],
+            [None, None, None, None, None],
+            ["ID", "Name", "Price", "Notes", "Extra"],
+            [1, "a", 10, None, "x"],
+            [2, "b", 20, "n", None],
+            [3, "c", None, None, None],
+        ]
+    )
+    with pd.ExcelWriter(path) as writer:
+        for sheet_name in ["Data", "Copy"]:
+            values.to_excel(
+                writer, sheet_name=sheet_name, header=False, index=False
+            )
+    boxes = [
+        CellBox(header_row=2, start_row=3),
+        CellBox(header_row=2, start_row=3, end_row=5),
+        CellBox(header_row=2, start_row=4, start_col=1, end_col=2),
+        CellBox(header_row=2, start_row=3, start_col=1, end_col=0),
+        CellBox(header_row=2, start_row=3, end_row=-1, end_col=3),
+    ]
+    sheets = [Sheet(name="Data", box=box) for box in boxes]
+    sheets.append(Sheet(index=1, box=boxes[2]))
+    etl = DriveETL()
+    with pd.ExcelFile(path) as excel:
+        dfs = etl._get_xlsx_sheets(excel, sheets)
+        for sheet, df in zip(sheets, dfs):
+            full = excel.parse(
+                sheet_name=sheet.name or excel.sheet_names[sheet.index],
+                header=None,
+                index_col=None,
+                keep_default_na=False,
+            )
+            expected = etl._get_df_box(full, sheet.box)
+            pd.testing.assert_frame_equal(df, expected)
+
+
+def test_extract_tables_xlsx_dates_and_times(mocker, tmp_path):
+    path = str(tmp_path / "times.xlsx")
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Data"
+    sheet.append(["Event", "Starts", "Day", "At"])
+    sheet.append(["standup", time(9, 30), date(2024, 5, 1), None])
+    sheet.append(["review", "", None, datetime(2024, 5, 2, 14, 15)])
+    workbook.save(path)
+    extractor = Extractor(
+        name="events",
+        inputs=GFileSelector(folder=GFolder(key="folder"), extension="xlsx"),
+        tables=[Table(name="events", sheet=Sheet(name="Data"))],
+    )
+    etl = DriveETL()
+    mocker.patch.object(etl, "_select_files", return_value=[GFile(key="k")])
+    mocker.patch.object(etl, "_download_drive_file", return_value=path)
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._extract_tables(extractor)
+    assert extracted_rows(etl, "events") == [
+        ("standup", "09:30:00.000000", "2024-05-01 00:00:00", ""),
+        ("review", "", "", "2024-05-02 14:15:00"),
+    ]
+    etl._close_db()
+
+
+def test_load_tables_xlsx_single_pass(mocker, tmp_path):
+    template_path = str(tmp_path / "template.xlsx")
+    with pd.ExcelWriter(template_path) as writer:
+        pd.DataFrame({"Name": ["seed"], "Active": [True]}).to_excel(
+            writer, sheet_name="Users", index=False
+        )
+        pd.DataFrame(columns=["Order", "Order"]).to_excel(
+            writer, sheet_name="Orders", index=False
+        )
+        pd.DataFrame({"Notes": ["kept"]}).to_excel(
+            writer, sheet_name="Notes", index=False
+        )
+    etl = DriveETL()
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._db_conn.executescript(
+        """CREATE TABLE users (name TEXT, active TEXT);
+           INSERT INTO users VALUES ('a', 'TRUE'), ('b', 'false');
+           CREATE TABLE orders (first TEXT, second TEXT);
+           INSERT INTO orders VALUES ('o1', 'o2');
+           CREATE TABLE empty (x TEXT);"""
+    )
+    mocker.patch.object(
+        etl,
+        "_download_drive_file",
+        side_effect=lambda file, path: shutil.copyfile(template_path, path),
+    )
+    upload = mocker.patch.object(etl, "_upload_to_folder")
+    writer = mocker.spy(pd, "ExcelWriter")
+    loader = Loader(
+        name=str(tmp_path / "report"),
+        extension="xlsx",
+        template=GFile(key="template"),
+        exports=GFolder(key="exports"),
+        tables=[
+            Table(name="users", sheet=Sheet(name="Users")),
+            Table(name="orders", sheet=Sheet(index=1)),
+            Table(name="empty", sheet=Sheet(name="Notes")),
+        ],
+    )
+    etl._load_tables(loader)
+    assert writer.call_count == 1
+    load_path = upload.call_args[0][0]
+    sheets = pd.read_excel(load_path, sheet_name=None)
+    assert sheets["Users"].to_dict("list") == {
+        "Name": ["seed", "a", "b"],
+        "Active": [True, True, False],
+    }
+    assert list(sheets["Orders"].columns) == ["Order", "Order.1"]
+    assert sheets["Orders"].values.tolist() == [["o1", "o2"]]
+    assert sheets["Notes"].to_dict("list") == {"Notes": ["kept"]}
+    etl._close_db()
+
+
+def test_run_loaders_concurrent_matches_sequential(mocker, tmp_path):
+    loaders = [
+        Loader(
+            name=str(tmp_path / f"{workers}_report_{i}"),
+            extension="xlsx",
+            exports=GFolder(key="exports"),
+            tables=[Table(name="users"), Table(name=f"orders_{i}")],
+        )
+        for workers in [1, 4]
+        for i in range(6)
+    ]
+    outputs = {}
+    for workers in [1, 4]:
+        etl = DriveETL()
+        etl.config = ETLConfig(
+            loaders=[ld for ld in loaders if f"{workers}_report" in ld.name],
+            loader_workers=workers,
+        )
+        etl._db_conn = sqlite3.connect(":memory:")
+        etl._db_conn.execute("CREATE TABLE users (name TEXT, n INTEGER);")
+        etl._db_conn.executemany(
+            "INSERT INTO users VALUES (?, ?);", [("a", 1), ("b", 2)]
+        )
+        for i in range(6):
+            etl._db_conn.execute(
+                f"CREATE TABLE orders_{i} AS SELECT {i} AS id, name "
+                f"FROM users;"
+            )
+        upload = mocker.patch.object(etl, "_upload_to_folder")
+        etl._run_loaders()
+        outputs[workers] = sorted(
+            (
+                call[0][0].split("_report_")[1],
+                {
+                    name: df.to_dict("list")
+                    for name, df in pd.read_excel(
+                        call[0][0], sheet_name=None
+                    ).items()
+                },
+            )
+            for call in upload.call_args_list
+        )
+        assert [s["status"] for s in etl.metrics.stages] == ["ok"] * 6
+        etl._close_db()
+    assert outputs[1] == outputs[4]
+    assert len(outputs[4]) == 6
+
+
+def test_run_loaders_concurrent_failure(mocker, tmp_path):
+    etl = DriveETL(work_dir=str(tmp_path))
+    etl.config = ETLConfig(
+        loaders=[
+            Loader(
+                name=str(tmp_path / f"report_{i}"),
+                extension="xlsx",
+                exports=GFolder(key="exports"),
+                tables=[Table(name="users")],
+            )
+            for i in range(4)
+        ],
+        loader_workers=2,
+    )
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._db_conn.execute("CREATE TABLE users AS SELECT 'a' AS name;")
+
+    def upload(path, key):
+        if "report_1" in path:
+            raise RuntimeError("upload failed")
+
+    mocker.patch.object(etl, "_upload_to_folder", side_effect=upload)
+    snapshot = mocker.spy(etl, "_snapshot_db")
+    with pytest.raises(RuntimeError, match="upload failed"):
+        etl._run_loaders()
+    failed = [s for s in etl.metrics.stages if s["status"] == "failed"]
+    assert [s["name"] for s in failed] == [str(tmp_path / "report_1")]
+    assert os.path.dirname(snapshot.spy_return) == str(tmp_path)
+    assert not os.path.exists(snapshot.spy_return)
+    assert extracted_rows(etl, "users") == [("a",)]
+    etl._close_db()
+
+
+def test_load_tables_xlsx_skips_empty_tables(mocker, tmp_path):
+    etl = DriveETL()
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._db_conn.execute("CREATE TABLE empty (n INTEGER);")
+    upload = mocker.patch.object(etl, "_upload_to_folder")
+    loader = Loader(
+        name=str(tmp_path / "empty"),
+        extension="xlsx",
+        exports=GFolder(key="exports"),
+        tables=[Table(name="empty")],
+    )
+    etl._load_tables(loader)
+    assert not upload.called
+    assert os.listdir(tmp_path) == []
+    etl._close_db()
+
+
+def test_load_tables_xlsx_streams_chunks(mocker, tmp_path):
+    etl = DriveETL()
+    etl.config = ETLConfig(chunksize=2)
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._db_conn.execute("CREATE TABLE numbers (n INTEGER, label TEXT);")
+    etl._db_conn.executemany(
+        "INSERT INTO numbers VALUES (?, ?);",
+        [(i, f"n{i}") for i in range(5)],
+    )
+    chunks = list(etl._iter_table_chunks("numbers"))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert list(chunks[0].columns) == ["n", "label"]
+
+    upload = mocker.patch.object(etl, "_upload_to_folder")
+    loader = Loader(
+        name=str(tmp_path / "numbers"),
+        extension="xlsx",
+        exports=GFolder(key="exports"),
+        tables=[Table(name="numbers")],
+    )
+    etl._load_tables(loader)
+    sheets = pd.read_excel(upload.call_args[0][0], sheet_name=None)
+    assert sheets["numbers"].to_dict("list") == {
+        "n": [0, 1, 2, 3, 4],
+        "label": ["n0", "n1", "n2", "n3", "n4"],
+    }
+    etl._close_db()
+
+
+def test_load_tables_streaming_exports(mocker, tmp_path):
+    etl = DriveETL()
+    etl.config = ETLConfig(chunksize=2)
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._db_conn.execute("CREATE TABLE numbers (n INTEGER, label TEXT);")
+    etl._db_conn.executemany(
+        "INSERT INTO numbers VALUES (?, ?);",
+        [(i, f"n,{i}") for i in range(5)] + [(None, "é")],
+    )
+    etl._db_conn.execute(
+        "CREATE VIEW evens AS SELECT * FROM numbers WHERE n % 2 = 0;"
+    )
+    upload = mocker.patch.object(etl, "_upload_to_folder")
+
+    def load(extension, tables, compression=None):
+        upload.reset_mock()
+        etl._load_tables(
+            Loader(
+                name=str(tmp_path / extension),
+                extension=extension,
+                compression=compression,
+                exports=GFolder(key="exports"),
+                tables=[Table(name=name) for name in tables],
+            )
+        )
+        return [call[0][0] for call in upload.call_args_list]
+
+    (path,) = load("csv", ["numbers"], compression="gzip")
+    assert path.endswith(".csv.gz")
+    df = pd.read_csv(path)
+    assert df["label"].tolist() == [f"n,{i}" for i in range(5)] + ["é"]
+    with open(path, "rb") as stream:
+        first = stream.read()
+    load("csv", ["numbers"], compression="gzip")
+    with open(path, "rb") as stream:
+        assert stream.read() == first
+
+    paths = load("jsonl", ["numbers", "evens"])
+    assert [os.path.basename(p).split("_")[1] for p in paths] == [
+        "numbers",
+        "evens",
+    ]
+    with open(paths[1], encoding="utf-8") as stream:
+        assert [json.loads(line) for line in stream] == [
+            {"n": 0, "label": "n,0"},
+            {"n": 2, "label": "n,2"},
+            {"n": 4, "label": "n,4"},
+        ]
+
+    (path,) = load("db", ["numbers", "evens"])
+    with sqlite3.connect(path) as export:
+        names = export.execute(
+            "SELECT name, type FROM sqlite_master ORDER BY name;"
+        ).fetchall()
+        assert names == [("evens", "table"), ("numbers", "table")]
+        columns = export.execute("PRAGMA table_info(numbers);").fetchall()
+        assert [(c[1], c[2]) for c in columns] == [
+            ("n", "INTEGER"),
+            ("label", "TEXT"),
+        ]
+        rows = export.execute("SELECT COUNT(*) FROM numbers;").fetchone()
+        assert rows == (6,)
+    assert etl.metrics.tables["numbers"]["out"] == 24
+
+    with pytest.raises(ValueError):
+        load("parquet", ["numbers"])
+    with pytest.raises(ValueError):
+        load("xlsx", ["numbers"], compression="gzip")
+    etl._close_db()
+
+
+def test_run_etl_config_report(mocker, tmp_path):
+    reports = []
+    etl = DriveETL(on_report=reports.append)
+    for method in [
+        "_load_config_from_file",
+        "_connect_to_db",
+        "_run_extractors",
+        "_run_transformers",
+        "_run_loaders",
+        "_close_db",
+        "_update_db_source",
+    ]:
+        mocker.patch.object(etl, method)
+    report_path = str(tmp_path / "report.json")
+    etl.run_etl_config("config_key", report_path=report_path)
+    with open(report_path) as f:
+        report = json.load(f)
+    assert report == reports[0]
+    assert report["config_key"] == "config_key"
+    assert report["status"] == "ok"
+    assert [s["stage"] for s in report["stages"]] == ["config_load", "connect"]
+
+    etl._run_extractors.side_effect = ValueError("cannot open file")
+    with pytest.raises(ValueError):
+        etl.run_etl_config("config_key", report_path=report_path)
+    assert reports[1]["status"] == "failed"
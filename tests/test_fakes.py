@@ -0,0 +1,472 @@
+import json
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+import yaml
+
+from gskeleton.drive_etl import (
+    CellBox,
+    DriveETL,
+    ETLConfig,
+    GFile,
+    GFileSelector,
+    GFolder,
+    Loader,
+    Sheet,
+    Table,
+)
+from gskeleton.fakes import (
+    FakeDrive,
+    FakeGspreadClient,
+    FakeUploadRequest,
+    generate_inputs,
+    write_gsheet,
+)
+
+
+def test_fake_drive_listing_and_transfer(tmp_path):
+    root = str(tmp_path / "drive")
+    ids = generate_inputs(root, "inputs", files=3, rows=5)
+    drive = FakeDrive(root)
+    query = {"q": "'inputs' in parents and trashed=false"}
+    files = drive.ListFile(query).GetList()
+    assert sorted(f["id"] for f in files) == sorted(ids)
+    assert drive.ListFile({"q": "'other' in parents"}).GetList() == []
+
+    source = tmp_path / "upload.csv"
+    source.write_text("a,b\n1,2\n")
+    f = drive.CreateFile({"parents": [{"id": "exports"}]})
+    f.SetContentFile(str(source))
+    f.Upload()
+    uploaded = drive.CreateFile({"id": f.metadata["id"]})
+    uploaded.FetchMetadata(fetch_all=True)
+    assert uploaded.metadata["title"] == "upload.csv"
+    assert uploaded.metadata["mimeType"] == "text/csv"
+    assert uploaded.metadata["fileSize"] == "8"
+    uploaded.GetContentFile(str(tmp_path / "download.csv"))
+    assert (tmp_path / "download.csv").read_text() == "a,b\n1,2\n"
+    assert drive.calls == {
+        "list": 2,
+        "upload": 1,
+        "metadata": 1,
+        "download": 1,
+    }
+
+
+def test_fake_gspread_values_batch_get(tmp_path):
+    root = str(tmp_path / "drive")
+    os.makedirs(os.path.join(root, "inputs"))
+    write_gsheet(
+        os.path.join(root, "inputs", "book.gsheet"),
+        {
+            "It's": [["a", "b", "c"], ["1", "", ""], ["", "", ""]],
+            "Other": [["x"]],
+        },
+    )
+    drive = FakeDrive(root)
+    key = drive.folder_files("inputs")["book.gsheet"]
+    workbook = FakeGspreadClient(drive).open_by_key(key)
+    assert [ws.title for ws in workbook.worksheets()] == ["It's", "Other"]
+    response = workbook.values_batch_get(["'It''s'!B1:C", "'Other'!A1:B5"])
+    assert [r["values"] for r in response["valueRanges"]] == [
+        [["b", "c"]],
+        [["x"]],
+    ]
+    assert workbook.worksheet("It's").get_all_values() == [
+        ["a", "b", "c"],
+        ["1", "", ""],
+    ]
+
+
+def test_run_etl_config_end_to_end(tmp_path, monkeypatch):
+    root = str(tmp_path / "drive")
+    generate_inputs(root, "inputs", files=4, rows=25, cols=5)
+    config = {
+        "extractors": [
+            {
+                "name": "inputs",
+                "inputs": {
+                    "folder": {"key": "inputs"},
+                    "extension": "gsheet",
+                },
+                "tables": [{"name": "records", "sheet": {"name": "Data"}}],
+                "workers": 2,
+            }
+        ],
+        "transformers": [
+            {
+                "sql_command": """CREATE TABLE categories AS
+                    SELECT category, COUNT(*) AS n FROM records
+                    GROUP BY category ORDER BY category;"""
+            }
+        ],
+        "loaders": [
+            {
+                "name": "categories",
+                "extension": "xlsx",
+                "exports": {"key": "exports"},
+                "tables": [{"name": "categories"}],
+            }
+        ],
+    }
+    os.makedirs(os.path.join(root, "configs"))
+    with open(os.path.join(root, "configs", "etl.yaml"), "w") as stream:
+        yaml.safe_dump(config, stream)
+    monkeypatch.chdir(tmp_path)
+    drive = FakeDrive(root)
+    etl = DriveETL()
+    etl.drive = drive
+    etl.gspread_client = FakeGspreadClient(drive)
+    etl.run_etl_config("configs", from_folder=True, report_path="report.json")
+
+    exports = drive.folder_files("exports")
+    assert list(exports) == ["categories_.xlsx"]
+    df = pd.read_excel(os.path.join(root, "exports", "categories_.xlsx"))
+    assert df["n"].sum() == 100
+    with open("report.json") as stream:
+        report = json.load(stream)
+    assert report["status"] == "ok"
+    assert report["tables"]["records"]["in"] == 100
+    assert report["counters"]["sheets.open"] == 4
+    assert etl.gspread_client.calls["values"] == 4
+
+
+def test_select_files_server_side_query(tmp_path):
+    root = str(tmp_path / "drive")
+    ids = generate_inputs(root, "inputs", files=5, rows=1)
+    for i, file_id in enumerate(sorted(ids)):
+        path = FakeDrive(root)._path(file_id)
+        os.utime(path, (1000 + i, 1000 + i))
+    (tmp_path / "drive" / "inputs" / "notes.yaml").write_text("a: 1")
+    drive = FakeDrive(root)
+    etl = DriveETL(listing_ttl=60)
+    etl.drive = drive
+    selector = GFileSelector(
+        folder=GFolder(key="inputs"), extension="gsheet", top=2, desc=True
+    )
+    requested = []
+    list_file = drive.ListFile
+    drive.ListFile = lambda param: requested.append(param) or list_file(param)
+    files = etl._select_files(selector)
+    assert [f.key for f in files] == sorted(ids)[::-1][:2]
+    assert "mimeType='application/vnd.google-apps.spreadsheet'" in (
+        requested[0]["q"]
+    )
+    assert requested[0]["orderBy"] == "modifiedDate desc"
+    assert requested[0]["maxResults"] == 2
+    assert drive.calls["list"] == 1
+
+    assert etl._select_files(selector) == files
+    assert drive.calls["list"] == 1
+    assert etl.metrics.counters["drive.list_cached"] == 1
+    etl._invalidate_listings("inputs")
+    etl._select_files(selector)
+    assert drive.calls["list"] == 2
+
+    for i in range(150):
+        (tmp_path / "drive" / "inputs" / f"note_{i}.csv").write_text("a")
+    everything = GFileSelector(folder=GFolder(key="inputs"))
+    assert len(etl._select_files(everything)) == 156
+    assert requested[-1]["maxResults"] == 1000
+    assert drive.calls["list"] == 3
+
+
+def test_resumable_upload_and_skip_unchanged(tmp_path, mocker):
+    mocker.patch("gskeleton.drive_etl.UPLOAD_CHUNKSIZE", 1024)
+    sleep = mocker.patch("gskeleton.throttle.time.sleep")
+    root = str(tmp_path / "drive")
+    os.makedirs(os.path.join(root, "exports"))
+    drive = FakeDrive(root)
+    etl = DriveETL()
+    etl.drive = drive
+    source = tmp_path / "report.csv"
+    source.write_bytes(os.urandom(5000))
+
+    drive.fail_chunks_at = {3072}
+    etl._upload_to_folder(str(source), "exports")
+    key = drive.folder_files("exports")["report.csv"]
+    with open(os.path.join(root, "exports", "report.csv"), "rb") as stream:
+        assert stream.read() == source.read_bytes()
+    assert drive.calls["upload_chunk"] == 6
+    assert drive.bytes_received == 5000
+    assert sleep.call_count == 1
+    assert etl.metrics.counters["drive.retried"] == 1
+
+    etl._upload_to_folder(str(source), "exports")
+    etl._update_file(str(source), key)
+    assert etl.metrics.counters["drive.upload_skipped"] == 2
+    assert etl.metrics.counters["drive.upload"] == 1
+
+    source.write_bytes(b"changed")
+    etl._update_file(str(source), key)
+    with open(os.path.join(root, "exports", "report.csv"), "rb") as stream:
+        assert stream.read() == b"changed"
+    assert etl.metrics.counters["drive.upload"] == 2
+    assert len(drive.folder_files("exports")) == 1
+
+
+def test_uploads_use_an_http_per_thread(tmp_path, mocker):
+    root = str(tmp_path / "drive")
+    os.makedirs(os.path.join(root, "exports"))
+    etl = DriveETL()
+    etl.drive = FakeDrive(root)
+    next_chunk = mocker.spy(FakeUploadRequest, "next_chunk")
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f"report_{i}.csv"))
+        with open(paths[-1], "w") as stream:
+            stream.write(f"a\n{i}\n")
+    etl._upload_to_folder(paths[0], "exports")
+    etl._upload_to_folder(paths[1], "exports")
+    thread = threading.Thread(
+        target=etl._upload_to_folder, args=(paths[2], "exports")
+    )
+    thread.start()
+    thread.join()
+    https = [c.kwargs["http"] for c in next_chunk.call_args_list]
+    assert len(https) == 3
+    assert https[0] is https[1]
+    assert https[2] is not https[0]
+
+
+def test_run_etl_config_spills_working_db(tmp_path, monkeypatch):
+    root = str(tmp_path / "drive")
+    generate_inputs(root, "inputs", kind="xlsx", files=2, rows=10, cols=4)
+    config = {
+        "spill_bytes": 1000,
+        "spill_dir": str(tmp_path),
+        "extractors": [
+            {
+                "name": "inputs",
+                "inputs": {"folder": {"key": "inputs"}, "extension": "xlsx"},
+                "tables": [{"name": "records", "sheet": {"name": "Data"}}],
+            }
+        ],
+        "transformers": [
+            {"sql_command": "SELECT COUNT(*) FROM records;"},
+        ],
+    }
+    os.makedirs(os.path.join(root, "configs"))
+    monkeypatch.chdir(tmp_path)
+    drive = FakeDrive(root)
+    reports = []
+    etl = DriveETL(on_report=reports.append)
+    etl.drive = drive
+
+    def run(config):
+        with open(os.path.join(root, "configs", "etl.yaml"), "w") as stream:
+            yaml.safe_dump(config, stream)
+        etl.run_etl_config(
+            "configs", from_folder=True, report_path="report.json"
+        )
+
+    run(config)
+    spill_path = reports[-1]["spill_path"]
+    assert os.path.dirname(spill_path) == str(tmp_path)
+    assert reports[-1]["counters"]["db.spilled"] == 1
+    # The config folder and the inputs, whose listing the spill estimate
+    # and the extraction share
+    assert reports[-1]["counters"]["drive.list"] == 2
+    assert reports[-1]["counters"]["drive.list_cached"] == 1
+    assert not os.path.exists(spill_path)
+
+    config["transformers"].append({"sql_command": "SELECT * FROM nothing;"})
+    with pytest.raises(Exception):
+        run(config)
+    spill_path = reports[-1]["spill_path"]
+    assert os.path.exists(spill_path)
+    with sqlite3.connect(spill_path) as conn:
+        count = conn.execute("SELECT COUNT(*) FROM records;").fetchone()
+    conn.close()
+    assert count == (20,)
+
+    config["spill_bytes"] = 10 ** 9
+    run({**config, "transformers": []})
+    assert "spill_path" not in reports[-1]
+
+
+def test_run_batch_shares_clients_and_isolates_runs(tmp_path, monkeypatch):
+    root = str(tmp_path / "drive")
+    generate_inputs(root, "inputs", kind="xlsx", files=3, rows=10, cols=4)
+    os.makedirs(os.path.join(root, "configs"))
+    os.makedirs(os.path.join(root, "exports"))
+    for name, sql in [
+        ("a", "CREATE TABLE out AS SELECT * FROM records;"),
+        ("b", "CREATE TABLE out AS SELECT name FROM records LIMIT 5;"),
+        ("c", "CREATE TABLE out AS SELECT * FROM missing;"),
+    ]:
+        config = {
+            "extractors": [
+                {
+                    "name": "inputs",
+                    "inputs": {
+                        "folder": {"key": "inputs"},
+                        "extension": "xlsx",
+                    },
+                    "tables": [{"name": "records", "sheet": {"name": "Data"}}],
+                }
+            ],
+            "transformers": [{"sql_command": sql}],
+            "loaders": [
+                {
+                    "name": name,
+                    "extension": "csv",
+                    "exports": {"key": "exports"},
+                    "tables": [{"name": "out"}],
+                }
+            ],
+        }
+        path = os.path.join(root, "configs", f"{name}.yaml")
+        with open(path, "w") as stream:
+            yaml.safe_dump(config, stream)
+    monkeypatch.chdir(tmp_path)
+    drive = FakeDrive(root)
+    reports = []
+    etl = DriveETL(cache_dir=str(tmp_path / "cache"), on_report=reports.append)
+    etl.drive = drive
+
+    summary = etl.run_batch(folder="configs", workers=3)
+    assert summary["configs"] == 3
+    assert [r["status"] for r in summary["results"]] == ["ok", "ok", "failed"]
+    assert summary["failed"] == [summary["results"][2]["config_key"]]
+    assert "missing" in summary["results"][2]["error"]
+    assert len(reports) == 3
+    assert summary["counters"]["drive.upload"] == 2
+    exports = drive.folder_files("exports")
+    assert sorted(title.split("_")[0] for title in exports) == ["a", "b"]
+    a = pd.read_csv(os.path.join(root, "exports", "a_.csv"))
+    b = pd.read_csv(os.path.join(root, "exports", "b_.csv"))
+    assert (len(a), len(b)) == (30, 5)
+    with open(f"batch_report_{etl.start_unix}.json") as stream:
+        assert json.load(stream)["failed"] == summary["failed"]
+
+    downloads = drive.calls["download"]
+    summary = etl.run_batch(
+        keys=[summary["results"][0]["config_key"]], workers=1
+    )
+    assert summary["failed"] == []
+    assert drive.calls["download"] == downloads
+    assert summary["cache"]["hits"] >= 4
+
+
+def test_gsheet_loader_batches_writes(mocker, tmp_path):
+    mocker.patch("gskeleton.drive_etl.GSHEET_PAYLOAD_BYTES", 100)
+    mocker.patch("gskeleton.throttle.time.sleep")
+    root = str(tmp_path / "drive")
+    os.makedirs(os.path.join(root, "templates"))
+    os.makedirs(os.path.join(root, "exports"))
+    write_gsheet(
+        os.path.join(root, "templates", "template.gsheet"),
+        {
+            "Report": [
+                ["Monthly report"],
+                [],
+                ["old", "header", "x"],
+                ["stale", "row", "x"],
+            ]
+        },
+    )
+    drive = FakeDrive(root)
+    gspread_client = FakeGspreadClient(drive)
+    etl = DriveETL()
+    etl.drive = drive
+    etl.gspread_client = gspread_client
+    etl.config = ETLConfig(chunksize=7)
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._db_conn.execute("CREATE TABLE numbers (n INTEGER, flag TEXT);")
+    etl._db_conn.executemany(
+        "INSERT INTO numbers VALUES (?, ?);",
+        [(i, "true" if i % 2 else None) for i in range(40)],
+    )
+    etl._db_conn.execute("CREATE TABLE extra AS SELECT 'a' AS letter;")
+    loader = Loader(
+        name="report",
+        extension="gsheet",
+        template=GFile(key=drive.folder_files("templates")["template.gsheet"]),
+        exports=GFolder(key="exports"),
+        tables=[
+            Table(
+                name="numbers",
+                sheet=Sheet(
+                    name="Report", box=CellBox(header_row=2, start_row=3)
+                ),
+            ),
+            Table(name="extra", sheet=Sheet(name="Extra")),
+        ],
+    )
+
+    def sheets():
+        with open(os.path.join(root, "exports", "report_.gsheet")) as f:
+            return {s["title"]: s for s in json.load(f)["sheets"]}
+
+    # A copy that may have gone through isn't repeated, one that was
+    # rate limited is
+    gspread_client.fail_next("copy", status=503)
+    with pytest.raises(Exception):
+        etl._load_tables(loader)
+    assert gspread_client.calls["copy"] == 1
+    gspread_client.fail_next("copy", status=429)
+    etl._load_tables(loader)
+    assert gspread_client.calls["copy"] == 3
+    report = sheets()["Report"]
+    assert report["values"][:5] == [
+        ["Monthly report"],
+        [],
+        ["n", "flag", ""],
+        [0, "", ""],
+        [1, True],
+    ]
+    assert len(report["values"]) == report["rows"] == 43
+    assert sheets()["Extra"]["values"] == [["letter"], ["a"]]
+    assert gspread_client.calls["batch_update"] == 1
+    assert gspread_client.calls["values_update"] >= 5
+    assert max(gspread_client.payload_bytes[1:]) < 300
+    assert etl.metrics.tables["numbers"]["out"] == 40
+
+    etl._db_conn.execute("DELETE FROM numbers WHERE n >= 5;")
+    key = drive.folder_files("exports")["report_.gsheet"]
+    etl._load_tables(loader.model_copy(update={"target": GFile(key=key)}))
+    report = sheets()["Report"]
+    assert report["values"][2:] == [
+        ["n", "flag", ""],
+        [0, "", ""],
+        [1, True],
+        [2, ""],
+        [3, True],
+        [4, ""],
+    ]
+    assert report["rows"] == 8
+    assert list(drive.folder_files("exports")) == ["report_.gsheet"]
+    assert gspread_client.calls["copy"] == 3
+    assert "create" not in gspread_client.calls
+    etl._close_db()
+
+
+def test_gsheet_loader_gives_unnamed_tables_own_sheets(tmp_path):
+    root = str(tmp_path / "drive")
+    os.makedirs(os.path.join(root, "exports"))
+    drive = FakeDrive(root)
+    etl = DriveETL()
+    etl.drive = drive
+    etl.gspread_client = FakeGspreadClient(drive)
+    etl._db_conn = sqlite3.connect(":memory:")
+    etl._db_conn.execute("CREATE TABLE a AS SELECT 1 AS x, 2 AS y;")
+    etl._db_conn.execute("CREATE TABLE b AS SELECT 'b' AS z;")
+    loader = Loader(
+        name="report",
+        extension="gsheet",
+        exports=GFolder(key="exports"),
+        tables=[Table(name="a"), Table(name="b")],
+    )
+    etl._load_tables(loader)
+    with open(os.path.join(root, "exports", "report_.gsheet")) as f:
+        sheets = {s["title"]: s["values"] for s in json.load(f)["sheets"]}
+    assert sheets == {"Sheet1": [["x", "y"], [1, 2]], "b": [["z"], ["b"]]}
+
+    tables = [Table(name=n, sheet=Sheet(name="Data")) for n in ["a", "b"]]
+    with pytest.raises(ValueError, match="two tables into sheet Data"):
+        etl._load_tables(loader.model_copy(update={"tables": tables}))
+    etl._close_db()
@@ -1,6 +1,39 @@
+import subprocess
+import sys
+from typing import Dict
+
 import gskeleton
 from gskeleton.drive_etl import DriveETL
 
+HEAVY_MODULES = [
+    "pandas",
+    "gspread",
+    "pydrive2",
+    "oauth2client",
+    "googleapiclient",
+    "yaml",
+]
+
+
+def import_times(statement: str) -> Dict[str, int]:
+    # Cumulative microseconds per top-level module, from -X importtime
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        package = name.strip().split(".")[0]
+        times[package] = max(times.get(package, 0), int(cumulative))
+    return times
+
 
 def test_gskeleton(mocker):
     mock_service_auth = mocker.patch(
@@ -10,3 +43,19 @@ def test_gskeleton(mocker):
     gs = gskeleton.authorize(test_path)
     assert isinstance(gs, DriveETL)
     assert mock_service_auth.call_args[0][0] == test_path
+    assert gskeleton.DriveETL is DriveETL
+
+
+def test_import_time():
+    times = import_times("import gskeleton")
+    assert "gskeleton" in times
+    assert not set(times) & set(HEAVY_MODULES + ["pydantic"])
+
+    times = import_times(
+        "from gskeleton.models import ETLConfig; ETLConfig(workers=2)"
+    )
+    assert "pydantic" in times
+    assert not set(times) & set(HEAVY_MODULES)
+
+    times = import_times("from gskeleton import DriveETL")
+    assert set(HEAVY_MODULES) <= set(times)
@@ -0,0 +1,33 @@
+import pytest
+
+from gskeleton.metrics import RunMetrics
+
+
+def test_run_metrics_report():
+    metrics = RunMetrics()
+    with metrics.stage("extractor", name="users"):
+        metrics.incr("drive.list")
+        metrics.incr("bytes_downloaded", 100)
+        metrics.incr("bytes_downloaded", 50)
+    with pytest.raises(ValueError):
+        with metrics.stage("transformer", index=0):
+            raise ValueError("bad sql")
+    metrics.add_rows("users", rows_in=10)
+    metrics.add_rows("users", rows_out=4)
+    metrics.add_coercion_failures("users", "age", 2, ["x", "y"])
+    metrics.add_coercion_failures("users", "age", 1, ["z"])
+    report = metrics.report(status="ok")
+    assert report["status"] == "ok"
+    assert report["counters"] == {"drive.list": 1, "bytes_downloaded": 150}
+    assert report["tables"] == {"users": {"in": 10, "out": 4}}
+    assert report["coercion_failures"] == {
+        "users": {"age": {"rows": 3, "examples": ["x", "y", "z"]}}
+    }
+    assert [s["stage"] for s in report["stages"]] == [
+        "extractor",
+        "transformer",
+    ]
+    assert report["stages"][0]["name"] == "users"
+    assert report["stages"][0]["status"] == "ok"
+    assert report["stages"][1]["status"] == "failed"
+    assert report["peak_rss_bytes"] > 0
@@ -0,0 +1,87 @@
+from gskeleton.planner import plan_units, statement_tables
+
+
+def test_statement_tables():
+    assert statement_tables(
+        """CREATE TABLE a AS SELECT * FROM b AS bb
+        JOIN "C c" ON 1 LEFT JOIN main.d ON 1
+        WHERE f IN (SELECT 1 FROM g, h) -- FROM comment"""
+    ) == ({"b", "c c", "d", "g", "h"}, {"a"})
+    assert statement_tables(
+        """WITH x AS (SELECT * FROM y), z AS NOT MATERIALIZED (SELECT 1)
+        INSERT INTO t (a) SELECT * FROM x, z, w"""
+    ) == ({"y", "w"}, {"t"})
+    assert statement_tables("DELETE FROM t WHERE a = 'FROM u'") == (
+        set(),
+        {"t"},
+    )
+    assert statement_tables(
+        "UPDATE OR IGNORE t SET a = (SELECT b FROM u)"
+    ) == ({"u"}, {"t"})
+    assert statement_tables("ALTER TABLE t RENAME TO u") == (set(), {"t", "u"})
+    assert statement_tables("DROP VIEW IF EXISTS v") == (set(), {"v"})
+    assert statement_tables("CREATE INDEX i ON t (a)") == (set(), {"t"})
+    assert statement_tables(
+        "CREATE TRIGGER tr AFTER UPDATE OF a ON t BEGIN SELECT 1; END"
+    ) == (set(), {"t"})
+
+
+def test_plan_units():
+    units = plan_units(
+        [
+            "DROP TABLE IF EXISTS x",
+            "CREATE TABLE x AS SELECT * FROM a",
+            "CREATE TABLE y AS SELECT * FROM b",
+            "INSERT INTO x SELECT * FROM b",
+            "CREATE TABLE z AS SELECT * FROM x JOIN y",
+            "CREATE TABLE w AS SELECT * FROM x",
+            "INSERT INTO x SELECT * FROM w",
+            "CREATE INDEX iz ON z (a)",
+            "DROP TABLE IF EXISTS cats",
+            "CREATE TABLE cats AS SELECT * FROM a",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_cats ON cats (category)",
+            "SELECT COUNT(*) FROM cats",
+        ]
+    )
+    assert [(u.name, u.statements, u.memoize) for u in units] == [
+        ("x", [0, 1, 3, 6], False),
+        ("y", [2], True),
+        ("z", [4, 7], False),
+        ("w", [5], False),
+        ("cats", [8, 9, 10], True),
+        ("#11", [11], False),
+    ]
+    assert units[0].reads == {"a", "b", "w"}
+    assert units[2].upstream == ["x", "y"]
+
+
+def test_plan_units_memoizes_only_rebuilt_deterministic_units():
+    units = plan_units(
+        [
+            "INSERT INTO log SELECT * FROM a",
+            "UPDATE counter SET n = n + 1",
+            "DELETE FROM t",
+            "INSERT INTO t SELECT * FROM a",
+            "DELETE FROM u WHERE a > 1",
+            "INSERT INTO u SELECT * FROM a",
+            "CREATE TABLE IF NOT EXISTS v AS SELECT * FROM a",
+            "CREATE TABLE d AS SELECT date('now') AS d",
+            "CREATE TABLE r AS SELECT random() AS r",
+            "CREATE TABLE c AS SELECT CURRENT_TIMESTAMP AS c",
+            "CREATE TABLE s AS SELECT random, 'now()' FROM a",
+            "CREATE TABLE f AS SELECT roll(6) AS f",
+        ],
+        volatile_functions=["roll"],
+    )
+    assert [(u.name, u.memoize) for u in units] == [
+        ("log", False),
+        ("counter", False),
+        ("t", True),
+        ("u", False),
+        ("v", False),
+        ("d", False),
+        ("r", False),
+        ("c", False),
+        ("s", True),
+        ("f", False),
+    ]
@@ -0,0 +1,105 @@
+import socket
+import sqlite3
+import time
+
+import httplib2
+import pytest
+import requests
+
+from gskeleton.drive_etl import (
+    DriveETL,
+    ETLConfig,
+    Extractor,
+    GFileSelector,
+    GFolder,
+    Sheet,
+    Table,
+)
+from gskeleton.fakes import FakeDrive, FakeGspreadClient, generate_inputs
+from gskeleton.throttle import Scheduler, TokenBucket, is_retryable
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, burst=1)
+    start = time.monotonic()
+    waits = [bucket.acquire() for _ in range(6)]
+    assert time.monotonic() - start >= 0.045
+    assert waits[0] == 0
+    bucket.slow_down()
+    assert bucket.rate == 50
+    bucket.speed_up()
+    assert bucket.rate == 60
+
+
+def test_scheduler_retries_retryable_errors(mocker, tmp_path):
+    sleep = mocker.patch("gskeleton.throttle.time.sleep")
+    drive = FakeDrive(str(tmp_path))
+    events = []
+    scheduler = Scheduler(max_retries=3, on_event=events.append)
+    attempts = []
+
+    def flaky(status, failures):
+        attempts.append(status)
+        if len(attempts) <= failures:
+            raise drive._error(status)
+        return "ok"
+
+    assert scheduler.call("drive", flaky, 429, 2) == "ok"
+    assert events == ["drive.retried", "drive.retried"]
+    assert sleep.call_count == 2
+    assert all(0 <= c[0][0] <= 2 for c in sleep.call_args_list)
+
+    attempts.clear()
+    with pytest.raises(Exception) as error:
+        scheduler.call("drive", flaky, 404, 1)
+    assert len(attempts) == 1
+    assert not is_retryable(error.value)
+
+    attempts.clear()
+    with pytest.raises(Exception):
+        scheduler.call("drive", flaky, 503, 10)
+    assert len(attempts) == 4
+    assert is_retryable(ConnectionError("reset"))
+    assert is_retryable(socket.timeout("timed out"))
+    assert is_retryable(httplib2.ServerNotFoundError("no dns"))
+    assert is_retryable(requests.Timeout("read timeout"))
+    assert not is_retryable(FileNotFoundError("missing.csv"))
+    assert not is_retryable(PermissionError("denied"))
+
+    attempts.clear()
+    with pytest.raises(Exception):
+        scheduler.call_nonidempotent("sheets", flaky, 503, 1)
+    assert len(attempts) == 1
+    attempts.clear()
+    assert scheduler.call_nonidempotent("sheets", flaky, 429, 1) == "ok"
+    assert len(attempts) == 2
+    assert not is_retryable(ConnectionError("reset"), idempotent=False)
+
+
+def test_extraction_survives_rate_limit_errors(mocker, tmp_path):
+    mocker.patch("gskeleton.throttle.time.sleep")
+    root = str(tmp_path / "drive")
+    generate_inputs(root, "inputs", files=3, rows=10, cols=4)
+    drive = FakeDrive(root)
+    gspread_client = FakeGspreadClient(drive)
+    drive.fail_next("list", times=2)
+    gspread_client.fail_next("open")
+    gspread_client.fail_next("values", status=503)
+    etl = DriveETL(rate_limits={"sheets": 1000})
+    etl.drive = drive
+    etl.gspread_client = gspread_client
+    etl.config = ETLConfig(workers=2)
+    etl._db_conn = sqlite3.connect(":memory:")
+    extractor = Extractor(
+        name="inputs",
+        inputs=GFileSelector(
+            folder=GFolder(key="inputs"), extension="gsheet"
+        ),
+        tables=[Table(name="records", sheet=Sheet(name="Data"))],
+    )
+    etl._extract_tables(extractor)
+    count = etl._db_conn.execute("SELECT COUNT(*) FROM records;").fetchone()
+    assert count == (30,)
+    assert etl.metrics.counters["drive.retried"] == 2
+    assert etl.metrics.counters["sheets.retried"] == 2
+    etl._close_db()
@@ -0,0 +1,90 @@
+import hashlib
+import sqlite3
+
+import pytest
+
+from gskeleton.drive_etl import DriveETL, ETLConfig, Function
+from gskeleton.udfs import fastHash, import_target, intHash, register_udfs
+
+
+class Concat:
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        self.values.append(str(value))
+
+    def finalize(self):
+        return ",".join(self.values)
+
+
+def query(conn, sql, *params):
+    return conn.execute(sql, params).fetchall()
+
+
+def test_int_hash_is_unchanged():
+    for s in ["", "abc", "ünïcode"]:
+        digest = hashlib.sha256(s.encode("utf-8")).hexdigest()
+        assert intHash(s) == int(digest, 16) % 10 ** 12
+
+
+def test_fast_hash_is_stable():
+    assert fastHash("abc") == fastHash("abc")
+    assert fastHash("abc") != fastHash("abd")
+    assert -(2 ** 63) <= fastHash("abc") < 2 ** 63
+    assert fastHash(None) is None
+
+
+def test_regexp_functions():
+    conn = sqlite3.connect(":memory:")
+    register_udfs(conn)
+    conn.execute("CREATE TABLE t (v TEXT);")
+    conn.executemany(
+        "INSERT INTO t VALUES (?);", [("a-1",), ("b-22",), (None,), (3,)]
+    )
+    assert query(conn, "SELECT v FROM t WHERE v REGEXP '\\d{2}';") == [
+        ("b-22",)
+    ]
+    assert query(conn, "SELECT COUNT(*) FROM t WHERE v REGEXP '^\\d';") == [
+        (1,)
+    ]
+    assert query(
+        conn, "SELECT regexp_extract(v, '-(\\d+)') FROM t ORDER BY rowid;"
+    ) == [("1",), ("22",), (None,), (None,)]
+    assert query(conn, "SELECT regexp_replace('a-1', '\\d', 'x');") == [
+        ("a-x",)
+    ]
+    assert query(conn, "SELECT intHash('abc'), fastHash('abc');") == [
+        (intHash("abc"), fastHash("abc"))
+    ]
+    conn.close()
+
+
+def test_config_functions():
+    etl = DriveETL()
+    etl.config = ETLConfig(
+        functions=[
+            Function(name="sqrt", target="math:sqrt", narg=1),
+            Function(
+                name="concat",
+                target="tests.test_udfs:Concat",
+                narg=1,
+                aggregate=True,
+            ),
+        ]
+    )
+    etl._db_conn = sqlite3.connect(":memory:")
+    register_udfs(etl._db_conn, etl._get_config_udfs())
+    assert query(etl._db_conn, "SELECT sqrt(16);") == [(4.0,)]
+    assert query(
+        etl._db_conn,
+        "SELECT concat(x) FROM (SELECT 'a' AS x UNION ALL SELECT 'b');",
+    ) == [("a,b",)]
+    etl._close_db()
+
+
+def test_import_target_errors():
+    with pytest.raises(ValueError):
+        import_target("math")
+    with pytest.raises(ValueError):
+        import_target("math:nothing")